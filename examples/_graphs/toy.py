@@ -5,6 +5,8 @@ Toy graphs which are created with arbitrary parameters to show some
 functionality of watermelon.
 """
 
+import numpy as np
+
 import watermelon as wm
 
 
@@ -30,38 +32,39 @@ def ex_graph1():
 
 def ex_graph2():
     """Create graph2"""
-    return (
-        wm.Graph()
-        .add_vertices(
-            [
-                wm.Vertex(0),
-                wm.Vertex(1, 10, wm.MaterialDischargeType(10000)),
-                wm.Vertex(2, 5, wm.EVChargerType(50000)),
-                wm.Vertex(3),
-                wm.Vertex(4),
-                wm.Vertex(5),
-                wm.Vertex(6, 10, wm.MaterialLoadType(10000)),
-                wm.Vertex(7, 5, wm.EVChargerType(50000)),
-            ]
-        )
-        .add_edges(
-            [
-                wm.Edge(wm.Vertex(0), wm.Vertex(2), 15000, 8),
-                wm.Edge(wm.Vertex(2), wm.Vertex(3), 5000, 5),
-                wm.Edge(wm.Vertex(3), wm.Vertex(2), 5000, 5),
-                wm.Edge(wm.Vertex(3), wm.Vertex(0), 20000, 10),
-                wm.Edge(wm.Vertex(0), wm.Vertex(3), 20000, 10),
-                wm.Edge(wm.Vertex(3), wm.Vertex(1), 20000, 10),
-                wm.Edge(wm.Vertex(1), wm.Vertex(0), 20000, 10),
-                wm.Edge(wm.Vertex(2), wm.Vertex(4), 40000, 25),
-                wm.Edge(wm.Vertex(4), wm.Vertex(3), 20000, 10),
-                wm.Edge(wm.Vertex(3), wm.Vertex(4), 20000, 10),
-                wm.Edge(wm.Vertex(4), wm.Vertex(5), 20000, 10),
-                wm.Edge(wm.Vertex(5), wm.Vertex(4), 20000, 10),
-                wm.Edge(wm.Vertex(5), wm.Vertex(7), 20000, 10),
-                wm.Edge(wm.Vertex(7), wm.Vertex(5), 20000, 10),
-                wm.Edge(wm.Vertex(7), wm.Vertex(6), 10000, 3),
-                wm.Edge(wm.Vertex(6), wm.Vertex(5), 25000, 15),
-            ]
-        )
+    charger = wm.EVChargerType(50000)
+    return wm.Graph.from_arrays(
+        ids=np.arange(8),
+        types=[
+            None,
+            wm.MaterialDischargeType(10000),
+            charger,
+            None,
+            None,
+            None,
+            wm.MaterialLoadType(10000),
+            charger,
+        ],
+        capacities=[np.nan, 10, 5, np.nan, np.nan, np.nan, 10, 5],
+        origins=[0, 2, 3, 3, 0, 3, 1, 2, 4, 3, 4, 5, 5, 7, 7, 6],
+        targets=[2, 3, 2, 0, 3, 1, 0, 4, 3, 4, 5, 4, 7, 5, 6, 5],
+        weights=[
+            15000,
+            5000,
+            5000,
+            20000,
+            20000,
+            20000,
+            20000,
+            40000,
+            20000,
+            20000,
+            20000,
+            20000,
+            20000,
+            20000,
+            10000,
+            25000,
+        ],
+        times=[8, 5, 5, 10, 10, 10, 10, 25, 10, 10, 10, 10, 10, 10, 3, 15],
     )
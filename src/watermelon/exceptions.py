@@ -20,3 +20,17 @@ class NonExistentEdgeException(Exception):
 
     def __init__(self, origin, target):
         super().__init__(f"Edge {origin}->{target} does not exist")
+
+
+class InvalidGraphException(Exception):
+    """Exception for inconsistent data given to build a graph"""
+
+    def __init__(self, reason):
+        super().__init__(f"Invalid graph: {reason}")
+
+
+class InvalidCheckpointException(Exception):
+    """Exception for a checkpoint that can't be resumed"""
+
+    def __init__(self, reason):
+        super().__init__(f"Invalid checkpoint: {reason}")
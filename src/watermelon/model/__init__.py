@@ -8,6 +8,10 @@ problem that watermelon tries to solve.
 from .agent import *
 from .edge import Edge
 from .graph import Graph, draw_graph
+from .registry import Registry, registry_scope
+from .routing import Route
+from .shared import SharedGraph
+from .storage import load_graph, save_graph
 from .types import *
 from .uncertainty import *
 from .vertex import Vertex
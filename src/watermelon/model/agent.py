@@ -6,16 +6,20 @@ on a vertex.
 """
 
 import abc
+import contextlib
+import contextvars
 import dataclasses
-from typing import Hashable, List, Tuple, Self
+from typing import Dict, Hashable, Iterator, List, Tuple, Self
 
 import numpy as np
 
-from watermelon_common.logger import LOGGER
+from watermelon_common.logger import LOGGER, is_fast_logging
 
 from watermelon.exceptions import ForbiddenActionException
 from watermelon.model import types
 from watermelon.model.graph import Graph
+from watermelon.model.registry import current_registry
+from watermelon.model.routing import _MINUTES_PER_HOUR, Route
 from watermelon.model.uncertainty import NoUncertainty, UncertaintySource
 from watermelon.model.vertex import Vertex
 from watermelon.defaults import (
@@ -26,9 +30,6 @@ from watermelon.defaults import (
 )
 
 
-_MINUTES_PER_HOUR = 60
-
-
 class VertexAction(abc.ABC):
     """Type of action"""
 
@@ -139,17 +140,70 @@ class AgentState:
         return dataclasses.replace(self)
 
 
+# States and plans that are owned by the simulation running in the current
+# context
+_BOUND_STATES = contextvars.ContextVar("agent_states", default=None)
+_BOUND_PLANS = contextvars.ContextVar("agent_plans", default=None)
+
+
+@contextlib.contextmanager
+def bind_states(
+    states: Dict["Agent", AgentState],
+    plans: Dict["Agent", List[Decision]] = None,
+) -> Iterator[None]:
+    """Make agents use the given states within the current context.
+
+    While bound, `Agent.state` returns the state given for the agent
+    instead of its own one, and the same goes for `Agent.actions` if plans
+    are given. The binding is local to the current context, so many
+    simulations can run in different threads or asyncio tasks without
+    sharing the state of their agents.
+
+    Parameters
+    ----------
+    states : dict of watermelon.model.Agent to watermelon.model.AgentState
+        State of each agent
+    plans : dict of watermelon.model.Agent to list of Decision, optional
+        Actions of each agent, by default None. If None, agents use their
+        own actions.
+    """
+    states_token = _BOUND_STATES.set(states)
+    plans_token = _BOUND_PLANS.set(plans)
+    try:
+        yield
+    finally:
+        _BOUND_PLANS.reset(plans_token)
+        _BOUND_STATES.reset(states_token)
+
+
+def route_decisions(route: Route) -> List[Decision]:
+    """Turn a route into the decisions an agent takes to follow it
+
+    The agent charges with a `ChargeBatteryAction` on the vertices where the
+    route charges, and does nothing on the rest.
+    """
+    return [
+        Decision(v, ChargeBatteryAction(route.charge_limit, route.battery_eff))
+        if charges
+        else Decision(v, NullAction())
+        for v, charges in zip(route.vertices, route.charges)
+    ]
+
+
 class AgentMetaClass(type):
-    """Metaclass to allow Agent singletons, defined by their identifier"""
+    """Metaclass to allow Agent singletons, defined by their identifier.
 
-    _instances = {}
+    The singletons are unique within the registry of the current scope.
+    """
 
     def __call__(cls, identifier: Hashable, *args, **kwargs) -> None:
+        instances = current_registry().table(AgentMetaClass)
         id_hash = hash(identifier)
-        if id_hash not in cls._instances:
+        instance = instances.get(id_hash)
+        if instance is None:
             instance = super().__call__(identifier, *args, **kwargs)
-            cls._instances[id_hash] = instance
-        return cls._instances[id_hash]
+            instances[id_hash] = instance
+        return instance
 
 
 class Agent(metaclass=AgentMetaClass):
@@ -172,7 +226,7 @@ class Agent(metaclass=AgentMetaClass):
         self.battery_capacity = battery_capacity
         self.material_capacity = material_capacity
         self.uncertainty = NoUncertainty() if uncertainty is None else uncertainty
-        self.state = AgentState() if initial_state is None else initial_state
+        self._state = AgentState() if initial_state is None else initial_state
         self.actions = [] if actions is None else actions
 
     def __hash__(self) -> None:
@@ -202,6 +256,52 @@ class Agent(metaclass=AgentMetaClass):
         """Hash of the unique ID of the agent."""
         return self._id_hash
 
+    @property
+    def state(self) -> AgentState:
+        """Current state of the agent.
+
+        Inside a simulation this is the state that the simulation owns for
+        this agent, and otherwise it is the state of the agent itself, which
+        simulations use as their initial state.
+        """
+        states = _BOUND_STATES.get()
+        if states is not None:
+            state = states.get(self)
+            if state is not None:
+                return state
+        return self._state
+
+    @state.setter
+    def state(self, val: AgentState) -> None:
+        states = _BOUND_STATES.get()
+        if states is not None and self in states:
+            states[self] = val
+        else:
+            self._state = val
+
+    @property
+    def actions(self) -> List[Decision]:
+        """Decisions that the agent takes.
+
+        Like the state, inside a simulation these are the decisions that
+        the simulation holds for this agent, which may differ from the ones
+        of the agent itself in a branch of the simulation.
+        """
+        plans = _BOUND_PLANS.get()
+        if plans is not None:
+            plan = plans.get(self)
+            if plan is not None:
+                return plan
+        return self._actions
+
+    @actions.setter
+    def actions(self, val: List[Decision]) -> None:
+        plans = _BOUND_PLANS.get()
+        if plans is not None and self in plans:
+            plans[self] = val
+        else:
+            self._actions = val
+
     def energy_as_soc(
         self, energy: float, battery_efficiency: float = BATTERY_EFFICIENCY
     ) -> float:
@@ -344,14 +444,15 @@ class LoadMaterialAction(VertexAction):
         leakage_energy = LEAKAGE_POWER * time / _MINUTES_PER_HOUR
         action_energy = 0
         energy = leakage_energy + action_energy
-        LOGGER.info(
-            "%s Loading %.0f kg (%.0f Wh, %.0f minutes) at %s",
-            agent,
-            material,
-            energy,
-            time,
-            vertex,
-        )
+        if not is_fast_logging():
+            LOGGER.info(
+                "%s Loading %.0f kg (%.0f Wh, %.0f minutes) at %s",
+                agent,
+                material,
+                energy,
+                time,
+                vertex,
+            )
         return time, -energy
 
 
@@ -392,12 +493,13 @@ class DischargeMaterialAction(VertexAction):
         leakage_energy = LEAKAGE_POWER * time / _MINUTES_PER_HOUR
         action_energy = 0
         energy = leakage_energy + action_energy
-        LOGGER.info(
-            "%s Discharging %.0f kg (%.0f Wh, %.0f minutes) at %s",
-            agent,
-            material,
-            energy,
-            time,
-            vertex,
-        )
+        if not is_fast_logging():
+            LOGGER.info(
+                "%s Discharging %.0f kg (%.0f Wh, %.0f minutes) at %s",
+                agent,
+                material,
+                energy,
+                time,
+                vertex,
+            )
         return time, -energy
@@ -4,26 +4,97 @@ watermelon.model.graph
 Modelling of the graph that represents the environment.
 """
 
+import dataclasses
 from typing import Callable, Hashable, List, Self
 
 import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
 import pandas as pd
+from numpy.typing import ArrayLike
 
 from watermelon_common.logger import LOGGER
 from watermelon.model.edge import Edge
+from watermelon.model.paths import ShortestPaths
+from watermelon.model.registry import current_registry
+from watermelon.model.routing import Route, fastest_route
+from watermelon.model.types import EmptyVertexType
 from watermelon.model.vertex import Vertex
-from watermelon.exceptions import NonExistentEdgeException
+from watermelon.exceptions import InvalidGraphException, NonExistentEdgeException
+
+
+@dataclasses.dataclass(frozen=True)
+class CSRAdjacency:
+    """Edges of a graph stored as compressed sparse rows.
+
+    The edges that leave the vertex with index `i` are stored in the
+    positions `offsets[i]:offsets[i + 1]` of the other arrays, sorted by
+    the index of their target. Missing weights or times are stored as
+    NaN.
+    """
+
+    offsets: np.ndarray
+    targets: np.ndarray
+    weights: np.ndarray
+    times: np.ndarray
+
+    @property
+    def origins(self) -> np.ndarray:
+        """Index of the origin of every edge"""
+        return np.repeat(
+            np.arange(len(self.offsets) - 1, dtype=np.int64), np.diff(self.offsets)
+        )
+
+
+def _edge_values(values: ArrayLike, size: int) -> np.ndarray:
+    if values is None:
+        return np.full(size, np.nan)
+    # Parse None values as NaN
+    return pd.Series(values, dtype=np.float64).to_numpy()
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def _as_value(value: float) -> float:
+    value = float(value)
+    # NaN marks a missing value
+    return None if value != value else value
 
 
 class Graph:
-    """Data structure for an abstract graph"""
+    """Data structure for an abstract graph
+
+    Vertices are assigned an integer index in insertion order, and the
+    edges are stored in compressed sparse rows over those indices. Edges
+    that are added one by one are kept in a buffer and merged into the
+    rows the next time the edges are read.
+
+    The graph remembers the registry of the scope where it was created, so
+    `registry_scope(graph.registry)` resolves vertex identifiers to the
+    vertices of this graph.
+    """
 
     def __init__(self, vertices: List[Vertex] = None, edges: List[Edge] = None) -> None:
+        self.registry = current_registry()
         self._verts_id = {}
         self._vertices = set()
-        self._adj_mat = pd.DataFrame()
+        self._vertex_list = []
+        self._index = {}
+
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._targets = np.empty(0, dtype=np.int64)
+        self._weights = np.empty(0, dtype=np.float64)
+        self._times = np.empty(0, dtype=np.float64)
+        self._pending = {}
+        # Origins of the edges sorted by target, with offsets by target like
+        # the rows. Built on demand and dropped whenever the rows change
+        self._in_offsets = None
+        self._in_origins = None
+        self._paths = {"time": ShortestPaths("time"), "weight": ShortestPaths("weight")}
 
         if vertices is not None:
             self.add_vertices(vertices)
@@ -31,11 +102,11 @@ class Graph:
             self.add_edges(edges)
 
     def __repr__(self) -> str:
-        return repr(self._adj_mat)
+        return repr(self.adj_mat)
 
     def __str__(self) -> str:
         return str(
-            self._adj_mat.applymap(lambda e: e.weight if not pd.isnull(e) else "-")
+            self.adj_mat.applymap(lambda e: e.weight if not pd.isnull(e) else "-")
         )
 
     def __getitem__(self, key: Hashable) -> Vertex:
@@ -54,6 +125,9 @@ class Graph:
             return key in self._vertices
         return key in self._verts_id
 
+    def __len__(self) -> int:
+        return len(self._vertex_list)
+
     @property
     def id(self) -> Hashable:
         """IDs of all vertices"""
@@ -67,19 +141,86 @@ class Graph:
     @property
     def edges(self) -> List[Edge]:
         """Edges within the graph"""
-        edges = []
-        axes = self._adj_mat.axes
-        for row in axes[0]:
-            for col in axes[1]:
-                e = self._adj_mat[col][row]
-                if not pd.isnull(e):
-                    edges.append(e.copy())
-        return edges
+        csr = self.csr
+        verts = self._vertex_list
+        return [
+            Edge(verts[i], verts[j], _as_value(w), _as_value(t))
+            for i, j, w, t in zip(
+                csr.origins.tolist(),
+                csr.targets.tolist(),
+                csr.weights.tolist(),
+                csr.times.tolist(),
+            )
+        ]
 
     @property
     def adj_mat(self) -> pd.DataFrame:
-        """Adjacency matrix of the graph, which codifies the edges"""
-        return self._adj_mat.copy()
+        """Adjacency matrix of the graph, which codifies the edges
+
+        The matrix is dense, so it should only be used for small graphs.
+        """
+        csr = self.csr
+        mat = np.full((len(self), len(self)), np.nan, dtype=object)
+        edges = np.empty(len(csr.targets), dtype=object)
+        edges[:] = self.edges
+        mat[csr.origins, csr.targets] = edges
+        return pd.DataFrame(mat, index=self._vertex_list, columns=self._vertex_list)
+
+    @property
+    def csr(self) -> CSRAdjacency:
+        """Edges of the graph in compressed sparse rows"""
+        self._compress()
+        return CSRAdjacency(self._offsets, self._targets, self._weights, self._times)
+
+    @property
+    def num_edges(self) -> int:
+        """Number of edges in the graph"""
+        self._compress()
+        return len(self._targets)
+
+    @property
+    def time_matrix(self) -> np.ndarray:
+        """Shortest time it takes to go between every pair of vertices
+
+        The element (i, j) is the time of the fastest path from the vertex
+        with index i to the one with index j, and it is infinite if there is
+        no such path. Edges without a time can't be traversed. The matrix is
+        computed lazily and cached until the graph changes.
+        """
+        return _read_only(self._paths["time"].matrix(self.csr))
+
+    @property
+    def energy_matrix(self) -> np.ndarray:
+        """Least energy it takes to go between every pair of vertices
+
+        The element (i, j) is the weight of the lightest path from the vertex
+        with index i to the one with index j, and it is infinite if there is
+        no such path. Edges without a weight can't be traversed. The matrix
+        is computed lazily and cached until the graph changes.
+        """
+        return _read_only(self._paths["weight"].matrix(self.csr))
+
+    def travel_time(
+        self, origin: Hashable | Vertex, target: Hashable | Vertex
+    ) -> float:
+        """Shortest time it takes to go from one vertex to another
+
+        Only the paths that start at the origin are computed, so this is
+        cheaper than `time_matrix` when few origins are used.
+        """
+        row = self._paths["time"].row(self.csr, self.index(origin))
+        return float(row[self.index(target)])
+
+    def travel_energy(
+        self, origin: Hashable | Vertex, target: Hashable | Vertex
+    ) -> float:
+        """Least energy it takes to go from one vertex to another
+
+        Only the paths that start at the origin are computed, so this is
+        cheaper than `energy_matrix` when few origins are used.
+        """
+        row = self._paths["weight"].row(self.csr, self.index(origin))
+        return float(row[self.index(target)])
 
     def add_vertex(self, vertex: Hashable | Vertex) -> Self:
         """Add a vertex to the graph
@@ -100,12 +241,20 @@ class Graph:
             parsed_vertex = Vertex(vertex)
 
         LOGGER.debug("Adding vertex %s", parsed_vertex)
-        self._vertices.add(parsed_vertex)
-        self._verts_id[parsed_vertex.hash] = parsed_vertex
-        self._adj_mat[parsed_vertex] = np.nan
-        self._adj_mat.loc[parsed_vertex] = np.nan
+        self._register_vertex(parsed_vertex)
         return self
 
+    def _register_vertex(self, vertex: Vertex) -> None:
+        if vertex.hash not in self._index:
+            self._index[vertex.hash] = len(self._vertex_list)
+            self._vertex_list.append(vertex)
+        else:
+            index = self._index[vertex.hash]
+            self._vertices.discard(self._vertex_list[index])
+            self._vertex_list[index] = vertex
+        self._vertices.add(vertex)
+        self._verts_id[vertex.hash] = vertex
+
     def add_vertices(self, vertices: List[Hashable | Vertex]) -> Self:
         """Add a group of vertices to the graph
 
@@ -118,14 +267,17 @@ class Graph:
         -------
         self
         """
+        vertices = list(vertices)
+        LOGGER.debug("Adding %i vertices", len(vertices))
         for vertex in vertices:
-            self.add_vertex(vertex)
+            self._register_vertex(vertex if isinstance(vertex, Vertex) else Vertex(vertex))
         return self
 
     def add_edge(self, edge: Edge) -> Self:
         """Add an edge to the graph
 
-        If the vertices are not found in the graph, it adds them first
+        If the vertices are not found in the graph, it adds them first. If
+        there already is an edge between the vertices, it is replaced.
 
         Parameters
         ----------
@@ -136,16 +288,7 @@ class Graph:
         -------
         self
         """
-        LOGGER.debug("Adding edge %s", edge)
-        if edge.origin not in self._vertices:
-            LOGGER.warning("Vertex %s was not found. Registering it", edge.origin)
-            self.add_vertex(edge.origin)
-        if edge.target not in self._vertices:
-            LOGGER.warning("Vertex %s was not found. Registering it", edge.target)
-            self.add_vertex(edge.target)
-
-        self._adj_mat.at[edge.origin, edge.target] = edge
-        return self
+        return self.add_edges([edge])
 
     def add_edges(self, edges: List[Edge]) -> Self:
         """Add a group of edges to the graph
@@ -161,10 +304,349 @@ class Graph:
         -------
         self
         """
+        edges = list(edges)
+        LOGGER.debug("Adding %i edges", len(edges))
+
+        # Register every missing vertex at once
+        missing = {}
+        for edge in edges:
+            for vertex in (edge.origin, edge.target):
+                if vertex not in self._vertices:
+                    missing[vertex] = None
+        if missing:
+            LOGGER.warning(
+                "Vertices %s were not found. Registering them",
+                ", ".join(map(str, missing)),
+            )
+            self.add_vertices(missing)
+
+        origins = set()
         for edge in edges:
-            self.add_edge(edge)
+            key = (self._index[edge.origin.hash], self._index[edge.target.hash])
+            self._pending[key] = (
+                np.nan if edge.weight is None else edge.weight,
+                np.nan if edge.time is None else edge.time,
+            )
+            origins.add(key[0])
+        for paths in self._paths.values():
+            paths.invalidate(list(origins))
         return self
 
+    @classmethod
+    def from_arrays(
+        cls,
+        ids: ArrayLike,
+        origins: ArrayLike,
+        targets: ArrayLike,
+        weights: ArrayLike = None,
+        times: ArrayLike = None,
+        *,
+        types: ArrayLike = None,
+        capacities: ArrayLike = None,
+    ) -> Self:
+        """Build a whole graph from arrays of vertices and edges
+
+        Every edge is given by the position `k` in the edge arrays, going
+        from the vertex `origins[k]` to the vertex `targets[k]`. All inputs
+        are validated at once before anything is built.
+
+        Parameters
+        ----------
+        ids : array_like
+            Identifiers of the vertices
+        origins, targets : array_like
+            Identifiers of the origin and target vertex of each edge
+        weights, times : array_like, optional
+            Weight and time of each edge, by default None. Missing values
+            are given by NaN.
+        types : array_like of watermelon.model.VertexType, optional
+            Type of each vertex, by default None. If None, or for the
+            entries which are None, the vertex is empty.
+        capacities : array_like, optional
+            Capacity of each vertex, by default None. If None, or for the
+            entries which are NaN, the capacity is infinite.
+
+        Returns
+        -------
+        watermelon.model.Graph
+
+        Raises
+        ------
+        watermelon.exceptions.InvalidGraphException
+            If the arrays are inconsistent with each other, or if a vertex
+            already exists in the current registry with a different type or
+            capacity. Build the graph inside `registry_scope()` to use new
+            vertices in that case.
+        """
+        ids = pd.Index(np.asarray(ids))
+        num_vertices = len(ids)
+        num_edges = len(origins)
+        weights = _edge_values(weights, num_edges)
+        times = _edge_values(times, num_edges)
+        types = [None] * num_vertices if types is None else list(types)
+        if capacities is None:
+            capacities = np.full(num_vertices, np.nan)
+        capacities = np.asarray(capacities, dtype=np.float64)
+
+        # Validate everything in bulk
+        if len(types) != num_vertices or len(capacities) != num_vertices:
+            raise InvalidGraphException("vertex arrays have different lengths")
+        if not (len(targets) == len(weights) == len(times) == num_edges):
+            raise InvalidGraphException("edge arrays have different lengths")
+        if not ids.is_unique:
+            duplicated = ids[ids.duplicated()].unique().tolist()
+            raise InvalidGraphException(f"duplicated vertices {duplicated}")
+        origin_idx = ids.get_indexer(np.asarray(origins))
+        target_idx = ids.get_indexer(np.asarray(targets))
+        unknown = np.concatenate(
+            [np.asarray(origins)[origin_idx < 0], np.asarray(targets)[target_idx < 0]]
+        )
+        if len(unknown) > 0:
+            raise InvalidGraphException(f"unknown vertices {np.unique(unknown).tolist()}")
+        if np.any(weights < 0) or np.any(times < 0):
+            raise InvalidGraphException("edges can't have negative weights or times")
+
+        origin_idx = origin_idx.astype(np.int64)
+        target_idx = target_idx.astype(np.int64)
+        order = np.lexsort((target_idx, origin_idx))
+        origin_idx = origin_idx[order]
+        target_idx = target_idx[order]
+        repeated = (origin_idx[1:] == origin_idx[:-1]) & (
+            target_idx[1:] == target_idx[:-1]
+        )
+        if np.any(repeated):
+            k = np.flatnonzero(repeated)[0]
+            raise InvalidGraphException(
+                f"duplicated edge {ids[origin_idx[k]]}->{ids[target_idx[k]]}"
+            )
+
+        # Vertices are singletons, so existing ones ignore the given values
+        vertices = [
+            Vertex(i, None if np.isnan(c) else c, t)
+            for i, c, t in zip(ids.tolist(), capacities.tolist(), types)
+        ]
+        types = [EmptyVertexType() if t is None else t for t in types]
+        mismatched = [
+            v.id
+            for v, c, t in zip(vertices, capacities.tolist(), types)
+            if v.capacity != (np.inf if np.isnan(c) else c)
+            or v.type != t
+            or vars(v.type) != vars(t)
+        ]
+        if mismatched:
+            raise InvalidGraphException(
+                f"vertices {mismatched} already exist with other types or capacities"
+            )
+
+        graph = cls()
+        graph.add_vertices(vertices)
+        graph._offsets = np.zeros(num_vertices + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(origin_idx, minlength=num_vertices), out=graph._offsets[1:]
+        )
+        graph._targets = target_idx
+        graph._weights = weights[order]
+        graph._times = times[order]
+        return graph
+
+    @classmethod
+    def from_csr(cls, vertices: List[Vertex], csr: CSRAdjacency) -> Self:
+        """Build a graph from its vertices and its edges in compressed rows
+
+        The arrays are used as they are, without copying or validating them,
+        so they can be read-only views into other memory. If the graph is
+        modified later, new arrays are created.
+
+        Parameters
+        ----------
+        vertices : list of watermelon.model.Vertex
+            Vertices of the graph, in the order of their indices
+        csr : watermelon.model.graph.CSRAdjacency
+            Edges of the graph
+
+        Returns
+        -------
+        watermelon.model.Graph
+        """
+        graph = cls().add_vertices(vertices)
+        graph._offsets = csr.offsets
+        graph._targets = csr.targets
+        graph._weights = csr.weights
+        graph._times = csr.times
+        return graph
+
+    @classmethod
+    def from_networkx(
+        cls,
+        nx_graph: nx.Graph,
+        *,
+        weight: str = "weight",
+        time: str = "time",
+        vertex_type: str = "type",
+        capacity: str = "capacity",
+    ) -> Self:
+        """Build a graph from a networkx graph
+
+        Undirected graphs are converted into a directed graph with edges in
+        both directions.
+
+        Parameters
+        ----------
+        nx_graph : networkx.Graph
+            Graph to convert
+        weight, time : str, optional
+            Edge attributes that hold the weight and time of each edge, by
+            default "weight" and "time"
+        vertex_type, capacity : str, optional
+            Node attributes that hold the type and the capacity of each
+            vertex, by default "type" and "capacity"
+
+        Returns
+        -------
+        watermelon.model.Graph
+        """
+        ids = np.empty(nx_graph.number_of_nodes(), dtype=object)
+        ids[:] = list(nx_graph.nodes)
+        types = [t for _, t in nx_graph.nodes(data=vertex_type)]
+        capacities = [
+            np.nan if c is None else c for _, c in nx_graph.nodes(data=capacity)
+        ]
+
+        edges = list(nx_graph.edges(data=True))
+        if not nx_graph.is_directed():
+            edges += [(v, u, data) for u, v, data in edges if u != v]
+        origins = np.empty(len(edges), dtype=object)
+        targets = np.empty(len(edges), dtype=object)
+        origins[:] = [u for u, _, _ in edges]
+        targets[:] = [v for _, v, _ in edges]
+        weights = [data.get(weight, np.nan) for _, _, data in edges]
+        times = [data.get(time, np.nan) for _, _, data in edges]
+        return cls.from_arrays(
+            ids,
+            origins,
+            targets,
+            weights,
+            times,
+            types=types,
+            capacities=capacities,
+        )
+
+    def to_networkx(self) -> nx.DiGraph:
+        """Convert the graph into a networkx directed graph
+
+        The nodes are the identifiers of the vertices, and they hold the
+        "type" and "capacity" attributes, while the edges hold the "weight"
+        and "time" attributes. Missing values are given by None.
+        """
+        csr = self.csr
+        nx_graph = nx.DiGraph()
+        nx_graph.add_nodes_from(
+            (v.id, {"type": v.type, "capacity": v.capacity}) for v in self._vertex_list
+        )
+        ids = [v.id for v in self._vertex_list]
+        nx_graph.add_edges_from(
+            (ids[i], ids[j], {"weight": _as_value(w), "time": _as_value(t)})
+            for i, j, w, t in zip(
+                csr.origins.tolist(),
+                csr.targets.tolist(),
+                csr.weights.tolist(),
+                csr.times.tolist(),
+            )
+        )
+        return nx_graph
+
+    def _compress(self) -> None:
+        """Merge the pending edges and vertices into the compressed rows"""
+        num_vertices = len(self._vertex_list)
+        if not self._pending and len(self._offsets) == num_vertices + 1:
+            return
+
+        # Pad the offsets for the vertices added since the last compression
+        offsets = np.empty(num_vertices + 1, dtype=np.int64)
+        offsets[: len(self._offsets)] = self._offsets
+        offsets[len(self._offsets) :] = self._offsets[-1]
+        origins = np.repeat(np.arange(num_vertices, dtype=np.int64), np.diff(offsets))
+        targets = self._targets
+        weights = self._weights
+        times = self._times
+
+        if self._pending:
+            keys = np.array(list(self._pending.keys()), dtype=np.int64)
+            values = np.array(list(self._pending.values()), dtype=np.float64)
+            origins = np.concatenate([origins, keys[:, 0]])
+            targets = np.concatenate([targets, keys[:, 1]])
+            weights = np.concatenate([weights, values[:, 0]])
+            times = np.concatenate([times, values[:, 1]])
+
+            # Sort by row and column, keeping the newest edge of duplicates
+            flat = origins * num_vertices + targets
+            order = np.argsort(flat[::-1], kind="stable")
+            order = len(flat) - 1 - order
+            flat = flat[order]
+            keep = np.ones(len(flat), dtype=bool)
+            keep[1:] = flat[1:] != flat[:-1]
+            order = order[keep]
+
+            origins = origins[order]
+            targets = targets[order]
+            weights = weights[order]
+            times = times[order]
+            offsets = np.zeros(num_vertices + 1, dtype=np.int64)
+            np.cumsum(np.bincount(origins, minlength=num_vertices), out=offsets[1:])
+
+        self._offsets = offsets
+        self._targets = targets
+        self._weights = weights
+        self._times = times
+        self._pending = {}
+        self._in_offsets = None
+        self._in_origins = None
+
+    def _compress_incoming(self) -> None:
+        """Index the compressed rows by target, to find the incoming edges"""
+        self._compress()
+        if self._in_offsets is not None:
+            return
+        num_vertices = len(self._vertex_list)
+        origins = np.repeat(
+            np.arange(num_vertices, dtype=np.int64), np.diff(self._offsets)
+        )
+        order = np.argsort(self._targets, kind="stable")
+        in_offsets = np.zeros(num_vertices + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self._targets, minlength=num_vertices), out=in_offsets[1:]
+        )
+        self._in_origins = origins[order]
+        self._in_offsets = in_offsets
+
+    def index(self, vertex: Hashable | Vertex) -> int:
+        """Get the index that the graph assigned to a vertex
+
+        Raises
+        ------
+        KeyError
+            If the vertex is not in the graph
+        """
+        if isinstance(vertex, Vertex):
+            return self._index[vertex.hash]
+        return self._index[hash(vertex)]
+
+    def vertex_at(self, index: int) -> Vertex:
+        """Get the vertex with the given index"""
+        return self._vertex_list[index]
+
+    def edge_position(self, origin: int, target: int) -> int:
+        """Position of an edge in the compressed rows, given the indices of
+        its vertices. If the edge does not exist, returns -1.
+        """
+        self._compress()
+        start = self._offsets[origin]
+        end = self._offsets[origin + 1]
+        pos = start + self._targets[start:end].searchsorted(target)
+        if pos < end and self._targets[pos] == target:
+            return int(pos)
+        return -1
+
     def _parse_vertex(self, vertex_representation: Hashable | Vertex) -> Vertex:
         try:
             if vertex_representation in self._verts_id:
@@ -179,33 +661,56 @@ class Graph:
 
     def get_edge(self, vert1: Hashable | Vertex, vert2: Hashable | Vertex) -> Edge:
         """Get the edge that connects two vertices"""
-        vert1 = self._parse_vertex(vert1)
-        vert2 = self._parse_vertex(vert2)
-        result = self._adj_mat[vert2][vert1]
-        if pd.isnull(result):
+        try:
+            origin = self.index(vert1)
+            target = self.index(vert2)
+        except KeyError as exc:
+            raise NonExistentEdgeException(vert1, vert2) from exc
+        pos = self.edge_position(origin, target)
+        if pos < 0:
             raise NonExistentEdgeException(vert1, vert2)
-        return result
+        return Edge(
+            self._vertex_list[origin],
+            self._vertex_list[target],
+            _as_value(self._weights[pos]),
+            _as_value(self._times[pos]),
+        )
 
     def adjacent(self, vert1: Hashable | Vertex, vert2: Hashable | Vertex) -> bool:
         """Indicate whether two vertices are adjacent"""
-        vert1 = self._parse_vertex(vert1)
-        vert2 = self._parse_vertex(vert2)
-        return not pd.isnull(self.get_edge(vert1, vert2))
+        try:
+            return self.edge_position(self.index(vert1), self.index(vert2)) >= 0
+        except KeyError:
+            return False
 
     def neighbors(self, vertex: Hashable | Vertex) -> List[Vertex]:
         """Get the neighbors of a vertex"""
-        vertex = self._parse_vertex(vertex)
-        return (
-            self._adj_mat[vertex][self._adj_mat[vertex].isna().map(lambda x: not x)]
-            .keys()
-            .to_list()
-        )
+        self._compress_incoming()
+        index = self.index(vertex)
+        start = self._in_offsets[index]
+        end = self._in_offsets[index + 1]
+        return [self._vertex_list[i] for i in self._in_origins[start:end].tolist()]
+
+    def fastest_route(
+        self, origin: Hashable | Vertex, target: Hashable | Vertex, **kwargs
+    ) -> Route | None:
+        """Find the fastest route between two vertices that a vehicle can take
+        without running out of charge, charging on the way if needed.
+
+        All keyword arguments are passed to
+        `watermelon.model.routing.fastest_route`.
+
+        Returns
+        -------
+        watermelon.model.routing.Route or None
+            Fastest feasible route, or None if there is none
+        """
+        return fastest_route(self, origin, target, **kwargs)
 
     def draw(self, axis: plt.Axes = None, pos_fn: Callable = None, **kwargs) -> None:
         """Draw this graph using matplotlib
 
-        It takes the graph, turns it into the convention used by networkx by taking the
-        adjacency matrix first, and then draws it
+        It takes the graph, turns it into a networkx graph first, and then draws it
 
         Parameters
         ----------
@@ -223,8 +728,7 @@ def draw_graph(
 ) -> None:
     """Draw a graph using matplotlib
 
-    It takes the graph, turns it into the convention used by networkx by taking the
-    adjacency matrix first, and then draws it
+    It takes the graph, turns it into a networkx graph first, and then draws it
 
     Parameters
     ----------
@@ -236,25 +740,20 @@ def draw_graph(
     pos_fn : function_, optional
         Function to use to determine the position of the vertices, by default None.
     """
-    # Parse the included graph data structure into the nx adjacency matrix format
-    df = (
-        1 - graph.adj_mat.applymap(lambda e: e.weight if not pd.isnull(e) else e).isna()
-    )
-    df.columns = df.columns.map(lambda c: c.id)
-    df.index = df.index.map(lambda c: c.id)
-    nx_graph = nx.from_pandas_adjacency(df, nx.DiGraph)
+    # Parse the included graph data structure into a nx graph
+    nx_graph = graph.to_networkx()
 
     if pos_fn is not None:
         pos = pos_fn(nx_graph)
     else:
         pos = None
 
+    weights = np.array(
+        [0 if w is None else w for _, _, w in nx_graph.edges(data="weight")]
+    )
+    weights_max = weights.max() if len(weights) > 0 and weights.max() > 0 else 1
     weights = [
-        graph.adj_mat[graph.get_vertex(v)][graph.get_vertex(u)].weight
-        for u, v in nx_graph.edges()
-    ]
-    weights_max = max(weights)
-    weights = [
-        (1 - w / weights_max, 1 - w / weights_max, 1 - w / weights_max) for w in weights
+        (1 - w / weights_max, 1 - w / weights_max, 1 - w / weights_max)
+        for w in weights.tolist()
     ]
     nx.draw_networkx(nx_graph, ax=axis, pos=pos, edge_color=weights, **kwargs)
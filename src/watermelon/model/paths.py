@@ -0,0 +1,150 @@
+"""
+watermelon.model.paths
+----------------------
+Shortest path computations over the compressed rows of a graph.
+"""
+
+import heapq
+from typing import List
+
+import numpy as np
+
+
+# Largest graph for which the full matrix is computed with Floyd-Warshall
+FLOYD_WARSHALL_MAX_VERTICES = 256
+
+
+def edge_costs(csr, attribute: str) -> np.ndarray:
+    """Get the cost of traversing every edge, given the name of the edge
+    attribute ("weight" or "time"). Missing values can't be traversed, so
+    their cost is infinite.
+    """
+    values = csr.weights if attribute == "weight" else csr.times
+    return np.where(np.isnan(values), np.inf, values)
+
+
+def floyd_warshall(csr, costs: np.ndarray) -> np.ndarray:
+    """Compute the cost of the shortest path between every pair of vertices
+
+    Parameters
+    ----------
+    csr : watermelon.model.graph.CSRAdjacency
+        Edges of the graph
+    costs : numpy.ndarray
+        Cost of traversing each edge
+
+    Returns
+    -------
+    numpy.ndarray
+        Matrix where the element (i, j) is the cost of going from the vertex
+        with index i to the one with index j
+    """
+    num_vertices = len(csr.offsets) - 1
+    dist = np.full((num_vertices, num_vertices), np.inf)
+    np.fill_diagonal(dist, 0)
+    np.minimum.at(dist, (csr.origins, csr.targets), costs)
+    for k in range(num_vertices):
+        np.minimum(dist, dist[:, k, None] + dist[None, k, :], out=dist)
+    return dist
+
+
+def dijkstra(csr, costs: np.ndarray, source: int) -> np.ndarray:
+    """Compute the cost of the shortest path from a vertex to every other one
+
+    Costs must not be negative.
+
+    Parameters
+    ----------
+    csr : watermelon.model.graph.CSRAdjacency
+        Edges of the graph
+    costs : numpy.ndarray
+        Cost of traversing each edge
+    source : int
+        Index of the vertex where the paths start
+
+    Returns
+    -------
+    numpy.ndarray
+        Cost of going from the source to every vertex
+    """
+    offsets = csr.offsets.tolist()
+    targets = csr.targets.tolist()
+    costs = costs.tolist()
+    dist = [float("inf")] * (len(offsets) - 1)
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for k in range(offsets[u], offsets[u + 1]):
+            nd = d + costs[k]
+            v = targets[k]
+            if nd < dist[v]:
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return np.array(dist)
+
+
+class ShortestPaths:
+    """Cache of the all-pairs shortest path costs over one edge attribute
+
+    Rows are computed lazily, and only the rows that may have changed are
+    invalidated when an edge is added.
+    """
+
+    def __init__(self, attribute: str) -> None:
+        self.attribute = attribute
+        self._dist = np.empty((0, 0))
+        self._stale = np.empty(0, dtype=bool)
+
+    def invalidate(self, origins: List[int]) -> None:
+        """Invalidate the rows affected by adding or replacing edges that
+        leave the vertices with the given indices.
+
+        Only the paths that start at a vertex from which the origin of an
+        edge is reachable can change.
+        """
+        origins = [i for i in origins if i < len(self._stale)]
+        if origins:
+            self._stale |= np.isfinite(self._dist[:, origins]).any(axis=1)
+            self._stale[origins] = True
+
+    def _resize(self, num_vertices: int) -> None:
+        old = len(self._stale)
+        if old == num_vertices:
+            return
+        # New vertices have no edges, so they are unreachable from old rows
+        dist = np.full((num_vertices, num_vertices), np.inf)
+        dist[:old, :old] = self._dist
+        stale = np.ones(num_vertices, dtype=bool)
+        stale[:old] = self._stale
+        self._dist = dist
+        self._stale = stale
+
+    def row(self, csr, source: int) -> np.ndarray:
+        """Get the shortest path costs from a vertex to every other one"""
+        self._resize(len(csr.offsets) - 1)
+        if self._stale[source]:
+            self._dist[source] = dijkstra(
+                csr, edge_costs(csr, self.attribute), source
+            )
+            self._stale[source] = False
+        return self._dist[source]
+
+    def matrix(self, csr) -> np.ndarray:
+        """Get the shortest path costs between every pair of vertices"""
+        num_vertices = len(csr.offsets) - 1
+        self._resize(num_vertices)
+        if not self._stale.any():
+            return self._dist
+
+        costs = edge_costs(csr, self.attribute)
+        if num_vertices <= FLOYD_WARSHALL_MAX_VERTICES:
+            self._dist = floyd_warshall(csr, costs)
+            self._stale[:] = False
+        else:
+            for source in np.flatnonzero(self._stale).tolist():
+                self._dist[source] = dijkstra(csr, costs, source)
+                self._stale[source] = False
+        return self._dist
@@ -0,0 +1,76 @@
+"""
+watermelon.model.registry
+-------------------------
+Registries of the singleton vertices and agents, which are scoped and
+only hold weak references to their instances.
+"""
+
+import contextlib
+import contextvars
+import weakref
+from typing import Hashable, Iterator
+
+
+class Registry:
+    """Table of the singletons created within a scope
+
+    Instances are stored by kind (the metaclass that creates them) and by
+    the hash of their identifier. Only weak references are held, so an
+    instance is collected as soon as nothing else uses it, e.g. when the
+    graph that held it is collected.
+    """
+
+    def __init__(self) -> None:
+        self._tables = {}
+
+    def table(self, kind: type) -> weakref.WeakValueDictionary:
+        """Get the table of instances of a given kind"""
+        try:
+            return self._tables[kind]
+        except KeyError:
+            return self._tables.setdefault(kind, weakref.WeakValueDictionary())
+
+    def get(self, kind: type, key: Hashable) -> object:
+        """Get an instance, or None if it doesn't exist"""
+        return self.table(kind).get(key)
+
+    def __len__(self) -> int:
+        return sum(len(t) for t in self._tables.values())
+
+
+GLOBAL_REGISTRY = Registry()
+
+_CURRENT_REGISTRY = contextvars.ContextVar("registry", default=GLOBAL_REGISTRY)
+
+
+def current_registry() -> Registry:
+    """Get the registry of the current scope"""
+    return _CURRENT_REGISTRY.get()
+
+
+@contextlib.contextmanager
+def registry_scope(registry: Registry = None) -> Iterator[Registry]:
+    """Open a scope with its own registry of vertices and agents
+
+    Inside the scope, `Vertex(3)` and `Agent(3)` refer to instances that
+    are independent from the ones created outside of it, so independent
+    scenarios can be built in the same process. The scope is bound to the
+    current context, so it is safe to use from threads and asyncio tasks.
+
+    Parameters
+    ----------
+    registry : watermelon.model.registry.Registry, optional
+        Registry to use, by default None. If None, a new one is created.
+        Passing the registry of a previous scope enters it again.
+
+    Yields
+    ------
+    watermelon.model.registry.Registry
+        Registry of the scope
+    """
+    registry = Registry() if registry is None else registry
+    token = _CURRENT_REGISTRY.set(registry)
+    try:
+        yield registry
+    finally:
+        _CURRENT_REGISTRY.reset(token)
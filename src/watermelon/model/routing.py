@@ -0,0 +1,143 @@
+"""
+watermelon.model.routing
+------------------------
+Routing of electric vehicles over a graph, making sure that they never
+run out of charge.
+"""
+
+import dataclasses
+import heapq
+from typing import Hashable, List
+
+from watermelon.model import types
+from watermelon.model.vertex import Vertex
+from watermelon.defaults import BATTERY_CAPACITY, BATTERY_EFFICIENCY
+
+
+_MINUTES_PER_HOUR = 60
+
+
+@dataclasses.dataclass
+class Route:
+    """Path through a graph, indicating where the vehicle charges"""
+
+    vertices: List[Vertex]
+    charges: List[bool]
+    time: float
+    soc: float
+    charge_limit: float
+    battery_eff: float
+
+    def __str__(self) -> str:
+        steps = " -> ".join(
+            f"{str(v)}[c]" if c else str(v) for v, c in zip(self.vertices, self.charges)
+        )
+        return f"{steps} ({self.time:.2f}min, {100 * self.soc:.1f}%)"
+
+
+def fastest_route(
+    graph,
+    origin: Hashable | Vertex,
+    target: Hashable | Vertex,
+    *,
+    soc: float = 1,
+    battery_capacity: float = BATTERY_CAPACITY,
+    battery_eff: float = BATTERY_EFFICIENCY,
+    charge_limit: float = 0.8,
+    min_soc: float = 0,
+) -> Route | None:
+    """Find the fastest route between two vertices that a vehicle can take
+    without running out of charge.
+
+    The route may detour through vertices of type `EVChargerType` to
+    charge the battery up to `charge_limit`, where charging takes the same
+    time as a `ChargeBatteryAction` with that limit. The search is done by
+    label setting with dominance pruning: a partial route is discarded if
+    another one reached the same vertex sooner with at least as much
+    charge.
+
+    Parameters
+    ----------
+    graph : watermelon.model.Graph
+        Graph to route over
+    origin, target : hashable or watermelon.model.Vertex
+        Vertices where the route starts and ends
+    soc : float, optional
+        State of charge at the origin, by default 1
+    battery_capacity : float, optional
+        Capacity of the battery in Wh, by default BATTERY_CAPACITY
+    battery_eff : float, optional
+        Efficiency of the battery, by default BATTERY_EFFICIENCY
+    charge_limit : float, optional
+        State of charge reached when charging, by default 0.8
+    min_soc : float, optional
+        The state of charge must stay above this value, by default 0
+
+    Returns
+    -------
+    watermelon.model.routing.Route or None
+        Fastest feasible route, or None if there is none
+    """
+    csr = graph.csr
+    offsets = csr.offsets.tolist()
+    targets = csr.targets.tolist()
+    times = csr.times.tolist()
+    energy_scale = battery_eff * battery_capacity
+    socs = (csr.weights / energy_scale).tolist()
+    source = graph.index(origin)
+    goal = graph.index(target)
+
+    # Each label is (time, soc, vertex, parent, charged)
+    labels = [(0.0, soc, source, -1, False)]
+    heap = [(0.0, -soc, 0)]
+    best_soc = [None] * len(graph)
+    while heap:
+        time, neg_soc, label = heapq.heappop(heap)
+        soc_u = -neg_soc
+        u = labels[label][2]
+        # Labels are settled by time, so a label is dominated if a previous
+        # one at the same vertex had at least as much charge
+        if best_soc[u] is not None and soc_u <= best_soc[u]:
+            continue
+        best_soc[u] = soc_u
+        if u == goal:
+            return _build_route(graph, labels, label, charge_limit, battery_eff)
+
+        vertex_type = graph.vertex_at(u).type
+        if isinstance(vertex_type, types.EVChargerType) and soc_u < charge_limit:
+            energy = (charge_limit - soc_u) * energy_scale
+            charge_time = _MINUTES_PER_HOUR * energy / vertex_type.charge_power
+            labels.append((time + charge_time, charge_limit, u, label, True))
+            heapq.heappush(heap, (time + charge_time, -charge_limit, len(labels) - 1))
+
+        for k in range(offsets[u], offsets[u + 1]):
+            new_soc = soc_u - socs[k]
+            new_time = time + times[k]
+            # NaN values fail both comparisons, so those edges are skipped
+            if not new_soc > min_soc or not new_time >= time:
+                continue
+            v = targets[k]
+            if best_soc[v] is not None and new_soc <= best_soc[v]:
+                continue
+            labels.append((new_time, new_soc, v, label, False))
+            heapq.heappush(heap, (new_time, -new_soc, len(labels) - 1))
+    return None
+
+
+def _build_route(graph, labels, label, charge_limit, battery_eff) -> Route:
+    time, soc = labels[label][:2]
+    vertices = []
+    charges = []
+    while label >= 0:
+        _, _, vertex, parent, charged = labels[label]
+        if charged:
+            # Charging happens at the vertex of the parent label
+            charges.append(True)
+            label = labels[parent][3]
+        else:
+            charges.append(False)
+            label = parent
+        vertices.append(graph.vertex_at(vertex))
+    vertices.reverse()
+    charges.reverse()
+    return Route(vertices, charges, time, soc, charge_limit, battery_eff)
@@ -0,0 +1,131 @@
+"""
+watermelon.model.shared
+-----------------------
+Graphs published in shared memory, so that worker processes can use them
+without copying.
+"""
+
+from multiprocessing import shared_memory
+from typing import Self
+
+import numpy as np
+
+from watermelon_common.logger import LOGGER
+from watermelon.model.graph import Graph
+from watermelon.model.storage import (
+    decode_graph,
+    encode_graph,
+    encoded_size,
+    write_encoded,
+)
+
+
+class SharedGraph:
+    """Graph stored in a shared memory segment
+
+    The process that creates the segment owns it, and must unlink it once
+    every worker is done. Workers attach to the segment by name, and the
+    graph they get is made of read-only views into the shared memory, so
+    nothing is copied. The segment uses the same layout as the files
+    written by `watermelon.model.save_graph`.
+
+    Pickling a `SharedGraph` only sends the name of the segment, so it can
+    be passed to worker processes as an argument, where it attaches again.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool) -> None:
+        self._shm = shm
+        self._owner = owner
+        self._graph = None
+
+    @classmethod
+    def create(cls, graph: Graph, name: str = None) -> Self:
+        """Publish a graph in a new shared memory segment
+
+        Parameters
+        ----------
+        graph : watermelon.model.Graph
+            Graph to publish
+        name : str, optional
+            Name of the segment, by default None. If None, a unique name is
+            generated.
+
+        Returns
+        -------
+        watermelon.model.shared.SharedGraph
+        """
+        prefix, arrays = encode_graph(graph)
+        shm = shared_memory.SharedMemory(
+            name=name, create=True, size=encoded_size(prefix, arrays)
+        )
+        write_encoded(np.frombuffer(shm.buf, dtype=np.uint8), prefix, arrays)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> Self:
+        """Attach to a graph that another process published
+
+        Parameters
+        ----------
+        name : str
+            Name of the segment
+
+        Returns
+        -------
+        watermelon.model.shared.SharedGraph
+        """
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    def __reduce__(self):
+        return SharedGraph.attach, (self.name,)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+        if self._owner:
+            self.unlink()
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory segment"""
+        return self._shm.name
+
+    @property
+    def graph(self) -> Graph:
+        """Graph stored in the segment, made of read-only views into it
+
+        Like graphs loaded from files, its vertices live in a registry of
+        their own, available as `graph.registry`.
+        """
+        if self._graph is None:
+            buffer = np.frombuffer(self._shm.buf, dtype=np.uint8)
+            buffer.flags.writeable = False
+            self._graph = decode_graph(buffer)
+            # The graph keeps the segment alive, so that its arrays remain
+            # valid even if this object is closed or collected first
+            self._graph._shm = self._shm
+        return self._graph
+
+    def close(self) -> None:
+        """Detach from the segment in this process
+
+        If the graph is still referenced elsewhere, closing is deferred: the
+        segment stays mapped for as long as the graph lives, and at the
+        latest until the process exits.
+        """
+        self._graph = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Arrays of the graph still export the buffer of the segment, so
+            # it can't be unmapped yet. The graph holds the segment, which is
+            # unmapped when both are collected or when the process exits
+            LOGGER.debug("Deferring the close of shared graph %s", self.name)
+
+    def unlink(self) -> None:
+        """Destroy the segment. Only the process that created it can do it"""
+        if not self._owner:
+            raise PermissionError("Only the owner of a shared graph can unlink it")
+        self._shm.unlink()
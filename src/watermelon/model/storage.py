@@ -0,0 +1,227 @@
+"""
+watermelon.model.storage
+------------------------
+Binary format to store graphs, so that they can be loaded without having
+to rebuild them.
+
+The format starts with a magic string and the length of a JSON header,
+followed by the header and by the raw arrays of the graph, each of them
+aligned to 64 bytes. The header holds the format version, the identifiers
+of the vertices, the table of vertex types and the dtype, shape and
+position of every array.
+"""
+
+import json
+import struct
+from typing import Dict, Tuple
+
+import numpy as np
+
+from watermelon.exceptions import InvalidGraphException
+from watermelon.model import types
+from watermelon.model.graph import CSRAdjacency, Graph
+from watermelon.model.registry import registry_scope
+from watermelon.model.vertex import Vertex
+
+
+FORMAT_VERSION = 1
+MAGIC = b"WMGRAPH\x00"
+
+_ALIGNMENT = 64
+_PREFIX = struct.Struct("<8sQ")
+_ARRAYS = ("offsets", "targets", "weights", "times", "capacities", "types")
+
+
+def _align(position: int) -> int:
+    return -(-position // _ALIGNMENT) * _ALIGNMENT
+
+
+def _encode_type(vertex_type: types.VertexType) -> Dict:
+    return {"name": type(vertex_type).__name__, "state": vars(vertex_type)}
+
+
+def _decode_type(data: Dict) -> types.VertexType:
+    vertex_type = getattr(types, data["name"]).__new__(getattr(types, data["name"]))
+    vars(vertex_type).update(data["state"])
+    return vertex_type
+
+
+def _decode_id(vertex_id):
+    # JSON turns tuples into lists, which are not hashable
+    if isinstance(vertex_id, list):
+        return tuple(_decode_id(i) for i in vertex_id)
+    return vertex_id
+
+
+def encode_graph(graph: Graph) -> Tuple[bytes, Dict[str, np.ndarray]]:
+    """Encode a graph into the binary format
+
+    Returns
+    -------
+    prefix : bytes
+        Magic string, header length and header, padded to the alignment
+    arrays : dict of numpy.ndarray
+        Arrays to write after the prefix, each at the position given by the
+        header
+    """
+    csr = graph.csr
+    vertices = [graph.vertex_at(i) for i in range(len(graph))]
+
+    # Vertices point to a table of the distinct types in the graph
+    type_table = {}
+    type_index = []
+    for v in vertices:
+        encoded_type = _encode_type(v.type)
+        type_index.append(
+            type_table.setdefault(json.dumps(encoded_type), len(type_table))
+        )
+    arrays = {
+        "offsets": np.ascontiguousarray(csr.offsets, dtype="<i8"),
+        "targets": np.ascontiguousarray(csr.targets, dtype="<i8"),
+        "weights": np.ascontiguousarray(csr.weights, dtype="<f8"),
+        "times": np.ascontiguousarray(csr.times, dtype="<f8"),
+        "capacities": np.array([v.capacity for v in vertices], dtype="<f8"),
+        "types": np.array(type_index, dtype="<i4"),
+    }
+    header = {
+        "version": FORMAT_VERSION,
+        "vertices": {
+            "ids": [v.id for v in vertices],
+            "types": [json.loads(t) for t in type_table],
+        },
+        "arrays": {},
+    }
+
+    # The positions depend on the header length, so it is encoded until the
+    # positions stop changing
+    header_size = 0
+    while True:
+        position = _align(_PREFIX.size + header_size)
+        for name in _ARRAYS:
+            header["arrays"][name] = {
+                "dtype": arrays[name].dtype.str,
+                "shape": list(arrays[name].shape),
+                "offset": position,
+            }
+            position = _align(position + arrays[name].nbytes)
+        header["size"] = position
+        encoded = json.dumps(header).encode("utf-8")
+        if len(encoded) == header_size:
+            break
+        header_size = len(encoded)
+
+    prefix = _PREFIX.pack(MAGIC, len(encoded)) + encoded
+    return prefix.ljust(_align(len(prefix)), b"\x00"), arrays
+
+
+def encoded_size(prefix: bytes, arrays: Dict[str, np.ndarray]) -> int:
+    """Number of bytes that an encoded graph takes"""
+    return len(prefix) + sum(_align(a.nbytes) for a in arrays.values())
+
+
+def write_encoded(
+    buffer: np.ndarray, prefix: bytes, arrays: Dict[str, np.ndarray]
+) -> None:
+    """Write an encoded graph into a buffer of bytes (numpy.uint8), which
+    must be at least as large as `encoded_size`
+    """
+    buffer[: len(prefix)] = np.frombuffer(prefix, dtype=np.uint8)
+    position = len(prefix)
+    for array in arrays.values():
+        buffer[position : position + array.nbytes] = array.view(np.uint8)
+        position += _align(array.nbytes)
+
+
+def decode_graph(buffer: np.ndarray) -> Graph:
+    """Decode a graph from a buffer in the binary format
+
+    The arrays of the graph are views into the buffer, so nothing is
+    copied. The vertices are created in a registry of their own, which the
+    graph keeps in `graph.registry`, so that they keep the capacities and
+    types that were stored even if vertices with the same identifiers
+    exist in the current scope.
+
+    Parameters
+    ----------
+    buffer : numpy.ndarray
+        Array of bytes (numpy.uint8) holding the encoded graph
+    """
+    magic, header_size = _PREFIX.unpack(buffer[: _PREFIX.size].tobytes())
+    if magic != MAGIC:
+        raise InvalidGraphException("not a watermelon graph file")
+    header = json.loads(
+        buffer[_PREFIX.size : _PREFIX.size + header_size].tobytes().decode("utf-8")
+    )
+    if header["version"] != FORMAT_VERSION:
+        raise InvalidGraphException(
+            f"unsupported format version {header['version']}"
+        )
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        size = dtype.itemsize * int(np.prod(spec["shape"]))
+        start = spec["offset"]
+        arrays[name] = (
+            buffer[start : start + size].view(dtype).reshape(spec["shape"])
+        )
+
+    type_table = [_decode_type(t) for t in header["vertices"]["types"]]
+    csr = CSRAdjacency(
+        arrays["offsets"], arrays["targets"], arrays["weights"], arrays["times"]
+    )
+    with registry_scope():
+        vertices = [
+            Vertex(_decode_id(i), None if np.isinf(c) else c, type_table[t])
+            for i, c, t in zip(
+                header["vertices"]["ids"],
+                arrays["capacities"].tolist(),
+                arrays["types"].tolist(),
+            )
+        ]
+        return Graph.from_csr(vertices, csr)
+
+
+def save_graph(graph: Graph, path: str) -> None:
+    """Save a graph to a file
+
+    The identifiers of the vertices must be serializable as JSON.
+
+    Parameters
+    ----------
+    graph : watermelon.model.Graph
+        Graph to save
+    path : str
+        Path of the file, which is overwritten if it exists
+    """
+    prefix, arrays = encode_graph(graph)
+    with open(path, "wb") as file:
+        file.write(prefix)
+        for array in arrays.values():
+            file.write(array.tobytes())
+            file.write(b"\x00" * (_align(array.nbytes) - array.nbytes))
+
+
+def load_graph(path: str, mmap: bool = True) -> Graph:
+    """Load a graph from a file
+
+    Parameters
+    ----------
+    path : str
+        Path of the file
+    mmap : bool, optional
+        Whether to memory-map the file, by default True. If True, the arrays
+        are read-only views into the file, and its pages are shared by every
+        process that opens it. Otherwise the file is read into memory.
+
+    Returns
+    -------
+    watermelon.model.Graph
+        Graph whose vertices live in their own registry, which can be
+        entered with `registry_scope(graph.registry)`
+    """
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        buffer = np.fromfile(path, dtype=np.uint8)
+    return decode_graph(buffer)
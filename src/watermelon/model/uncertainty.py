@@ -5,15 +5,29 @@ Sources of uncertainty in the model.
 """
 
 import abc
+import copy
+from typing import Dict
 
 import numpy as np
 
 
 class UncertaintySource(abc.ABC):
-    """Abstract source of uncertainty"""
+    """Abstract source of uncertainty
 
+    Every source has its own random stream in `RNG`, which can be seeded
+    when the source is created or later with `seed`, so that its samples
+    don't depend on the rest of the sources.
+    """
+
+    # Stream of the sources that don't have one of their own
     RNG = np.random.default_rng()
 
+    # Attributes left out of `getstate`, which `setstate` rebuilds
+    _TRANSIENT = ("RNG",)
+
+    def __init__(self, seed: int | np.random.SeedSequence = None) -> None:
+        self.RNG = np.random.default_rng(seed)
+
     @property
     @abc.abstractmethod
     def last(self) -> float:
@@ -23,11 +37,143 @@ class UncertaintySource(abc.ABC):
     def sample(self) -> float:
         """Get a sample of the distribution"""
 
+    def sample_array(self, size: int) -> np.ndarray:
+        """Get many samples of the distribution at once
+
+        Parameters
+        ----------
+        size : int
+            Number of samples
+
+        Returns
+        -------
+        numpy.ndarray
+            Samples, in the same order in which `sample` would give them
+        """
+        return np.array([self.sample() for _ in range(size)], dtype=np.float64)
+
+    def seed(self, seed: int | np.random.SeedSequence = None) -> None:
+        """Restart the stream of the source from a seed"""
+        self.RNG = np.random.default_rng(seed)
+
+    def getstate(self) -> Dict:
+        """Capture the state of the source, including its stream"""
+        state = copy.deepcopy(
+            {k: v for k, v in vars(self).items() if k not in self._TRANSIENT}
+        )
+        state["RNG"] = copy.deepcopy(self.RNG.bit_generator.state)
+        return state
+
+    def setstate(self, state: Dict) -> None:
+        """Go back to a state captured by `getstate`"""
+        state = copy.deepcopy(state)
+        self.RNG.bit_generator.state = state.pop("RNG")
+        vars(self).update(state)
+
+
+class BlockUncertainty(UncertaintySource):
+    """Abstract source that draws its samples in blocks
+
+    Drawing a single sample from a generator has a large overhead compared
+    to drawing many of them, so samples are drawn `block_size` at a time
+    into a buffer, from which `sample` and `sample_array` take them.
+    Subclasses implement `_draw`, which draws samples that don't depend on
+    the parameters of the distribution, and `_transform`, which applies the
+    parameters as samples are taken, so that changes to the parameters
+    apply right away.
+
+    Parameters
+    ----------
+    seed : int or numpy.random.SeedSequence, optional
+        Seed of the stream of the source, by default None
+    block_size : int, optional
+        Number of samples drawn at once, by default 4096
+    """
+
+    # The block is drawn again from the stream when the state is restored
+    _TRANSIENT = ("RNG", "_block")
+
+    def __init__(
+        self, seed: int | np.random.SeedSequence = None, block_size: int = 4096
+    ) -> None:
+        super().__init__(seed)
+        self.block_size = block_size
+        self._block = np.empty(0)
+        self._block_state = None
+        self._position = 0
+        self._last_sample = None
+
+    @abc.abstractmethod
+    def _draw(self, size: int) -> np.ndarray:
+        """Draw new samples from `RNG`, before applying the parameters"""
+
+    def _transform(self, values: np.ndarray) -> np.ndarray:
+        """Apply the current parameters of the distribution to drawn samples"""
+        return values
+
+    def _new_block(self, size: int) -> None:
+        """Draw the next block, remembering the stream from before it"""
+        self._block_state = self.RNG.bit_generator.state
+        self._block = self._draw(size)
+
+    @property
+    def last(self) -> float:
+        return self._last_sample
+
+    def sample(self) -> float:
+        if self._position >= len(self._block):
+            self._new_block(self.block_size)
+            self._position = 0
+        value = float(self._transform(self._block[self._position]))
+        self._position += 1
+        self._last_sample = value
+        return value
+
+    def sample_array(self, size: int) -> np.ndarray:
+        available = len(self._block) - self._position
+        if size <= available:
+            values = self._block[self._position : self._position + size].copy()
+            self._position += size
+        else:
+            # The rest of the block is used first, so that the samples are
+            # the same as the ones that `sample` would give
+            missing = size - available
+            rest = self._block[self._position :]
+            self._new_block(-(-missing // self.block_size) * self.block_size)
+            values = np.concatenate((rest, self._block[:missing]))
+            self._position = missing
+        values = self._transform(values)
+        if size > 0:
+            self._last_sample = float(values[-1])
+        return values
+
+    def seed(self, seed: int | np.random.SeedSequence = None) -> None:
+        super().seed(seed)
+        self._block = np.empty(0)
+        self._block_state = None
+        self._position = 0
+
+    def getstate(self) -> Dict:
+        state = super().getstate()
+        state["_block_length"] = len(self._block)
+        return state
+
+    def setstate(self, state: Dict) -> None:
+        state = dict(state)
+        block_length = state.pop("_block_length")
+        super().setstate(state)
+        self._block = np.empty(0)
+        if self._block_state is not None:
+            # Drawing the block again leaves the stream where it was
+            self.RNG.bit_generator.state = self._block_state
+            self._block = self._draw(block_length)
+
 
 class NoUncertainty(UncertaintySource):
     """Model for a deterministic output"""
 
     def __init__(self) -> None:
+        super().__init__()
         self._last_sample = 0
 
     @property
@@ -37,20 +183,39 @@ class NoUncertainty(UncertaintySource):
     def sample(self) -> float:
         return 0
 
-
-class GaussianUncertainty(UncertaintySource):
-    """Model for gaussian uncertainty"""
-
-    def __init__(self, mean: float = 0, std: float = 0.001) -> None:
+    def sample_array(self, size: int) -> np.ndarray:
+        return np.zeros(size)
+
+
+class GaussianUncertainty(BlockUncertainty):
+    """Model for gaussian uncertainty
+
+    Parameters
+    ----------
+    mean : float, optional
+        Mean of the samples, by default 0
+    std : float, optional
+        Standard deviation of the samples, by default 0.001
+    seed : int or numpy.random.SeedSequence, optional
+        Seed of the stream of the source, by default None
+    block_size : int, optional
+        Number of samples drawn at once, by default 4096
+    """
+
+    def __init__(
+        self,
+        mean: float = 0,
+        std: float = 0.001,
+        *,
+        seed: int | np.random.SeedSequence = None,
+        block_size: int = 4096,
+    ) -> None:
+        super().__init__(seed, block_size)
         self.mean = mean
         self.std = std
-        self._last_sample = None
 
-    @property
-    def last(self) -> float:
-        return self._last_sample
+    def _draw(self, size: int) -> np.ndarray:
+        return self.RNG.standard_normal(size)
 
-    def sample(self) -> float:
-        value = self.RNG.normal(self.mean, self.std)
-        self._last_sample = value
-        return value
+    def _transform(self, values: np.ndarray) -> np.ndarray:
+        return self.mean + self.std * values
@@ -6,20 +6,24 @@ Definition of a vertex in the graph.
 
 from typing import Hashable
 
+from watermelon.model.registry import current_registry
 from watermelon.model.types import EmptyVertexType, VertexType
 
 
 class VertexMetaClass(type):
-    """Metaclass to allow Vertex singletons, defined by their identifier"""
+    """Metaclass to allow Vertex singletons, defined by their identifier.
 
-    _instances = {}
+    The singletons are unique within the registry of the current scope.
+    """
 
     def __call__(cls, identifier: Hashable, *args, **kwargs):
+        instances = current_registry().table(VertexMetaClass)
         id_hash = hash(identifier)
-        if id_hash not in cls._instances:
+        instance = instances.get(id_hash)
+        if instance is None:
             instance = super().__call__(identifier, *args, **kwargs)
-            cls._instances[id_hash] = instance
-        return cls._instances[id_hash]
+            instances[id_hash] = instance
+        return instance
 
 
 class Vertex(metaclass=VertexMetaClass):
@@ -35,7 +39,6 @@ class Vertex(metaclass=VertexMetaClass):
         self._id = identifier
         self._id_hash = hash(identifier)
         self.type = EmptyVertexType() if vertex_type is None else vertex_type
-        self.members = set()
         self.capacity = float("inf") if capacity is None else capacity
 
     def __hash__(self) -> int:
@@ -5,5 +5,16 @@ Module that contains the functionality necessary to simulate a given
 problem and environment.
 """
 
+from .analytic import *
+from .batch import *
+from .checkpoint import *
+from .conditions import *
 from .data_extractor import *
+from .montecarlo import *
+from .plan import *
+from .queueing import *
+from .scheduling import *
 from .simulator import *
+from .streaming import *
+from .trace import *
+from .trajectory import *
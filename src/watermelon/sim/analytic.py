@@ -0,0 +1,301 @@
+"""
+watermelon.sim.analytic
+-----------------------
+Closed-form evaluation of deterministic schedules, which computes the
+outcome of every agent straight from its plan when the agents don't
+compete for the vertices, and simulates them otherwise.
+"""
+
+import copy
+import dataclasses
+from typing import List, Sequence
+
+import numpy as np
+
+from watermelon_common.logger import LOGGER
+from watermelon.model import Agent, ChargeBatteryAction, Decision, Graph, NoUncertainty
+from watermelon.model.agent import _MINUTES_PER_HOUR
+from watermelon.sim.data_extractor import SummaryExtractor
+from watermelon.sim.parameters import SimulationControl, SimulationParameters
+from watermelon.sim.plan import CompiledPlans
+from watermelon.sim.simulator import Simulator
+
+
+@dataclasses.dataclass
+class AnalyticResult:
+    """Outcome of every agent of a deterministic run
+
+    Arrays have one entry per agent. Finish times and the times in which
+    the agents ran out of charge are NaN for the agents that didn't.
+    """
+
+    finish_times: np.ndarray
+    out_of_charge: np.ndarray
+    out_of_charge_times: np.ndarray
+    soc: np.ndarray
+    analytic: bool
+
+    @property
+    def finished(self) -> np.ndarray:
+        """Whether each agent finished its plan"""
+        return ~np.isnan(self.finish_times)
+
+
+def _is_fresh(agent: Agent) -> bool:
+    state = agent.state
+    return not (
+        state.current_action
+        or state.action_time
+        or state.is_waiting
+        or state.is_done
+        or state.is_travelling[0]
+        or state.out_of_charge
+    )
+
+
+def _contended(
+    compiled: CompiledPlans, slot: np.ndarray, start: np.ndarray, end: np.ndarray
+) -> bool:
+    """Check whether more agents than allowed may be in a vertex at once"""
+    for s in np.flatnonzero(np.isfinite(compiled.capacity)).tolist():
+        in_slot = slot == s
+        if not in_slot.any():
+            continue
+        starts = np.sort(start[in_slot])
+        ends = np.sort(end[in_slot])
+        # Agents that leave exactly when another one arrives are counted as
+        # members, since the order of simultaneous events is not known here
+        members = np.searchsorted(starts, starts, "right") - np.searchsorted(
+            ends, starts, "left"
+        )
+        if (members > compiled.capacity[s]).any():
+            return True
+    return False
+
+
+def solve_analytic(
+    graph: Graph,
+    agents: List[Agent],
+    plans: Sequence[List[Decision]] = None,
+    *,
+    stop_time: float = None,
+    control: SimulationControl = None,
+    params: SimulationParameters = None,
+    **kwargs,
+) -> AnalyticResult | None:
+    """Compute the outcome of a deterministic run without simulating it
+
+    Without uncertainty, and as long as no vertex has more agents than its
+    capacity, every agent moves on its own, so its times are sums of the
+    times of its travels and actions and its state of charge only changes
+    by the energy of each of them. Charging depends on the state of charge
+    when it starts, so the plans are walked one decision at a time, but
+    every agent is advanced at once with arrays, so the cost is linear in
+    the length of the longest plan.
+
+    The times are exact, with the same rules as the event engine, which
+    the step engine approaches as `control.delta` goes to zero. Once they
+    are known, the stays of the agents in the vertices with a finite
+    capacity are checked, and if they may overlap beyond the capacity the
+    result is discarded.
+
+    Keyword arguments are taken by the control variables or the parameters
+    of the simulation, like in `Simulator`.
+
+    Parameters
+    ----------
+    graph : watermelon.model.Graph
+        Graph where the agents move
+    agents : list of watermelon.model.Agent
+        Agents, which start from their own states
+    plans : sequence of list of watermelon.model.Decision, optional
+        Plan of each agent, by default None. If None, the agents follow
+        their own actions.
+    stop_time : float, optional
+        Time when the run stops, by default None. If None, the stop time of
+        the control variables is used.
+    control : SimulationControl, optional
+        Control variables, by default None
+    params : SimulationParameters, optional
+        Parameters of the simulation, by default None
+
+    Returns
+    -------
+    watermelon.sim.analytic.AnalyticResult or None
+        Outcome of each agent, or None if it can't be computed in closed
+        form: some agent has uncertainty, has already started its plan or
+        takes an action whose cost isn't known beforehand, some travel has
+        no edge, or the agents contend for a vertex.
+    """
+    control = SimulationControl(**kwargs) if control is None else control
+    params = SimulationParameters(**kwargs) if params is None else params
+    stop_time = control.stop_time if stop_time is None else stop_time
+    plans = [list(a.actions) for a in agents] if plans is None else list(plans)
+    if len(plans) != len(agents):
+        raise ValueError("There must be a plan for each agent")
+    if not all(
+        type(a.uncertainty) is NoUncertainty and _is_fresh(a) and p
+        for a, p in zip(agents, plans)
+    ):
+        return None
+
+    compiled = CompiledPlans(graph, agents, plans)
+    if np.isin(compiled.code, (compiled.GENERIC, compiled.FORBIDDEN)).any():
+        return None
+    first = compiled.offsets[:-1]
+    travels = np.ones(len(compiled.vertex), dtype=bool)
+    travels[first] = False
+    travels[1:] &= compiled.vertex[1:] != compiled.vertex[:-1]
+    if np.isnan(compiled.edge_time[travels]).any():
+        return None
+    battery_eff = np.array(
+        [
+            a.battery_eff if type(a) is ChargeBatteryAction else 1
+            for a in compiled.actions
+        ]
+    )
+
+    capacity = np.array([a.battery_capacity for a in agents], dtype=np.float64)
+    scale = params.battery_eff * capacity
+    length = compiled.length
+    now = np.full(len(agents), float(control.time))
+    phase = now.copy()
+    soc = np.array([a.state.soc for a in agents], dtype=np.float64)
+    running = np.ones(len(agents), dtype=bool)
+    finish_times = np.full(len(agents), np.nan)
+    out_of_charge_times = np.full(len(agents), np.nan)
+    stays = []
+
+    for j in range(int(length.max())):
+        k = first + np.minimum(j, length - 1)
+        acting = running & (j < length)
+
+        # Arrival to the vertex of the decision
+        arrival = now + compiled.edge_time[k]
+        travelling = acting & travels[k]
+        arrived = travelling & (arrival <= stop_time)
+        soc = np.where(arrived, soc + -compiled.edge_energy[k] / scale, soc)
+        empty = arrived & (soc <= 0)
+        soc[empty] = 0
+        out_of_charge_times[empty] = arrival[empty]
+        now = np.where(arrived, arrival, now)
+        phase = np.where(arrived, arrival, phase)
+        acting &= ~travelling | arrived & ~empty
+        running &= ~(travelling & ~arrived) & ~empty
+
+        # Action, which starts right away since nobody waits
+        code = compiled.code[k]
+        level = np.clip(soc, 0, 1)
+        limit = compiled.limit[k]
+        charge = (code == compiled.CHARGE) & (level < limit)
+        energy = np.where(
+            charge,
+            (limit - level) * battery_eff[k] * capacity,
+            compiled.action_energy_k[k],
+        )
+        duration = np.where(
+            charge,
+            _MINUTES_PER_HOUR * energy / compiled.power[k],
+            compiled.action_time_k[k],
+        )
+        completion = np.maximum(now, phase + duration)
+        completed = acting & (completion <= stop_time)
+
+        # Agents stay in the vertex from their arrival to the end of their
+        # first action in it, or forever if they run out of charge there
+        stayed = arrived & (acting | empty)
+        stays.append(
+            (
+                compiled.vertex[k][stayed],
+                arrival[stayed],
+                np.where(empty, np.inf, completion)[stayed],
+            )
+        )
+
+        soc = np.where(completed, soc + energy / scale, soc)
+        empty = completed & (soc <= 0)
+        soc[empty] = 0
+        out_of_charge_times[empty] = completion[empty]
+        now = np.where(completed, completion, now)
+        last = completed & (j == length - 1)
+        finish_times[last] = completion[last]
+        running &= ~(acting & ~completed) & ~empty & ~last
+
+    slot, start, end = (np.concatenate(c) for c in zip(*stays))
+    if _contended(compiled, slot, start, end):
+        LOGGER.debug("Agents contend for some vertex, the run must be simulated")
+        return None
+    return AnalyticResult(
+        finish_times=finish_times,
+        out_of_charge=~np.isnan(out_of_charge_times),
+        out_of_charge_times=out_of_charge_times,
+        soc=soc,
+        analytic=True,
+    )
+
+
+def evaluate_schedule(
+    graph: Graph,
+    agents: List[Agent],
+    plans: Sequence[List[Decision]] = None,
+    *,
+    stop_time: float = None,
+    control: SimulationControl = None,
+    params: SimulationParameters = None,
+    engine: str | type = "event",
+    **kwargs,
+) -> AnalyticResult:
+    """Compute the outcome of a run, in closed form when possible
+
+    The run is first solved with `solve_analytic`, and if that is not
+    possible it is simulated with the given engine. With the event engine,
+    both ways give the same results.
+
+    Takes the same arguments as `solve_analytic`, plus the engine used to
+    simulate the runs that can't be solved.
+
+    Parameters
+    ----------
+    engine : str or type, optional
+        Engine of the simulation, by default "event"
+
+    Returns
+    -------
+    watermelon.sim.analytic.AnalyticResult
+        Outcome of each agent
+    """
+    control = SimulationControl(**kwargs) if control is None else control
+    params = SimulationParameters(**kwargs) if params is None else params
+    result = solve_analytic(
+        graph, agents, plans, stop_time=stop_time, control=control, params=params
+    )
+    if result is not None:
+        return result
+
+    sim = Simulator(
+        graph,
+        agents,
+        control=copy.copy(control),
+        params=params,
+        data_extractor_cls=SummaryExtractor,
+        engine=engine,
+    )
+    sim.start(stop_time, plans=None if plans is None else dict(zip(agents, plans)))
+    while not sim.should_close:
+        sim.update()
+
+    summaries = [sim.data_extractor.data[a] for a in agents]
+    return AnalyticResult(
+        finish_times=np.array(
+            [np.nan if s.finish_time is None else s.finish_time for s in summaries]
+        ),
+        out_of_charge=np.array([sim.states[a].out_of_charge for a in agents]),
+        out_of_charge_times=np.array(
+            [
+                np.nan if s.out_of_charge_time is None else s.out_of_charge_time
+                for s in summaries
+            ]
+        ),
+        soc=np.array([sim.states[a].soc for a in agents], dtype=np.float64),
+        analytic=False,
+    )
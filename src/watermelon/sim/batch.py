@@ -0,0 +1,125 @@
+"""
+watermelon.sim.batch
+--------------------
+Simulation of many scenarios at once, e.g. every individual of the
+population of a genetic algorithm.
+"""
+
+import dataclasses
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from watermelon.model import Agent, Decision, Graph, Vertex, VertexAction, bind_states
+from watermelon.sim.parameters import SimulationControl, SimulationParameters
+from watermelon.sim.queueing import AdmissionPolicy
+from watermelon.sim.vector_engine import VectorKernel
+
+
+@dataclasses.dataclass
+class BatchResult:
+    """Outcome of every agent in every scenario of a batch
+
+    Arrays have one row per scenario and one column per agent.
+    """
+
+    finish_times: np.ndarray
+    out_of_charge: np.ndarray
+    soc: np.ndarray
+
+    @property
+    def finished(self) -> np.ndarray:
+        """Whether each agent finished its plan"""
+        return ~np.isnan(self.finish_times)
+
+
+def simulate_batch(
+    graph: Graph,
+    agents: List[Agent],
+    population: Sequence[Sequence[List[Decision]]],
+    *,
+    stop_time: float = None,
+    control: SimulationControl = None,
+    params: SimulationParameters = None,
+    admission: AdmissionPolicy = None,
+    **kwargs,
+) -> BatchResult:
+    """Simulate many sets of decisions for the same agents and graph
+
+    Every scenario is simulated in isolation, with the same rules as the
+    step engine of `Simulator`, but all of them are advanced together: the
+    state of every agent of every scenario is a lane of a `VectorKernel`,
+    and the vertices are occupied separately in each scenario. The
+    simulation stops once every agent is done or out of charge, or when
+    the stop time is reached.
+
+    Keyword arguments are taken by the control variables or the parameters
+    of the simulation, like in `Simulator`.
+
+    Parameters
+    ----------
+    graph : watermelon.model.Graph
+        Graph shared by every scenario
+    agents : list of watermelon.model.Agent
+        Agents of every scenario, which start from their own states
+    population : sequence of sequence of list of watermelon.model.Decision
+        Plan of each agent in each scenario
+    stop_time : float, optional
+        Time when the simulation stops, by default None. If None, the stop
+        time of the control variables is used.
+    control : SimulationControl, optional
+        Control variables, by default None
+    params : SimulationParameters, optional
+        Parameters of the simulation, by default None
+    admission : AdmissionPolicy, optional
+        Order in which the agents that wait for a vertex are let in, by
+        default None. If None, they are let in by their time of arrival.
+
+    Returns
+    -------
+    watermelon.sim.batch.BatchResult
+        Time at which each agent finished (NaN if it didn't), whether it ran
+        out of charge and its final state of charge
+    """
+    control = SimulationControl(**kwargs) if control is None else control
+    params = SimulationParameters(**kwargs) if params is None else params
+    stop_time = control.stop_time if stop_time is None else stop_time
+    num_scenarios = len(population)
+    num_agents = len(agents)
+
+    lane_agents = list(agents) * num_scenarios
+    plans = [list(plan) for scenario in population for plan in scenario]
+    if len(plans) != num_scenarios * num_agents:
+        raise ValueError("Every scenario must have a plan for each agent")
+
+    def act(lane: int, action: VertexAction, vertex: Vertex) -> Tuple[float, float]:
+        agent = lane_agents[lane]
+        with bind_states({agent: kernel.lane_state(lane)}):
+            return action.act(agent, vertex)
+
+    kernel = VectorKernel(
+        graph,
+        lane_agents,
+        plans,
+        [a.state.copy() for a in lane_agents],
+        params.battery_eff,
+        act,
+        groups=np.repeat(np.arange(num_scenarios), num_agents),
+        admission=admission,
+        time=control.time,
+    )
+
+    time = control.time
+    finish_times = np.full(len(plans), np.nan)
+    finish_times[kernel.done] = time
+    while time < stop_time and not (kernel.done | kernel.out_of_charge).all():
+        time += control.delta
+        kernel.step(control.delta)
+        finish_times[kernel.done & np.isnan(finish_times)] = time
+
+    shape = (num_scenarios, num_agents)
+    return BatchResult(
+        finish_times.reshape(shape),
+        kernel.out_of_charge.reshape(shape),
+        kernel.soc.reshape(shape),
+    )
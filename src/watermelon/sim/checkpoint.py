@@ -0,0 +1,392 @@
+"""
+watermelon.sim.checkpoint
+-------------------------
+Checkpoints of simulations on disk, so that long runs can be resumed after
+a crash.
+
+A checkpoint file starts with a magic string and the format version,
+followed by a compressed pickle of the snapshot of the simulation. Agents,
+vertices, graphs, stop conditions and admission policies are stored by
+reference, so they are taken from the scenario in which the checkpoint is
+loaded. The state of the stop conditions is stored apart from them.
+
+The data extracted by the simulation is kept in a log next to the file
+(`<path>.data`). Every checkpoint appends the data extracted since the
+previous one as a record, made of its size and a compressed pickle, and
+stores the size that the log had when it was written.
+"""
+
+import io
+import os
+import pickle
+import struct
+import threading
+import zlib
+from typing import Dict, List
+
+from watermelon_common.logger import LOGGER
+from watermelon.exceptions import InvalidCheckpointException
+from watermelon.model import Agent, Graph, Vertex
+from watermelon.sim.conditions import StopCondition
+from watermelon.sim.queueing import AdmissionPolicy, FIFOAdmission
+
+
+FORMAT_VERSION = 1
+MAGIC = b"WMCKPT\x00\x00"
+
+_PREFIX = struct.Struct("<8sI")
+_RECORD = struct.Struct("<Q")
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(
+        self, file, graph: Graph, stop_conditions: List[StopCondition]
+    ) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._graph = graph
+        self._conditions = {id(c): i for i, c in enumerate(stop_conditions)}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Agent):
+            return "agent", obj.id
+        if isinstance(obj, Vertex):
+            return "vertex", obj.id
+        if obj is self._graph:
+            return "graph", None
+        if isinstance(obj, StopCondition) and id(obj) in self._conditions:
+            return "stop_condition", (self._conditions[id(obj)], type(obj).__name__)
+        if isinstance(obj, AdmissionPolicy):
+            return "admission", type(obj).__name__
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(
+        self,
+        file,
+        graph: Graph,
+        agents: List[Agent],
+        stop_conditions: List[StopCondition],
+        admission: AdmissionPolicy,
+    ) -> None:
+        super().__init__(file)
+        self._graph = graph
+        self._agents = {a.id: a for a in agents}
+        self._conditions = stop_conditions
+        self._admission = admission
+
+    def persistent_load(self, pid):
+        kind, key = pid
+        try:
+            if kind == "agent":
+                return self._agents[key]
+            if kind == "vertex":
+                return self._graph.vertex_at(self._graph.index(key))
+            if kind == "graph":
+                return self._graph
+            if kind == "stop_condition":
+                index, name = key
+                if index >= len(self._conditions):
+                    raise InvalidCheckpointException(
+                        f"the checkpoint has a {name} stop condition in position "
+                        f"{index}, pass the stop conditions of the simulation"
+                    )
+                return _expect(self._conditions[index], name, "stop condition")
+            if kind == "admission":
+                return _expect(self._admission, key, "admission policy")
+        except KeyError as exc:
+            raise InvalidCheckpointException(
+                f"{kind} {repr(key)} is not part of the scenario"
+            ) from exc
+        raise InvalidCheckpointException(f"unknown reference {repr(kind)}")
+
+
+def _expect(obj: object, name: str, kind: str) -> object:
+    """Check that an object given to resume a checkpoint has the class that
+    the checkpoint refers to
+    """
+    if type(obj).__name__ != name:
+        raise InvalidCheckpointException(
+            f"the checkpoint was taken with a {name} {kind}, "
+            f"but {type(obj).__name__} was given"
+        )
+    return obj
+
+
+def _dumps(obj: object, graph: Graph, stop_conditions: List[StopCondition]) -> bytes:
+    buffer = io.BytesIO()
+    _Pickler(buffer, graph, stop_conditions).dump(obj)
+    return zlib.compress(buffer.getvalue(), 1)
+
+
+def _loads(content: bytes, *args) -> object:
+    try:
+        data = zlib.decompress(content)
+    except zlib.error as exc:
+        raise InvalidCheckpointException("the file is corrupted") from exc
+    return _Unpickler(io.BytesIO(data), *args).load()
+
+
+def _data_path(path: str) -> str:
+    return f"{path}.data"
+
+
+def save_checkpoint(
+    state: Dict,
+    path: str,
+    graph: Graph,
+    agents: List[Agent],
+    *,
+    data_size: int = 0,
+) -> int:
+    """Write a checkpoint to a file
+
+    The data extracted since the previous checkpoint, in `state["data"]`,
+    is appended to a log next to the file (`<path>.data`), which is
+    first cut to `data_size` bytes, so every checkpoint of a run only
+    writes the data that is new. Then the rest of the state is written
+    next to the destination and moved over it, so a crash while writing
+    keeps the previous checkpoint.
+
+    Parameters
+    ----------
+    state : dict
+        State of the simulation, as built by `Simulator.checkpoint_state`
+    path : str
+        Path of the file, which is overwritten if it exists
+    graph : watermelon.model.Graph
+        Graph of the simulation
+    agents : list of Agent
+        Agents of the simulation
+    data_size : int, optional
+        Size of the log with the data of the previous checkpoints of the
+        run, as returned when writing the last one, by default 0
+
+    Returns
+    -------
+    int
+        Size of the log with the data of the checkpoints of the run
+    """
+    state = dict(state)
+    with open(_data_path(path), "r+b" if data_size else "wb") as file:
+        file.truncate(data_size)
+        file.seek(data_size)
+        for item in state.pop("data", []):
+            record = _dumps(item, graph, [])
+            file.write(_RECORD.pack(len(record)))
+            file.write(record)
+        file.flush()
+        os.fsync(file.fileno())
+        state["data_size"] = file.tell()
+
+    content = _dumps(state, graph, state["snapshot"].stop_conditions)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION))
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    return state["data_size"]
+
+
+def load_checkpoint(
+    path: str,
+    graph: Graph,
+    agents: List[Agent],
+    *,
+    stop_conditions: List[StopCondition] = None,
+    admission: AdmissionPolicy = None,
+) -> Dict:
+    """Read a checkpoint from a file
+
+    Parameters
+    ----------
+    path : str
+        Path of the file
+    graph : watermelon.model.Graph
+        Graph of the simulation, whose vertices are referenced by the
+        checkpoint
+    agents : list of Agent
+        Agents of the simulation, which are referenced by their identifiers
+    stop_conditions : list of StopCondition, optional
+        Stop conditions of the simulation, in the same order as when the
+        checkpoint was written, by default None
+    admission : AdmissionPolicy, optional
+        Admission policy of the simulation, by default None, which is
+        `FIFOAdmission`
+
+    Returns
+    -------
+    dict
+        State of the simulation, where `state["data"]` holds the data of
+        every checkpoint of the run up to this one, in order
+    """
+    with open(path, "rb") as file:
+        content = file.read()
+    if len(content) < _PREFIX.size:
+        raise InvalidCheckpointException("the file is truncated")
+    magic, version = _PREFIX.unpack(content[: _PREFIX.size])
+    if magic != MAGIC:
+        raise InvalidCheckpointException("not a watermelon checkpoint")
+    if version != FORMAT_VERSION:
+        raise InvalidCheckpointException(f"unsupported format version {version}")
+    conditions = list(stop_conditions or [])
+    admission = FIFOAdmission() if admission is None else admission
+    state = _loads(content[_PREFIX.size :], graph, agents, conditions, admission)
+
+    data_size = state["data_size"]
+    try:
+        with open(_data_path(path), "rb") as file:
+            content = file.read(data_size)
+    except FileNotFoundError:
+        content = b""
+    if len(content) < data_size:
+        raise InvalidCheckpointException("the data of the checkpoint is truncated")
+    state["data"] = []
+    offset = 0
+    while offset < data_size:
+        (size,) = _RECORD.unpack_from(content, offset)
+        offset += _RECORD.size
+        record = content[offset : offset + size]
+        state["data"].append(_loads(record, graph, agents, [], None))
+        offset += size
+    return state
+
+
+class Checkpointer:
+    """Object that writes checkpoints of a simulation periodically
+
+    Every `every` iterations, the state of the simulation is captured and
+    written to `path`, replacing the previous checkpoint. Checkpoints are
+    incremental: the data extractor only hands over the data extracted
+    since the previous checkpoint, which is appended to a log next to the
+    file, so neither capturing nor writing the state of the run grows with
+    its length.
+
+    The serialization and the write happen in a background thread, and
+    the simulation never waits for them. If a checkpoint is captured while
+    the previous one is still being written, the one that was waiting, if
+    any, is dropped in favor of the new one, keeping its data for the log.
+
+    Parameters
+    ----------
+    path : str
+        Path of the checkpoint file
+    every : int, optional
+        Number of iterations between checkpoints, by default 1000
+    background : bool, optional
+        Whether to write the checkpoints from a background thread, by
+        default True
+    """
+
+    def __init__(self, path: str, *, every: int = 1000, background: bool = True):
+        self.path = path
+        self.every = every
+        self.background = background
+        self._last = None
+        self._error = None
+        self._extractor = None
+        self._data_size = 0
+        self._lock = threading.Condition()
+        self._pending = None
+        self._closing = False
+        self._writer = None
+
+    def update(self, sim) -> None:
+        """Write a checkpoint if enough iterations have passed since the
+        last one. The simulator calls it after every update
+        """
+        iteration = sim.control.iteration
+        if self._last is None or iteration < self._last:
+            self._last = iteration
+        if iteration - self._last >= self.every:
+            self.write(sim)
+
+    def write(self, sim) -> None:
+        """Capture the state of the simulation and write it"""
+        if self._error is not None:
+            raise self._error
+        self._last = sim.control.iteration
+        state = sim.checkpoint_state()
+        # A new extractor, from a new run or a restored snapshot, starts the
+        # log of data again
+        restart = sim.data_extractor is not self._extractor
+        self._extractor = sim.data_extractor
+        if not self.background:
+            self._save(state, restart, sim.graph, sim.agents)
+            return
+        with self._lock:
+            if self._pending is not None:
+                stale, stale_restart, *_ = self._pending
+                if not restart:
+                    state["data"] = stale["data"] + state["data"]
+                    restart = stale_restart
+                LOGGER.debug("Dropped a checkpoint that wasn't written yet")
+            self._pending = (state, restart, sim.graph, sim.agents)
+            self._lock.notify()
+        if self._writer is None:
+            self._closing = False
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def resume(self, path: str, data_size: int, extractor) -> None:
+        """Continue writing the checkpoints of a run resumed from the
+        checkpoint in `path`. `Simulator.resume` calls it.
+
+        The log with the data of the checkpoint is cut to `data_size`,
+        dropping the data of checkpoints that were written after it, or
+        copied if this checkpointer writes somewhere else.
+
+        Parameters
+        ----------
+        path : str
+            Path of the checkpoint the run was resumed from
+        data_size : int
+            Size of the log with the data of that checkpoint
+        extractor : SimulationDataExtractor
+            Data extractor of the resumed run
+        """
+        source = _data_path(path)
+        if os.path.abspath(source) == os.path.abspath(_data_path(self.path)):
+            with open(source, "r+b") as file:
+                file.truncate(data_size)
+        else:
+            with open(source, "rb") as file:
+                content = file.read(data_size)
+            with open(_data_path(self.path), "wb") as file:
+                file.write(content)
+        self._data_size = data_size
+        self._extractor = extractor
+
+    def close(self) -> None:
+        """Wait until every checkpoint is written"""
+        if self._writer is not None:
+            with self._lock:
+                self._closing = True
+                self._lock.notify()
+            self._writer.join()
+            self._writer = None
+        if self._error is not None:
+            raise self._error
+
+    def _save(self, state: Dict, restart: bool, graph: Graph, agents) -> None:
+        data_size = 0 if restart else self._data_size
+        self._data_size = save_checkpoint(
+            state, self.path, graph, agents, data_size=data_size
+        )
+        LOGGER.debug("Checkpoint written to %s", self.path)
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._lock:
+                while self._pending is None and not self._closing:
+                    self._lock.wait()
+                if self._pending is None:
+                    return
+                item, self._pending = self._pending, None
+            try:
+                self._save(*item)
+            except Exception as exc:  # pylint: disable=broad-except
+                # The error is raised again from the simulation thread
+                self._error = exc
@@ -0,0 +1,117 @@
+"""
+watermelon.sim.conditions
+-------------------------
+Conditions that make a simulation stop before every agent finishes or the
+stop time is reached.
+"""
+
+import abc
+from typing import Callable
+
+
+class StopCondition(abc.ABC):
+    """Condition that is checked after every update of the simulation
+
+    When a condition holds, the simulation closes and the simulator stores
+    the condition in `Simulator.stopped_by`. Conditions may keep some
+    state, which is cleared when the simulation starts.
+
+    Conditions that don't read the action times of the agents can set
+    `READS_ACTION_TIME` to False, so that the step engine doesn't have to
+    bring them up to date at every step.
+    """
+
+    READS_ACTION_TIME = True
+
+    def __str__(self) -> str:
+        return self.__class__.__name__
+
+    def reset(self) -> None:
+        """Clear the state of the condition before a new run"""
+
+    def getstate(self) -> object:
+        """Capture the state of the condition for a checkpoint, which is
+        stored apart from the condition itself. By default it is None
+        """
+        return None
+
+    def setstate(self, state: object) -> None:
+        """Go back to a state captured by `getstate`"""
+
+    @abc.abstractmethod
+    def __call__(self, sim) -> bool:
+        """Check whether the simulation should stop"""
+
+
+class AnyOutOfCharge(StopCondition):
+    """Stop as soon as some agent runs out of charge"""
+
+    READS_ACTION_TIME = False
+
+    def __call__(self, sim) -> bool:
+        return any(s.out_of_charge for s in sim.context.states.values())
+
+
+class TotalTimeBound(StopCondition):
+    """Stop once the sum of the finish times of the agents is known to be
+    larger than a bound, e.g. the one of the best known solution.
+
+    Agents that haven't finished will do it at least at the current time,
+    so the sum of their finish times is bounded from below.
+
+    Parameters
+    ----------
+    bound : float
+        Largest sum of finish times that is worth simulating
+    """
+
+    READS_ACTION_TIME = False
+
+    def __init__(self, bound: float) -> None:
+        self.bound = bound
+        self._finished = {}
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.bound})"
+
+    def reset(self) -> None:
+        self._finished = {}
+
+    def __copy__(self):
+        other = TotalTimeBound(self.bound)
+        other._finished = dict(self._finished)
+        return other
+
+    def getstate(self) -> object:
+        return dict(self._finished)
+
+    def setstate(self, state: object) -> None:
+        self._finished = dict(state)
+
+    def __call__(self, sim) -> bool:
+        total = 0
+        for agent, state in sim.context.states.items():
+            if state.is_done:
+                total += self._finished.setdefault(agent, sim.time)
+            else:
+                total += sim.time
+        return total > self.bound
+
+
+class Callback(StopCondition):
+    """Stop when a function of the simulator returns True
+
+    Parameters
+    ----------
+    func : callable
+        Function that takes the simulator
+    """
+
+    def __init__(self, func: Callable) -> None:
+        self.func = func
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({getattr(self.func, '__name__', self.func)})"
+
+    def __call__(self, sim) -> bool:
+        return bool(self.func(sim))
@@ -0,0 +1,52 @@
+"""
+watermelon.sim.context
+----------------------
+Mutable state that belongs to a single simulation run.
+"""
+
+import contextlib
+from typing import Dict, Iterator, List, Self
+
+from watermelon.model import Agent, AgentState, Decision, Vertex, bind_states
+from watermelon.sim.queueing import VertexQueue
+
+
+class SimulationContext:
+    """State of the agents and vertices during a simulation.
+
+    Agents and vertices are shared by every simulation that uses them, so
+    everything that a simulation changes while it runs lives here instead:
+    the state of each agent, which starts as a copy of the state of the
+    agent itself, the queue of each vertex with the agents that occupy it
+    and the ones that wait to get in, and the plan of each agent, which
+    starts as its own actions and may be changed in a branch of the
+    simulation.
+    """
+
+    def __init__(self, agents: List[Agent]) -> None:
+        self.states: Dict[Agent, AgentState] = {a: a.state.copy() for a in agents}
+        self.plans: Dict[Agent, List[Decision]] = {a: list(a.actions) for a in agents}
+        self.queues: Dict[Vertex, VertexQueue] = {}
+
+    def copy(self) -> Self:
+        """Create an independent copy of the context"""
+        context = SimulationContext([])
+        context.states = {a: s.copy() for a, s in self.states.items()}
+        context.plans = {a: list(p) for a, p in self.plans.items()}
+        context.queues = {v: q.copy() for v, q in self.queues.items()}
+        return context
+
+    def queue(self, vertex: Vertex) -> VertexQueue:
+        """Queue of a vertex"""
+        try:
+            return self.queues[vertex]
+        except KeyError:
+            return self.queues.setdefault(vertex, VertexQueue(vertex.capacity))
+
+    @contextlib.contextmanager
+    def bound(self) -> Iterator[None]:
+        """Make `Agent.state` and `Agent.actions` refer to the states and
+        plans of this simulation within the current context
+        """
+        with bind_states(self.states, self.plans):
+            yield
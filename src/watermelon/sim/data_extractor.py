@@ -6,7 +6,11 @@ and transforms it into the correct format.
 """
 
 import abc
+import copy
 import dataclasses
+from typing import Dict, List, Self, Tuple
+
+import numpy as np
 import pandas as pd
 
 from watermelon.model.agent import AgentState, Decision
@@ -44,8 +48,41 @@ class DataElement:
         return result
 
 
+@dataclasses.dataclass
+class AgentSummary:
+    """Key figures of an agent over a simulation
+
+    Energies are in Wh and times in minutes. The times at which the agent
+    finished and ran out of charge are None if that never happened.
+    """
+
+    finish_time: float = None
+    out_of_charge_time: float = None
+    energy_used: float = 0
+    energy_charged: float = 0
+    waiting_time: float = 0
+    min_soc: float = 1
+
+    @property
+    def finished(self) -> bool:
+        """Whether the agent finished its actions"""
+        return self.finish_time is not None
+
+    @property
+    def out_of_charge(self) -> bool:
+        """Whether the agent ran out of charge"""
+        return self.out_of_charge_time is not None
+
+
 class SimulationDataExtractor(abc.ABC):
-    """Abstract class for an object that extracts data from a simulation"""
+    """Abstract class for an object that extracts data from a simulation
+
+    Extractors that don't read the action times of the agents can set
+    `READS_ACTION_TIME` to False, so that the step engine only brings them
+    up to date when the simulation closes.
+    """
+
+    READS_ACTION_TIME = True
 
     def __init__(self, simulation_state: SimulationData) -> None:
         self._data = None
@@ -103,6 +140,42 @@ class SimulationDataExtractor(abc.ABC):
         """
         return self._append(self.extract_data(simulation_state))
 
+    def close(self) -> None:
+        """Finish the extraction. The simulator calls it once the simulation
+        closes, and by default it does nothing
+        """
+
+    def copy(self) -> Self:
+        """Create an independent copy of the extractor, which is used to
+        branch a simulation. By default it is a shallow copy, which is enough
+        for extractors that replace their data instead of modifying it
+        """
+        return copy.copy(self)
+
+    def checkpoint(self) -> Tuple[Self, object]:
+        """Capture the extractor for a checkpoint, which is pickled from
+        another thread.
+
+        Checkpoints are written incrementally: the first element is the
+        extractor without the data that it gave to previous checkpoints,
+        and the second one is the data added since then, which is appended
+        to the data of the previous checkpoints, or None if there is none.
+        By default the first element is a copy of the whole extractor, and
+        the second one is None.
+
+        Returns
+        -------
+        tuple
+            Extractor to store and new data
+        """
+        return self.copy(), None
+
+    def resume(self, data: List[object]) -> None:
+        """Take back the data given by `checkpoint`, in the same order, when a
+        run is resumed from a checkpoint. By default there is nothing to
+        take back
+        """
+
 
 class DataFrameExtractor(SimulationDataExtractor):
     """Object that extracts data into a pandas.DataFrame object.
@@ -114,10 +187,28 @@ class DataFrameExtractor(SimulationDataExtractor):
 
     def _initialize(self, data: object) -> None:
         self.data = pd.DataFrame(data)
+        self._checkpointed = 0
 
     def _append(self, data: object) -> None:
         self.data = pd.concat([self.data, pd.DataFrame(data)], ignore_index=True)
 
+    def copy(self) -> Self:
+        other = copy.copy(self)
+        other._checkpointed = 0
+        return other
+
+    def checkpoint(self) -> Tuple[Self, object]:
+        # Frames are replaced on every step instead of modified, so the new
+        # rows can be handed over without copying them
+        new = self.data.iloc[self._checkpointed :]
+        self._checkpointed = len(self.data)
+        other = copy.copy(self)
+        other.data = None
+        return other, new
+
+    def resume(self, data: List[object]) -> None:
+        self.data = pd.concat(data, ignore_index=True)
+
     @staticmethod
     def extract_data(simulation_state: SimulationData) -> object:
         states = {}
@@ -128,3 +219,247 @@ class DataFrameExtractor(SimulationDataExtractor):
             else:
                 states[a] = DataElement(a.actions[i], a.state.copy(), None)
         return {"time": [simulation_state.time], **states}
+
+
+class ColumnarExtractor(SimulationDataExtractor):
+    """Object that extracts data into preallocated numpy columns.
+
+    The data of every step is written into buffers that grow geometrically,
+    so recording a step takes constant time, and the pandas.DataFrame is
+    only built when `data` is accessed. The frame is indexed by time, and
+    its columns are a two-level index of the agent and the field, where
+    the fields are the state of charge, payload, index of the current
+    action, identifier of its vertex, action time and status flags.
+    """
+
+    FIELDS = ("soc", "payload", "action", "vertex", "action_time")
+    FLAGS = ("travelling", "waiting", "done", "out_of_charge", "overcharged")
+    INITIAL_CAPACITY = 1024
+
+    def _initialize(self, data: Tuple) -> None:
+        self._agents = data[0]
+        self._size = 0
+        self._frame = None
+        self._vertex_ids: Dict = {}
+        self._checkpointed = (0, 0)
+        num_agents = len(self._agents)
+        shape = (self.INITIAL_CAPACITY, num_agents)
+        self._time = np.empty(self.INITIAL_CAPACITY)
+        self._columns = {
+            "soc": np.empty(shape),
+            "payload": np.empty(shape),
+            "action": np.empty(shape, dtype=np.int64),
+            "vertex": np.empty(shape, dtype=np.int64),
+            "action_time": np.empty(shape),
+            **{f: np.empty(shape, dtype=bool) for f in self.FLAGS},
+        }
+        self._append(data)
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self._time)
+        self._time = np.resize(self._time, capacity)
+        for name, column in self._columns.items():
+            grown = np.empty((capacity, column.shape[1]), dtype=column.dtype)
+            grown[: self._size] = column[: self._size]
+            self._columns[name] = grown
+
+    def _append(self, data: Tuple) -> None:
+        _, time, states = data
+        if self._size == len(self._time):
+            self._grow()
+        row = self._size
+        self._time[row] = time
+        vertex_ids = self._vertex_ids
+        columns = self._columns
+        columns["soc"][row] = [st.soc for _, st in states]
+        columns["payload"][row] = [st.payload for _, st in states]
+        columns["action"][row] = [st.current_action for _, st in states]
+        columns["vertex"][row] = [
+            vertex_ids.setdefault(v, len(vertex_ids)) for v, _ in states
+        ]
+        columns["action_time"][row] = [st.action_time for _, st in states]
+        columns["travelling"][row] = [st.is_travelling[0] for _, st in states]
+        columns["waiting"][row] = [st.is_waiting for _, st in states]
+        columns["done"][row] = [st.is_done for _, st in states]
+        columns["out_of_charge"][row] = [st.out_of_charge for _, st in states]
+        columns["overcharged"][row] = [st.overcharged for _, st in states]
+        self._size += 1
+        self._frame = None
+
+    def copy(self) -> Self:
+        other = copy.copy(self)
+        other._vertex_ids = dict(self._vertex_ids)
+        other._time = self._time.copy()
+        other._columns = {k: v.copy() for k, v in self._columns.items()}
+        other._checkpointed = (0, 0)
+        return other
+
+    def checkpoint(self) -> Tuple[Self, object]:
+        # Only the rows and vertices added since the last checkpoint are
+        # copied
+        start, num_vertices = self._checkpointed
+        size = self._size
+        new = (
+            self._time[start:size].copy(),
+            {k: v[start:size].copy() for k, v in self._columns.items()},
+            list(self._vertex_ids)[num_vertices:],
+        )
+        self._checkpointed = (size, len(self._vertex_ids))
+        other = copy.copy(self)
+        other._time = other._columns = other._vertex_ids = other._frame = None
+        return other, new
+
+    def resume(self, data: List[object]) -> None:
+        self._time = np.concatenate([d[0] for d in data])
+        self._columns = {
+            k: np.concatenate([d[1][k] for d in data]) for k in data[0][1]
+        }
+        self._vertex_ids = {}
+        for _, _, vertices in data:
+            for v in vertices:
+                self._vertex_ids[v] = len(self._vertex_ids)
+        self._size = len(self._time)
+
+    @property
+    def data(self) -> pd.DataFrame:
+        if self._frame is None:
+            size = self._size
+            vertex_ids = np.empty(len(self._vertex_ids), dtype=object)
+            vertex_ids[:] = list(self._vertex_ids)
+            columns = {}
+            for j, agent in enumerate(self._agents):
+                for name, column in self._columns.items():
+                    values = column[:size, j]
+                    if name == "vertex":
+                        values = vertex_ids[values]
+                    columns[(agent, name)] = values
+            self._frame = pd.DataFrame(
+                columns, index=pd.Index(self._time[:size].copy(), name="time")
+            )
+        return self._frame
+
+    @data.setter
+    def data(self, new_data: object):
+        self._frame = new_data
+
+    @staticmethod
+    def extract_data(simulation_state: SimulationData) -> object:
+        agents = simulation_state.agents
+        states = [
+            (a.actions[a.state.current_action].vertex.id, a.state) for a in agents
+        ]
+        return agents, simulation_state.time, states
+
+
+class SummaryExtractor(SimulationDataExtractor):
+    """Object that only keeps a summary of each agent.
+
+    The summary is updated on every step, so it takes constant memory per
+    agent regardless of the length of the simulation. It is kept in arrays
+    with one element per agent, and the data is a dictionary with the
+    `AgentSummary` of each agent, built when it is accessed.
+
+    The time spent waiting is accumulated from the state at the previous
+    step, so with the step engine it may differ from the true one by one
+    step.
+    """
+
+    READS_ACTION_TIME = False
+
+    def _initialize(self, data: Tuple) -> None:
+        agents, time, _, states = data
+        num_agents = len(agents)
+        self._agents = list(agents)
+        self._capacity = np.array([a.battery_capacity for a in agents], dtype=float)
+        self._time = time
+        self._soc = np.array([s.soc for s in states], dtype=float)
+        self._waiting = np.zeros(num_agents, dtype=bool)
+        self._min_soc = self._soc.copy()
+        self._energy_used = np.zeros(num_agents)
+        self._energy_charged = np.zeros(num_agents)
+        self._waiting_time = np.zeros(num_agents)
+        self._finish_time = np.full(num_agents, np.nan)
+        self._out_of_charge_time = np.full(num_agents, np.nan)
+        self._append(data)
+
+    def _append(self, data: Tuple) -> None:
+        _, time, battery_eff, states = data
+        delta = time - self._time
+        self._time = time
+        num_agents = len(states)
+        soc = np.fromiter([s.soc for s in states], float, num_agents)
+        waiting = np.fromiter([s.is_waiting for s in states], bool, num_agents)
+        done = np.fromiter([s.is_done for s in states], bool, num_agents)
+        ooc = np.fromiter([s.out_of_charge for s in states], bool, num_agents)
+
+        self._waiting_time[self._waiting] += delta
+        self._waiting = waiting
+        change = (soc - self._soc) * battery_eff * self._capacity
+        self._energy_used -= np.minimum(change, 0)
+        self._energy_charged += np.maximum(change, 0)
+        self._soc = soc
+        np.minimum(self._min_soc, soc, out=self._min_soc)
+
+        finished = done & np.isnan(self._finish_time)
+        self._finish_time[finished] = time
+        out_of_charge = ooc & np.isnan(self._out_of_charge_time)
+        self._out_of_charge_time[out_of_charge] = time
+        self._data = None
+
+    @property
+    def data(self) -> Dict:
+        if self._data is None:
+            self._data = {
+                agent: AgentSummary(
+                    finish_time=_optional(self._finish_time[i]),
+                    out_of_charge_time=_optional(self._out_of_charge_time[i]),
+                    energy_used=float(self._energy_used[i]),
+                    energy_charged=float(self._energy_charged[i]),
+                    waiting_time=float(self._waiting_time[i]),
+                    min_soc=float(self._min_soc[i]),
+                )
+                for i, agent in enumerate(self._agents)
+            }
+        return self._data
+
+    @data.setter
+    def data(self, new_data: object):
+        self._data = new_data
+
+    def copy(self) -> Self:
+        other = copy.copy(self)
+        for name in (
+            "_soc",
+            "_waiting",
+            "_min_soc",
+            "_energy_used",
+            "_energy_charged",
+            "_waiting_time",
+            "_finish_time",
+            "_out_of_charge_time",
+        ):
+            setattr(other, name, getattr(self, name).copy())
+        other._data = None
+        return other
+
+    @staticmethod
+    def extract_data(simulation_state: SimulationData) -> object:
+        agents = simulation_state.agents
+        context = getattr(simulation_state, "context", None)
+        if context is not None:
+            # The states are read from the context at once, instead of going
+            # through the state of every agent
+            states = list(map(context.states.__getitem__, agents))
+        else:
+            states = [a.state for a in agents]
+        return (
+            agents,
+            simulation_state.time,
+            simulation_state.params.battery_eff,
+            states,
+        )
+
+
+def _optional(value: float) -> float:
+    """Python float of a value, or None if it is NaN"""
+    return None if np.isnan(value) else float(value)
@@ -0,0 +1,457 @@
+"""
+watermelon.sim.engine
+---------------------
+Engines that advance the state of a simulation. The simulator owns the
+state of the run, and the engine decides how time moves forward.
+"""
+
+import abc
+import bisect
+import math
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from watermelon_common.logger import LOGGER, is_fast_logging
+from watermelon.model import Agent, AgentState, NoUncertainty, Vertex
+from watermelon.sim.plan import CompiledPlans
+from watermelon.sim.scheduling import TimerWheel
+from watermelon.sim.trace import (
+    ARRIVED,
+    COMPLETED,
+    FINISHED,
+    STARTED,
+    WAITING,
+    TraceEvent,
+)
+
+
+class SimulationEngine(abc.ABC):
+    """Strategy used by a simulator to advance time
+
+    The engine is created by the simulator, and it works over the context
+    of the current run of the simulator. Every call to `update` must move
+    the time of the simulation forward, update the states of the agents
+    and decide whether the simulation should close. The simulator takes
+    care of storing the data afterwards.
+
+    Engines log what the agents do only when `_verbose` is set, and they
+    give it to the trace hooks of the simulator only when `_tracing` is
+    set. Both are checked with `_check_outputs` when a run starts and at
+    every update.
+    """
+
+    def __init__(self, sim) -> None:
+        self.sim = sim
+        self._verbose = True
+        self._tracing = False
+
+    def start(self) -> None:
+        """Prepare the engine for a new run of the simulation"""
+
+    def snapshot(self) -> object:
+        """Capture the state of the engine, besides the context of the
+        simulator. By default engines have no state of their own
+        """
+        return None
+
+    def restore(self, snapshot: object) -> None:
+        """Go back to a state captured by `snapshot`. The context of the
+        simulator has already been restored when this is called
+        """
+
+    def replan(self) -> None:
+        """Take into account that the plans in the context have changed"""
+
+    def sync(self) -> None:
+        """Bring the states in the context up to date, for engines that only
+        update them when they are read. By default states are always up to
+        date
+        """
+
+    def _reads_action_time(self) -> bool:
+        """Whether the data extractor or a stop condition reads the action
+        time of the agents at every step, so that `sync` must be called
+        """
+        return getattr(self.sim.data_extractor, "READS_ACTION_TIME", True) or any(
+            c.READS_ACTION_TIME for c in self.sim.stop_conditions
+        )
+
+    def _check_outputs(self) -> None:
+        """Check whether to log and trace what the agents do"""
+        self._verbose = not is_fast_logging()
+        self._tracing = bool(self.sim.trace_hooks)
+
+    def _trace(
+        self, kind: str, agent: Agent, action: int, vertex: Vertex, time: float = None
+    ) -> None:
+        """Give an event of an agent to the trace hooks of the simulator. By
+        default it happens at the current time of the simulation
+        """
+        time = self.sim.control.time if time is None else time
+        event = TraceEvent(time, kind, agent, action, vertex)
+        for hook in self.sim.trace_hooks:
+            hook(event)
+
+    @abc.abstractmethod
+    def update(self) -> bool:
+        """Advance the simulation.
+
+        Returns
+        -------
+        bool
+            Whether every agent has finished
+        """
+
+
+class StepEngine(SimulationEngine):
+    """Engine that advances time in fixed steps of `control.delta`
+
+    At every step, each agent checks whether its current travel or action
+    has finished, so the times at which things happen are rounded up to
+    the next step.
+
+    Agents that arrive to a vertex with limited capacity join its queue,
+    and they are left alone while they wait. At the end of every step, the
+    queues where some agent arrived or left let in the agents that fit, in
+    the order of the admission policy of the simulator, and those agents
+    start their action from that moment.
+
+    The plans of the agents are compiled when the simulation starts, so the
+    edges and the times and energies of the actions that don't depend on
+    the state of the agent are computed once, and only the rest of the
+    actions are called at every step.
+
+    Most agents are in the middle of a travel or an action whose duration
+    is known, so they are parked in a `TimerWheel` until the step where it
+    finishes, and only the agents that are due are updated. Agents whose
+    action has to be evaluated at every step (e.g. charging with an
+    uncertainty source) are updated at every step, and agents that are
+    done, out of charge or waiting are not updated at all. The action time
+    accumulates `control.delta` in the same way for every agent, so parked
+    agents take it from a table, and it is only written into their states
+    when something reads it: at every step if the data extractor or a
+    `Callback` stop condition needs it, and otherwise in snapshots and when
+    the run closes. The records are the same as if every agent was updated
+    at every step.
+    """
+
+    def __init__(self, sim) -> None:
+        super().__init__(sim)
+        self.plans = None
+        self._vertex = []
+        self._offsets = []
+        self._code = []
+        self._edge_time = []
+        self._edge_energy = []
+        self._action_time = []
+        self._action_energy = []
+        self._queues = []
+        self._states: List[AgentState] = []
+        self._index: Dict[Agent, int] = {}
+        self._wheel = TimerWheel()
+        self._tick = 0
+        # Step when the action time of each agent was zero, or None if it
+        # didn't start from zero
+        self._zero: List[int | None] = []
+        # Agents that are updated at every step
+        self._eager: Set[int] = set()
+        self._num_done = 0
+        self._delta = None
+        self._elapsed = [0.0]
+
+    def start(self) -> None:
+        self._check_outputs()
+        self._compile()
+        self._schedule_all()
+        # Agents that start the run waiting queue up in the same order
+        for i, agent in enumerate(self.sim.agents):
+            state = self._states[i]
+            if state.is_waiting and not (state.is_done or state.is_travelling[0]):
+                vertex = self._vertex[self._offsets[i] + state.current_action]
+                state.is_waiting = not self._arrive(agent, state, vertex)
+                self._schedule(i, agent, state)
+        self._admit()
+
+    def _compile(self) -> None:
+        self.plans = CompiledPlans(
+            self.sim.graph, self.sim.agents, [a.actions for a in self.sim.agents]
+        )
+        # Lists are faster than arrays to read one element at a time
+        self._vertex = [self.plans.vertices[v] for v in self.plans.vertex.tolist()]
+        self._offsets = self.plans.offsets.tolist()
+        self._code = self.plans.code.tolist()
+        self._edge_time = self.plans.edge_time.tolist()
+        self._edge_energy = self.plans.edge_energy.tolist()
+        self._action_time = self.plans.action_time_k.tolist()
+        self._action_energy = self.plans.action_energy_k.tolist()
+
+    def restore(self, snapshot: object) -> None:
+        self._compile()
+        self._schedule_all()
+
+    def replan(self) -> None:
+        self.sync()
+        self._compile()
+        self._schedule_all()
+
+    def sync(self) -> None:
+        tick = self._tick
+        elapsed = self._elapsed_table(tick)
+        for state, zero in zip(self._states, self._zero):
+            # Agents that started at this step already have their action time
+            if zero is not None and zero != tick:
+                state.action_time = elapsed[tick - zero]
+
+    def update(self) -> bool:
+        control = self.sim.control
+        if control.delta != self._delta:
+            # The table of action times only holds for one step length
+            self.sync()
+            self._schedule_all()
+        self._check_outputs()
+        control.time += control.delta
+        control.iteration += 1
+        self._tick += 1
+        tick = self._tick
+
+        finished_simulation = self._num_done == len(self._states)
+        due = self._wheel.advance()
+        if self._eager:
+            due.extend(self._eager)
+            due = sorted(set(due))
+        else:
+            due.sort()
+        for i in due:
+            agent = self.sim.agents[i]
+            state = self._states[i]
+            zero = self._zero[i]
+            if zero is None:
+                state.action_time += control.delta
+            else:
+                state.action_time = self._elapsed_table(tick - zero)[tick - zero]
+
+            if not (state.is_done or state.out_of_charge or state.is_waiting):
+                k = self._offsets[i] + state.current_action
+                self._update_agent(i, agent, state, k)
+            self._schedule(i, agent, state)
+        if self._queues:
+            self._admit()
+
+        if self._reads_action_time():
+            self.sync()
+        return finished_simulation
+
+    def _schedule_all(self) -> None:
+        """Schedule every agent again, from the current states"""
+        self._states = [self.sim.context.states[a] for a in self.sim.agents]
+        self._index = {a: i for i, a in enumerate(self.sim.agents)}
+        self._wheel = TimerWheel()
+        self._tick = 0
+        self._delta = self.sim.control.delta
+        self._elapsed = [0.0]
+        self._zero = [0 if s.action_time == 0 else None for s in self._states]
+        self._eager = set()
+        self._num_done = sum(s.is_done for s in self._states)
+        for i, agent in enumerate(self.sim.agents):
+            self._schedule(i, agent, self._states[i])
+
+    def _elapsed_table(self, steps: int) -> List[float]:
+        """Action times after each number of steps from zero, accumulated in
+        the same way as the action time of an agent that is updated at every
+        step. The table grows to cover the given number of steps
+        """
+        elapsed = self._elapsed
+        if steps >= len(elapsed):
+            more = max(steps + 1 - len(elapsed), len(elapsed))
+            increments = np.full(more + 1, self._delta)
+            increments[0] = elapsed[-1]
+            elapsed.extend(np.add.accumulate(increments)[1:].tolist())
+        return elapsed
+
+    def _schedule(self, i: int, agent: Agent, state: AgentState) -> None:
+        """Park an agent until the step where its current travel or action
+        finishes, if that step is known, or make it eager otherwise
+        """
+        self._eager.discard(i)
+        zero = self._zero[i]
+        if state.is_done or state.out_of_charge or state.is_waiting:
+            # Idle agents only need their action time to accumulate
+            if zero is None:
+                self._eager.add(i)
+            return
+        if zero is None or state.just_arrived or state.finished_action:
+            self._eager.add(i)
+            return
+
+        k = self._offsets[i] + state.current_action
+        if state.is_travelling[0]:
+            duration = self._edge_time[k]
+            if duration != duration:
+                # The edge is looked up, and may fail, at every step
+                self._eager.add(i)
+                return
+        else:
+            code = self._code[k]
+            if code == CompiledPlans.CONSTANT:
+                duration = self._action_time[k]
+            elif (
+                code == CompiledPlans.CHARGE
+                and type(agent.uncertainty) is NoUncertainty
+            ):
+                duration, _ = self._act(agent, self._vertex[k], k)
+            else:
+                # The action is evaluated, and may sample, at every step
+                self._eager.add(i)
+                return
+
+        # First step where the action time passes the duration. Durations
+        # beyond the table wake the agent up when the table ends, to look
+        # again with a longer one
+        elapsed = self._elapsed_table(self._tick - zero + self._wheel.slots)
+        steps = bisect.bisect_right(elapsed, duration)
+        self._wheel.schedule(i, max(zero + steps, self._tick + 1))
+
+    def _restart(self, i: int, state: AgentState) -> None:
+        state.action_time = 0
+        self._zero[i] = self._tick
+
+    def _arrive(self, agent: Agent, state: AgentState, vertex: Vertex) -> bool:
+        """Let an agent into a vertex without limit, or make it wait in the
+        queue of the vertex. Returns whether the agent got in
+        """
+        if not math.isfinite(vertex.capacity):
+            return True
+        queue = self.sim.context.queue(vertex)
+        queue.push(agent, self.sim.admission.priority(agent, self.sim.control.time))
+        self._queues.append(queue)
+        state.is_waiting = True
+        if self._verbose:
+            LOGGER.debug("(%s|%i) waiting in %s", agent, state.current_action, vertex)
+        if self._tracing:
+            self._trace(WAITING, agent, state.current_action, vertex)
+        return False
+
+    def _leave(self, agent: Agent, vertex: Vertex) -> None:
+        if math.isfinite(vertex.capacity):
+            queue = self.sim.context.queue(vertex)
+            queue.leave(agent)
+            self._queues.append(queue)
+
+    def _admit(self) -> None:
+        """Let in the agents that fit in the queues that changed"""
+        for queue in self._queues:
+            for agent in queue.admit():
+                i = self._index[agent]
+                state = self._states[i]
+                state.is_waiting = False
+                self._restart(i, state)
+                vertex, action = agent.actions[state.current_action].tuple()
+                if self._verbose:
+                    LOGGER.info("%s started (%s, %s)", agent, vertex, action)
+                if self._tracing:
+                    self._trace(STARTED, agent, state.current_action, vertex)
+                self._schedule(i, agent, state)
+        self._queues = []
+
+    def _update_agent(self, i: int, agent: Agent, state: AgentState, k: int) -> None:
+        vertex = self._vertex[k]
+        self._do_action(i, agent, state, vertex, k)
+        self._check_next_action(i, agent, state, vertex)
+
+    def _travel(self, state: AgentState, k: int) -> Tuple[float, float]:
+        travel_time = self._edge_time[k]
+        if travel_time == travel_time:
+            return travel_time, self._edge_energy[k]
+        # The travel doesn't come from the plan, or its edge doesn't exist
+        _, origin, target = state.is_travelling
+        edge = self.sim.graph.get_edge(origin, target)
+        return edge.time, edge.weight
+
+    def _act(self, agent: Agent, vertex: Vertex, k: int) -> Tuple[float, float]:
+        code = self._code[k]
+        if code == CompiledPlans.CONSTANT:
+            return self._action_time[k], self._action_energy[k]
+        action = self.plans.actions[k]
+        if code == CompiledPlans.FORBIDDEN:
+            return action.act(agent, vertex)
+        # The action was already validated when the plan was compiled
+        return action._act(agent, vertex)  # pylint: disable=protected-access
+
+    def _do_action(
+        self, i: int, agent: Agent, state: AgentState, vertex: Vertex, k: int
+    ) -> None:
+        if state.is_travelling[0]:
+            # It is travelling to a vertex
+            _, origin, target = state.is_travelling
+            travel_time, travel_energy = self._travel(state, k)
+            if self._verbose:
+                completion = state.action_time / travel_time if travel_time != 0 else 1
+                LOGGER.debug(
+                    "(%s|%i) %s->%s [%d%%]",
+                    agent,
+                    state.current_action,
+                    origin,
+                    target,
+                    100 * completion,
+                )
+            if state.action_time > travel_time:
+                state.is_travelling = (False, None, None)
+                state.just_arrived = True
+                self._restart(i, state)
+                agent.insert_energy(-travel_energy, self.sim.params.battery_eff)
+                if self._tracing:
+                    self._trace(ARRIVED, agent, state.current_action, vertex)
+
+        if not state.is_travelling[0]:
+            # It is doing some action
+            action = self.plans.actions[k]
+            if state.just_arrived:
+                state.just_arrived = False
+                if not self._arrive(agent, state, vertex):
+                    return
+                if self._verbose:
+                    LOGGER.info("%s started (%s, %s)", agent, vertex, action)
+                if self._tracing:
+                    self._trace(STARTED, agent, state.current_action, vertex)
+
+            time, energy = self._act(agent, vertex, k)
+            if self._verbose:
+                completion = state.action_time / time if time != 0 else 1
+                LOGGER.debug(
+                    "(%s|%i) %s in %s [%d%%]",
+                    agent,
+                    state.current_action,
+                    action,
+                    vertex,
+                    100 * completion,
+                )
+            if state.action_time > time:
+                self._leave(agent, vertex)
+                state.finished_action = True
+                agent.insert_energy(energy, self.sim.params.battery_eff)
+                if self._tracing:
+                    self._trace(COMPLETED, agent, state.current_action, vertex)
+
+    def _check_next_action(
+        self, i: int, agent: Agent, state: AgentState, vertex: Vertex
+    ) -> None:
+        if state.finished_action:
+            # Send the agent to sleep if there are no more actions left
+            if state.current_action + 1 >= len(agent.actions):
+                if self._verbose:
+                    LOGGER.info("Agent %s finished", agent)
+                if self._tracing:
+                    self._trace(FINISHED, agent, state.current_action, vertex)
+                state.is_done = True
+                self._restart(i, state)
+                self._num_done += 1
+            else:
+                next_vertex, _ = agent.actions[state.current_action + 1].tuple()
+                if next_vertex is not vertex:
+                    state.is_travelling = (True, vertex, next_vertex)
+                    self._restart(i, state)
+                state.current_action += 1
+                state.finished_action = False
+                if self._tracing and next_vertex is vertex:
+                    self._trace(STARTED, agent, state.current_action, vertex)
@@ -0,0 +1,216 @@
+"""
+watermelon.sim.event_engine
+---------------------------
+Discrete-event engine, which jumps straight from one event of the
+simulation to the next one instead of advancing in fixed steps.
+"""
+
+import heapq
+import math
+from typing import List
+
+from watermelon_common.logger import LOGGER
+from watermelon.sim.engine import SimulationEngine
+from watermelon.sim.trace import ARRIVED, COMPLETED, FINISHED, STARTED, WAITING
+
+
+# Kinds of events
+_ARRIVAL = 0
+_COMPLETION = 1
+
+
+class EventEngine(SimulationEngine):
+    """Engine that advances time from one event to the next
+
+    The duration of every travel and action is known when it starts, so
+    the engine keeps a priority queue with the time at which each agent
+    finishes what it is doing, and every update jumps to the earliest of
+    them. Agents that wait for a vertex to have room sit in the queue of
+    the vertex, and they are let in after the events of the moment when
+    another agent leaves it. The data of the simulation is stored once per
+    event, at the exact time in which it happens.
+
+    The rules are the same as in `StepEngine`, so the results match the
+    ones of a step engine as `control.delta` goes to zero. The duration of
+    an action is computed once when it starts, so with an uncertainty
+    source the state of charge is only sampled at that moment.
+    """
+
+    def __init__(self, sim) -> None:
+        super().__init__(sim)
+        self._queue = []
+        self._counter = 0
+        self._phase_start: List[float] = []
+        self._energy: List[float] = []
+        self._queues = []
+        self._index = {}
+
+    def start(self) -> None:
+        self._check_outputs()
+        now = self.sim.control.time
+        self._index = {a: i for i, a in enumerate(self.sim.agents)}
+        self._queue = []
+        self._counter = 0
+        self._energy = [0.0] * len(self.sim.agents)
+        self._queues = []
+        states = self.sim.context.states
+        self._phase_start = [now - states[a].action_time for a in self.sim.agents]
+
+        for i, agent in enumerate(self.sim.agents):
+            state = states[agent]
+            if state.is_done or state.out_of_charge:
+                continue
+            if state.is_travelling[0]:
+                _, origin, target = state.is_travelling
+                edge = self.sim.graph.get_edge(origin, target)
+                self._push(self._phase_start[i] + edge.time, i, _ARRIVAL)
+            elif state.is_waiting:
+                # Agents that start the run waiting queue up in order
+                state.is_waiting = False
+                self._enter(i, now)
+            else:
+                self._begin_action(i, now)
+        self._admit(now)
+
+    def snapshot(self) -> object:
+        return (
+            list(self._queue),
+            self._counter,
+            list(self._phase_start),
+            list(self._energy),
+        )
+
+    def restore(self, snapshot: object) -> None:
+        queue, self._counter, phase_start, energy = snapshot
+        self._queue = list(queue)
+        self._phase_start = list(phase_start)
+        self._energy = list(energy)
+        self._queues = []
+        self._index = {a: i for i, a in enumerate(self.sim.agents)}
+
+    def update(self) -> bool:
+        self._check_outputs()
+        control = self.sim.control
+        next_time = self._queue[0][0] if self._queue else float("inf")
+        control.time = max(control.time, min(next_time, control.stop_time))
+        control.iteration += 1
+
+        while self._queue and self._queue[0][0] <= control.time:
+            time, _, i, kind = heapq.heappop(self._queue)
+            if kind == _ARRIVAL:
+                self._arrive(i, time)
+            else:
+                self._complete(i, time)
+        if self._queues:
+            self._admit(control.time)
+
+        finished_simulation = True
+        for i, agent in enumerate(self.sim.agents):
+            state = self.sim.context.states[agent]
+            state.action_time = control.time - self._phase_start[i]
+            finished_simulation &= state.is_done
+        return finished_simulation
+
+    def _push(self, time: float, i: int, kind: int) -> None:
+        heapq.heappush(self._queue, (time, self._counter, i, kind))
+        self._counter += 1
+
+    def _begin_action(self, i: int, now: float) -> None:
+        agent = self.sim.agents[i]
+        vertex, action = agent.actions[agent.state.current_action].tuple()
+        time, energy = action.act(agent, vertex)
+        self._energy[i] = energy
+        # An action that follows another one in the same vertex keeps the
+        # time of the previous one, so it may finish right away
+        self._push(max(now, self._phase_start[i] + time), i, _COMPLETION)
+
+    def _arrive(self, i: int, now: float) -> None:
+        agent = self.sim.agents[i]
+        state = agent.state
+        _, origin, target = state.is_travelling
+        edge = self.sim.graph.get_edge(origin, target)
+        state.is_travelling = (False, None, None)
+        self._phase_start[i] = now
+        agent.insert_energy(-edge.weight, self.sim.params.battery_eff)
+        if self._tracing:
+            self._trace(ARRIVED, agent, state.current_action, target, now)
+        self._enter(i, now)
+
+    def _enter(self, i: int, now: float) -> None:
+        """Let an agent into the vertex of its action, or make it wait in the
+        queue of the vertex
+        """
+        agent = self.sim.agents[i]
+        state = agent.state
+        vertex, action = agent.actions[state.current_action].tuple()
+        if math.isfinite(vertex.capacity):
+            queue = self.sim.context.queue(vertex)
+            queue.push(agent, self.sim.admission.priority(agent, now))
+            self._queues.append(queue)
+            state.is_waiting = True
+            if self._verbose:
+                LOGGER.debug(
+                    "(%s|%i) waiting in %s", agent, state.current_action, vertex
+                )
+            if self._tracing:
+                self._trace(WAITING, agent, state.current_action, vertex, now)
+        else:
+            if self._verbose:
+                LOGGER.info("%s started (%s, %s)", agent, vertex, action)
+            if self._tracing:
+                self._trace(STARTED, agent, state.current_action, vertex, now)
+            if not state.out_of_charge:
+                self._begin_action(i, now)
+
+    def _complete(self, i: int, now: float) -> None:
+        agent = self.sim.agents[i]
+        state = agent.state
+        vertex = agent.actions[state.current_action].vertex
+        if math.isfinite(vertex.capacity):
+            queue = self.sim.context.queue(vertex)
+            queue.leave(agent)
+            self._queues.append(queue)
+        agent.insert_energy(self._energy[i], self.sim.params.battery_eff)
+        if self._tracing:
+            self._trace(COMPLETED, agent, state.current_action, vertex, now)
+
+        if state.current_action + 1 >= len(agent.actions):
+            if self._verbose:
+                LOGGER.info("Agent %s finished", agent)
+            if self._tracing:
+                self._trace(FINISHED, agent, state.current_action, vertex, now)
+            state.finished_action = True
+            state.is_done = True
+            self._phase_start[i] = now
+        else:
+            next_vertex = agent.actions[state.current_action + 1].vertex
+            state.current_action += 1
+            if next_vertex is not vertex:
+                state.is_travelling = (True, vertex, next_vertex)
+                self._phase_start[i] = now
+                if not state.out_of_charge:
+                    edge = self.sim.graph.get_edge(vertex, next_vertex)
+                    self._push(now + edge.time, i, _ARRIVAL)
+            else:
+                if self._tracing:
+                    self._trace(STARTED, agent, state.current_action, vertex, now)
+                if not state.out_of_charge:
+                    self._begin_action(i, now)
+
+    def _admit(self, now: float) -> None:
+        """Let in the agents that fit in the queues that changed"""
+        for queue in self._queues:
+            for agent in queue.admit():
+                i = self._index[agent]
+                agent.state.is_waiting = False
+                self._phase_start[i] = now
+                vertex, action = agent.actions[agent.state.current_action].tuple()
+                if self._verbose:
+                    LOGGER.info("%s started (%s, %s)", agent, vertex, action)
+                if self._tracing:
+                    self._trace(
+                        STARTED, agent, agent.state.current_action, vertex, now
+                    )
+                if not agent.state.out_of_charge:
+                    self._begin_action(i, now)
+        self._queues = []
@@ -0,0 +1,413 @@
+"""
+watermelon.sim.montecarlo
+-------------------------
+Monte Carlo studies of simulations with uncertainty, which repeat a
+simulation with independent random streams and aggregate the outcomes of
+the agents.
+"""
+
+import concurrent.futures
+import contextlib
+import copy
+import dataclasses
+import os
+import statistics
+import warnings
+from typing import Callable, Hashable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from watermelon_common.logger import LOGGER
+from watermelon.model import Agent, Graph, registry_scope
+from watermelon.sim.data_extractor import SummaryExtractor
+from watermelon.sim.simulator import Simulator
+
+
+_METRICS = ("finish_time", "final_soc", "min_soc")
+
+# Scenario of the current worker process
+_WORKER_SCENARIO = None
+
+
+class _RunningMoments:
+    """Running mean and variance of many variables at once, with Welford's
+    algorithm. NaN values are skipped
+    """
+
+    def __init__(self, shape: Tuple[int, ...]) -> None:
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+
+    def add(self, values: np.ndarray) -> None:
+        """Add a sample of every variable"""
+        valid = ~np.isnan(values)
+        self.count += valid
+        delta = np.where(valid, values - self.mean, 0)
+        self.mean += np.divide(delta, self.count, out=np.zeros_like(delta), where=valid)
+        self._m2 += np.where(valid, delta * (values - self.mean), 0)
+
+    @property
+    def std(self) -> np.ndarray:
+        """Sample standard deviation, which is NaN with less than two samples"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(
+                self.count > 1, np.sqrt(self._m2 / (self.count - 1)), np.nan
+            )
+
+
+class _StreamingQuantiles:
+    """Estimates of quantiles of many variables at once, with the P² algorithm
+    of Jain and Chlamtac, which keeps five markers per quantile and
+    variable instead of the samples. NaN values are skipped, and the
+    estimates are exact up to five samples
+    """
+
+    def __init__(self, shape: Tuple[int, ...], quantiles: Sequence[float]) -> None:
+        self.quantiles = tuple(quantiles)
+        self.shape = (len(self.quantiles), *shape)
+        size = int(np.prod(self.shape))
+        p = np.repeat(self.quantiles, size // len(self.quantiles))[:, None]
+        self.count = np.zeros(size, dtype=np.int64)
+        self._heights = np.zeros((size, 5))
+        self._positions = np.tile(np.arange(5, dtype=float), (size, 1))
+        ones = np.ones_like(p)
+        self._desired = np.hstack([0 * ones, 2 * p, 4 * p, 2 + 2 * p, 4 * ones])
+        self._increments = np.hstack([0 * ones, p / 2, p, (1 + p) / 2, ones])
+
+    def add(self, values: np.ndarray) -> None:
+        """Add a sample of every variable"""
+        x = np.broadcast_to(values, self.shape).ravel()
+        valid = ~np.isnan(x)
+        # The first five samples are the initial heights of the markers
+        first = np.flatnonzero(valid & (self.count < 5))
+        self._heights[first, self.count[first]] = x[first]
+        self.count[first] += 1
+        full = first[self.count[first] == 5]
+        self._heights[full] = np.sort(self._heights[full], axis=1)
+
+        rows = np.flatnonzero(valid & (self.count >= 5))
+        rows = np.setdiff1d(rows, first, assume_unique=True)
+        if len(rows):
+            self._update(rows, x[rows])
+            self.count[rows] += 1
+
+    def _update(self, rows: np.ndarray, x: np.ndarray) -> None:
+        q = self._heights[rows]
+        n = self._positions[rows]
+        q[:, 0] = np.minimum(q[:, 0], x)
+        q[:, 4] = np.maximum(q[:, 4], x)
+        cell = np.sum(x[:, None] >= q[:, 1:4], axis=1)
+        n += np.arange(5) > cell[:, None]
+        desired = self._desired[rows] + self._increments[rows]
+        self._desired[rows] = desired
+
+        for i in (1, 2, 3):
+            d = desired[:, i] - n[:, i]
+            move = ((d >= 1) & (n[:, i + 1] - n[:, i] > 1)) | (
+                (d <= -1) & (n[:, i - 1] - n[:, i] < -1)
+            )
+            if not move.any():
+                continue
+            qm, nm, sign = q[move], n[move], np.sign(d[move])
+            # Piecewise-parabolic prediction, or linear if it breaks the order
+            parabolic = qm[:, i] + sign / (nm[:, i + 1] - nm[:, i - 1]) * (
+                (nm[:, i] - nm[:, i - 1] + sign)
+                * (qm[:, i + 1] - qm[:, i])
+                / (nm[:, i + 1] - nm[:, i])
+                + (nm[:, i + 1] - nm[:, i] - sign)
+                * (qm[:, i] - qm[:, i - 1])
+                / (nm[:, i] - nm[:, i - 1])
+            )
+            neighbor = np.where(sign > 0, i + 1, i - 1)
+            k = np.arange(len(qm))
+            linear = qm[:, i] + sign * (qm[k, neighbor] - qm[:, i]) / (
+                nm[k, neighbor] - nm[:, i]
+            )
+            ordered = (qm[:, i - 1] < parabolic) & (parabolic < qm[:, i + 1])
+            q[move, i] = np.where(ordered, parabolic, linear)
+            n[move, i] += sign
+
+        self._heights[rows] = q
+        self._positions[rows] = n
+
+    def estimate(self) -> np.ndarray:
+        """Estimates of the quantiles, with shape (quantiles, *shape)"""
+        result = self._heights[:, 2].copy()
+        p = np.repeat(self.quantiles, len(self.count) // len(self.quantiles))
+        for j in np.flatnonzero(self.count < 5):
+            count = self.count[j]
+            result[j] = (
+                np.quantile(self._heights[j, :count], p[j]) if count else np.nan
+            )
+        return result.reshape(self.shape)
+
+
+@dataclasses.dataclass
+class MonteCarloResult:
+    """Outcomes of the agents over the replications of a Monte Carlo study
+
+    The outcomes are aggregated as the replications finish: the mean and
+    standard deviation of each metric and agent are running ones, and its
+    quantiles are streaming estimates, so the memory of the study doesn't
+    grow with the number of replications.
+
+    The outcomes of every replication are only kept if the study is run
+    with `keep_samples=True`, in arrays with one row per replication and
+    one column per agent, and otherwise they are None. Finish times are
+    NaN for the agents that didn't finish in a replication.
+    """
+
+    agents: List[Hashable]
+    replications: int
+    out_of_charge_count: np.ndarray
+    finish_time: np.ndarray = None
+    final_soc: np.ndarray = None
+    min_soc: np.ndarray = None
+    out_of_charge: np.ndarray = None
+    _moments: _RunningMoments = dataclasses.field(default=None, repr=False)
+    _quantiles: _StreamingQuantiles = dataclasses.field(default=None, repr=False)
+
+    @property
+    def has_samples(self) -> bool:
+        """Whether the outcomes of every replication were kept"""
+        return self.finish_time is not None
+
+    def summary(
+        self, quantiles: Sequence[float] = None, confidence: float = 0.95
+    ) -> pd.DataFrame:
+        """Statistics of the outcomes of each agent
+
+        Parameters
+        ----------
+        quantiles : sequence of float, optional
+            Quantiles to compute, by default None, which are the ones that
+            the study estimated. Other quantiles can only be computed if
+            the study kept its samples, and then they are exact.
+        confidence : float, optional
+            Confidence level of the interval of the mean, by default 0.95.
+            The interval uses the normal approximation.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per metric and agent, with the number of samples, the
+            mean, the standard deviation, the confidence interval of the
+            mean and the quantiles. Agents that didn't finish are left out
+            of the statistics of the finish time.
+
+        Raises
+        ------
+        ValueError
+            If a quantile was not estimated and the samples were not kept
+        """
+        if quantiles is None:
+            quantiles = self._quantiles.quantiles
+        elif not self.has_samples:
+            missing = set(quantiles) - set(self._quantiles.quantiles)
+            if missing:
+                raise ValueError(
+                    f"Quantiles {sorted(missing)} were not estimated, pass them "
+                    "to run_monte_carlo or keep the samples"
+                )
+        estimates = dict(zip(self._quantiles.quantiles, self._quantiles.estimate()))
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        count, mean, std = self._moments.count, self._moments.mean, self._moments.std
+        frames = []
+        for m, metric in enumerate(_METRICS):
+            with warnings.catch_warnings(), np.errstate(invalid="ignore"):
+                # Agents without samples get NaN
+                warnings.simplefilter("ignore", RuntimeWarning)
+                mean_m = np.where(count[m] > 0, mean[m], np.nan)
+                half_width = z * std[m] / np.sqrt(count[m])
+                columns = {
+                    "count": count[m],
+                    "mean": mean_m,
+                    "std": std[m],
+                    "ci_low": mean_m - half_width,
+                    "ci_high": mean_m + half_width,
+                }
+                for q in quantiles:
+                    if self.has_samples:
+                        values = getattr(self, metric)
+                        columns[f"q{q:g}"] = np.nanquantile(values, q, axis=0)
+                    else:
+                        columns[f"q{q:g}"] = estimates[q][m]
+            frames.append(
+                pd.DataFrame(
+                    columns,
+                    index=pd.MultiIndex.from_product(
+                        [[metric], self.agents], names=["metric", "agent"]
+                    ),
+                )
+            )
+        return pd.concat(frames)
+
+
+def _init_worker(scenario: Callable) -> None:
+    global _WORKER_SCENARIO  # pylint: disable=global-statement
+    with registry_scope():
+        _WORKER_SCENARIO = scenario()
+
+
+def _replicate(
+    graph: Graph,
+    agents: List[Agent],
+    seed: np.random.SeedSequence,
+    stop_time: float,
+    kwargs: dict,
+) -> np.ndarray:
+    # Every agent gets its own source, with its own stream of the replication
+    for agent, agent_seed in zip(agents, seed.spawn(len(agents))):
+        source = copy.copy(agent.uncertainty)
+        source.seed(agent_seed)
+        agent.uncertainty = source
+
+    sim = Simulator(graph, agents, data_extractor_cls=SummaryExtractor, **kwargs)
+    sim.start(stop_time)
+    while not sim.should_close:
+        sim.update()
+
+    outcome = np.empty((4, len(agents)))
+    for i, agent in enumerate(agents):
+        summary = sim.data_extractor.data[agent]
+        outcome[0, i] = np.nan if summary.finish_time is None else summary.finish_time
+        outcome[1, i] = sim.states[agent].soc
+        outcome[2, i] = summary.min_soc
+        outcome[3, i] = summary.out_of_charge
+    return outcome
+
+
+def _run_replications(
+    seeds: List[np.random.SeedSequence], stop_time: float, kwargs: dict
+) -> List[np.ndarray]:
+    graph, agents = _WORKER_SCENARIO
+    return [_replicate(graph, agents, s, stop_time, kwargs) for s in seeds]
+
+
+def run_monte_carlo(
+    scenario: Callable[[], Tuple[Graph, List[Agent]]],
+    replications: int,
+    *,
+    seed: int | np.random.SeedSequence = None,
+    workers: int = None,
+    batch_size: int = None,
+    stop_time: float = None,
+    quantiles: Sequence[float] = (0.05, 0.5, 0.95),
+    keep_samples: bool = False,
+    **kwargs,
+) -> MonteCarloResult:
+    """Repeat a simulation with independent random streams
+
+    Every replication gets a seed spawned from `seed`, and every agent gets
+    its own stream spawned from the one of the replication, so the outcome
+    of each replication only depends on `seed` and on its position, and
+    the results are the same for any number of workers. Replications are
+    reduced to the outcomes of the agents as soon as they finish, so the
+    data of the simulations is never kept, and the outcomes are folded
+    into running statistics in the order of the replications as they
+    arrive, so they aren't kept either unless `keep_samples` is True.
+
+    Since graphs and agents are singletons tied to their process, the
+    scenario is given as a function that builds them, which is called once
+    in each worker. It must be picklable (e.g. a function defined at the
+    top level of a module, or a `functools.partial` of one) when more than
+    one worker is used.
+
+    Keyword arguments are passed to `Simulator`.
+
+    Parameters
+    ----------
+    scenario : callable
+        Function without arguments that returns the graph and the agents
+    replications : int
+        Number of replications
+    seed : int or numpy.random.SeedSequence, optional
+        Seed of the study, by default None. If None, a fresh seed is used.
+    workers : int, optional
+        Number of worker processes, by default None. If None, one per CPU
+        is used. With one worker, the replications run in this process.
+    batch_size : int, optional
+        Number of replications sent to a worker at once, by default None.
+        If None, every worker gets about four batches.
+    stop_time : float, optional
+        Time when each replication stops, by default None. If None, the
+        stop time of the control variables is used.
+    quantiles : sequence of float, optional
+        Quantiles of the outcomes to estimate while the replications
+        arrive, by default (0.05, 0.5, 0.95)
+    keep_samples : bool, optional
+        Whether to keep the outcomes of every replication, by default
+        False. They take memory proportional to the number of
+        replications, and they allow computing any quantile exactly.
+
+    Returns
+    -------
+    watermelon.sim.montecarlo.MonteCarloResult
+        Statistics of the outcomes of the agents
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(replications)
+    workers = os.cpu_count() if workers is None else workers
+    if batch_size is None:
+        batch_size = max(1, -(-replications // (4 * workers)))
+    batches = [seeds[i : i + batch_size] for i in range(0, replications, batch_size)]
+    LOGGER.info(
+        "Running %i replications in %i batches with %i workers",
+        replications,
+        len(batches),
+        workers,
+    )
+
+    with registry_scope():
+        graph, agents = scenario()
+    shape = (len(_METRICS), len(agents))
+    moments = _RunningMoments(shape)
+    estimates = _StreamingQuantiles(shape, quantiles)
+    out_of_charge = np.zeros(len(agents), dtype=np.int64)
+    samples = np.empty((replications, 4, len(agents))) if keep_samples else None
+    with contextlib.ExitStack() as stack:
+        if workers <= 1:
+            results = (
+                [_replicate(graph, agents, s, stop_time, kwargs) for s in batch]
+                for batch in batches
+            )
+        else:
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_worker, initargs=(scenario,)
+                )
+            )
+            results = executor.map(
+                _run_replications,
+                batches,
+                [stop_time] * len(batches),
+                [kwargs] * len(batches),
+            )
+        # Batches come back in order, and each one is folded in as it arrives
+        for start, batch_outcomes in zip(range(0, replications, batch_size), results):
+            for outcome in batch_outcomes:
+                moments.add(outcome[:3])
+                estimates.add(outcome[:3])
+                out_of_charge += outcome[3].astype(bool)
+            if samples is not None:
+                samples[start : start + len(batch_outcomes)] = batch_outcomes
+
+    kept = {}
+    if samples is not None:
+        kept = {
+            "finish_time": samples[:, 0],
+            "final_soc": samples[:, 1],
+            "min_soc": samples[:, 2],
+            "out_of_charge": samples[:, 3].astype(bool),
+        }
+    return MonteCarloResult(
+        agents=[a.id for a in agents],
+        replications=replications,
+        out_of_charge_count=out_of_charge,
+        _moments=moments,
+        _quantiles=estimates,
+        **kept,
+    )
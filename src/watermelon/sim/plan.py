@@ -0,0 +1,135 @@
+"""
+watermelon.sim.plan
+-------------------
+Plans of the agents compiled into flat arrays, so that engines don't have
+to validate and dispatch on the decisions at every step.
+"""
+
+from typing import List, Sequence
+
+import numpy as np
+
+from watermelon.exceptions import NonExistentEdgeException
+from watermelon.model import (
+    Agent,
+    ChargeBatteryAction,
+    Decision,
+    NullAction,
+    Vertex,
+    WaitAction,
+)
+
+
+class CompiledPlans:
+    """Plans of many agents flattened into arrays
+
+    The decisions of every plan are stored one after the other, and the
+    decisions of plan `i` are the ones between `offsets[i]` and
+    `offsets[i + 1]`. For each decision there is the slot of its vertex in
+    `vertices`, its action, the time and energy of the edge that leads to it
+    from the previous decision (NaN if there is no travel or no edge) and
+    the kind of action:
+
+    - `CONSTANT` actions (`NullAction` and `WaitAction`) always take the
+      same time and energy, which are stored in `action_time_k` and
+      `action_energy_k`.
+    - `CHARGE` actions (`ChargeBatteryAction`) depend on the state of
+      charge, so only their limit, charge scale and power are stored.
+    - `GENERIC` actions have to be evaluated by calling them.
+    - `FORBIDDEN` actions can't be taken in their vertex, so acting raises
+      an error.
+
+    Every decision is validated and every edge is looked up once, when the
+    plans are compiled.
+
+    Parameters
+    ----------
+    graph : watermelon.model.Graph
+        Graph where the agents move
+    agents : list of watermelon.model.Agent
+        Agent that follows each plan
+    plans : list of list of watermelon.model.Decision
+        Plans to compile
+    """
+
+    # Kinds of actions
+    GENERIC = 0
+    CONSTANT = 1
+    CHARGE = 2
+    FORBIDDEN = 3
+
+    def __init__(
+        self, graph, agents: Sequence[Agent], plans: Sequence[List[Decision]]
+    ) -> None:
+        self.graph = graph
+        self.agents = agents
+        self.vertices: List[Vertex] = []
+        self._slots = {}
+        self.compile(plans)
+
+    def compile(self, plans: Sequence[List[Decision]]) -> None:
+        """Flatten the plans into arrays. Slots of the vertices are kept when
+        compiling again, so arrays indexed by slot stay valid
+        """
+        lengths = [len(p) for p in plans]
+        self.offsets = np.zeros(len(plans) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.length = np.array(lengths, dtype=np.int64)
+
+        # Vertices are compared by identity, like the engines do
+        slots = self._slots
+        decisions = [d for p in plans for d in p]
+        vertex = np.empty(len(decisions), dtype=np.int64)
+        for k, d in enumerate(decisions):
+            slot = slots.get(id(d.vertex))
+            if slot is None:
+                slot = slots[id(d.vertex)] = len(self.vertices)
+                self.vertices.append(d.vertex)
+            vertex[k] = slot
+        self.vertex = vertex
+        self.capacity = np.array([v.capacity for v in self.vertices], dtype=np.float64)
+        self.actions = [d.action for d in decisions]
+
+        # Travel towards each decision from the previous one
+        first = np.zeros(len(decisions), dtype=bool)
+        first[self.offsets[:-1][self.length > 0]] = True
+        self.edge_time = np.full(len(decisions), np.nan)
+        self.edge_energy = np.full(len(decisions), np.nan)
+        for k in np.flatnonzero(~first & (vertex != np.roll(vertex, 1))).tolist():
+            edge = self._get_edge(k)
+            if edge is not None:
+                self.edge_time[k] = edge.time
+                self.edge_energy[k] = edge.weight
+
+        self.code = np.full(len(decisions), self.GENERIC, dtype=np.int8)
+        self.action_time_k = np.zeros(len(decisions))
+        self.action_energy_k = np.zeros(len(decisions))
+        self.limit = np.zeros(len(decisions))
+        self.charge_scale = np.zeros(len(decisions))
+        self.power = np.ones(len(decisions))
+        lane = np.repeat(np.arange(len(plans)), self.length)
+        for k, d in enumerate(decisions):
+            if not d.action.can_act_on(d.vertex):
+                # Acting raises the error when the agent gets there
+                self.code[k] = self.FORBIDDEN
+                continue
+            agent = self.agents[lane[k]]
+            if type(d.action) in (NullAction, WaitAction):
+                self.code[k] = self.CONSTANT
+                self.action_time_k[k], self.action_energy_k[k] = d.action.act(
+                    agent, d.vertex
+                )
+            elif type(d.action) is ChargeBatteryAction:
+                self.code[k] = self.CHARGE
+                self.limit[k] = d.action.limit
+                self.charge_scale[k] = d.action.battery_eff * agent.battery_capacity
+                self.power[k] = d.vertex.type.charge_power
+
+    def _get_edge(self, k: int):
+        try:
+            return self.graph.get_edge(
+                self.vertices[self.vertex[k - 1]], self.vertices[self.vertex[k]]
+            )
+        except NonExistentEdgeException:
+            # The engines fail only when an agent takes the edge
+            return None
@@ -0,0 +1,112 @@
+"""
+watermelon.sim.queueing
+-----------------------
+Queues of the agents that wait for room in a vertex with limited capacity,
+and the policies that decide in which order they are let in.
+"""
+
+import abc
+import heapq
+from typing import Callable, Hashable, List, Self, Set
+
+from watermelon.model import Agent
+
+
+class AdmissionPolicy(abc.ABC):
+    """Order in which the agents that wait for a vertex are let in
+
+    Every agent gets a priority when it arrives, and the agents with the
+    lowest priority are let in first. Agents with the same priority are
+    let in in the order in which they arrived.
+    """
+
+    def __str__(self) -> str:
+        return self.__class__.__name__
+
+    @abc.abstractmethod
+    def priority(self, agent: Agent, time: float) -> object:
+        """Priority of an agent that arrives to a vertex at some time"""
+
+
+class FIFOAdmission(AdmissionPolicy):
+    """Let the agents in by their time of arrival"""
+
+    def priority(self, agent: Agent, time: float) -> object:
+        return time
+
+
+class PriorityAdmission(AdmissionPolicy):
+    """Let the agents in by a priority of their own, and then by their time
+    of arrival
+
+    Parameters
+    ----------
+    key : callable
+        Function that takes an agent and returns its priority, where lower
+        values go first
+    """
+
+    def __init__(self, key: Callable[[Agent], object]) -> None:
+        self.key = key
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({getattr(self.key, '__name__', self.key)})"
+
+    def priority(self, agent: Agent, time: float) -> object:
+        return self.key(agent), time
+
+
+class VertexQueue:
+    """Agents that occupy a vertex and agents that wait to get in
+
+    Agents are admitted while the vertex has room, and the rest wait in a
+    priority queue until some agent leaves. Nothing is done for the agents
+    while they wait, so they don't cost anything until they are admitted.
+    Items are usually agents, but any hashable item can be queued.
+
+    Parameters
+    ----------
+    capacity : float
+        Number of agents that fit in the vertex
+    """
+
+    def __init__(self, capacity: float) -> None:
+        self.capacity = capacity
+        self.admitted: Set[Hashable] = set()
+        self._heap = []
+        self._counter = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def copy(self) -> Self:
+        """Create an independent copy of the queue"""
+        other = VertexQueue(self.capacity)
+        other.admitted = set(self.admitted)
+        other._heap = list(self._heap)
+        other._counter = self._counter
+        return other
+
+    def push(self, item: Hashable, priority: object) -> None:
+        """Make an item wait for its turn to get in"""
+        heapq.heappush(self._heap, (priority, self._counter, item))
+        self._counter += 1
+
+    def leave(self, item: Hashable) -> None:
+        """Free the place of an item, if it was admitted"""
+        self.admitted.discard(item)
+
+    def admit(self) -> List[Hashable]:
+        """Let in the waiting items that fit, in order of priority
+
+        Returns
+        -------
+        list
+            Items that were admitted
+        """
+        admitted = []
+        while self._heap and len(self.admitted) < self.capacity:
+            _, _, item = heapq.heappop(self._heap)
+            self.admitted.add(item)
+            admitted.append(item)
+        return admitted
@@ -0,0 +1,96 @@
+"""
+watermelon.sim.scheduling
+-------------------------
+Scheduling of the agents that have nothing to do until a known step, so
+that fixed-step engines only update the agents that are due.
+"""
+
+import heapq
+from typing import Hashable, List
+
+
+class TimerWheel:
+    """Hierarchical timer wheel of items that are due at some step
+
+    The first wheel has one slot per step for the next `slots` steps, and
+    every other wheel has slots that span all the slots of the previous
+    one. Items are kept in the lowest wheel that reaches their step, and
+    they move down to the lower wheels as their step gets closer, so
+    scheduling an item and taking the items of a step take constant time,
+    regardless of how many items there are or how far away they are due.
+    Items that are due beyond the last wheel wait in a heap.
+
+    Steps are integers, and `advance` must be called once per step.
+
+    Parameters
+    ----------
+    slots : int, optional
+        Number of slots of each wheel, by default 256
+    levels : int, optional
+        Number of wheels, by default 3
+    """
+
+    def __init__(self, slots: int = 256, levels: int = 3) -> None:
+        self.slots = slots
+        self.levels = levels
+        self.tick = 0
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow = []
+        self._counter = 0
+
+    def schedule(self, item: Hashable, tick: int) -> None:
+        """Make an item due at a future step
+
+        Parameters
+        ----------
+        item : hashable
+            Item to schedule
+        tick : int
+            Step when the item is due, which must come after the current one
+        """
+        if tick <= self.tick:
+            raise ValueError(
+                f"Items must be due after the current step {self.tick}, not at {tick}"
+            )
+        self._insert(item, tick)
+
+    def _insert(self, item: Hashable, tick: int) -> None:
+        remaining = tick - self.tick
+        span = 1
+        for wheel in self._wheels:
+            if remaining < span * self.slots:
+                wheel[(tick // span) % self.slots].append((tick, item))
+                return
+            span *= self.slots
+        heapq.heappush(self._overflow, (tick, self._counter, item))
+        self._counter += 1
+
+    def advance(self) -> List[Hashable]:
+        """Move to the next step
+
+        Returns
+        -------
+        list
+            Items that are due at the new step, in the order in which they
+            reached the first wheel
+        """
+        self.tick += 1
+        tick = self.tick
+        reach = self.slots**self.levels
+        if tick % reach == 0:
+            while self._overflow and self._overflow[0][0] < tick + reach:
+                due, _, item = heapq.heappop(self._overflow)
+                self._insert(item, due)
+        # Slots of the upper wheels that start at this step move down
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots**level
+            if tick % span == 0:
+                index = (tick // span) % self.slots
+                bucket = self._wheels[level][index]
+                self._wheels[level][index] = []
+                for due, item in bucket:
+                    self._insert(item, due)
+        index = tick % self.slots
+        bucket = self._wheels[0][index]
+        self._wheels[0][index] = []
+        return [item for _, item in bucket]
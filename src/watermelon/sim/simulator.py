@@ -5,16 +5,92 @@ Main functionality of the simulator, which takes a graph and a collection
 of agents and runs the simulation given their decisions.
 """
 
-from typing import List
+import copy
+import dataclasses
+from typing import Callable, Dict, List, Tuple
 
-from watermelon_common.logger import LOGGER
-from watermelon.model import Agent, Graph, Vertex, VertexAction
+from watermelon_common.logger import LOGGER, is_fast_logging
+from watermelon_common.logger import fast_logging as fast_logging_scope
+from watermelon.exceptions import InvalidCheckpointException
+from watermelon.model import Agent, AgentState, Decision, Graph
+from watermelon.sim.checkpoint import Checkpointer, load_checkpoint
+from watermelon.sim.conditions import Callback, StopCondition
+from watermelon.sim.context import SimulationContext
 from watermelon.sim.data_extractor import DataFrameExtractor, SimulationDataExtractor
+from watermelon.sim.engine import SimulationEngine, StepEngine
+from watermelon.sim.event_engine import EventEngine
+from watermelon.sim.vector_engine import VectorEngine
 from watermelon.sim.parameters import SimulationControl, SimulationParameters
+from watermelon.sim.queueing import AdmissionPolicy, FIFOAdmission
+from watermelon.sim.trace import TraceHook
+
+
+ENGINES = {"step": StepEngine, "event": EventEngine, "vector": VectorEngine}
+
+
+@dataclasses.dataclass
+class SimulationSnapshot:
+    """State of a simulator at some moment of a run, taken with
+    `Simulator.snapshot`
+
+    Attributes
+    ----------
+    control : SimulationControl
+        Control variables, including the time and iteration
+    context : SimulationContext
+        States, plans and queues of the vertices of the run
+    engine : object
+        State of the engine itself, if it has any
+    uncertainty : list of tuple
+        States of the uncertainty sources, each with an agent that uses it
+    data_extractor : SimulationDataExtractor
+        Copy of the data extractor, or None if the data wasn't captured
+    stop_conditions : list of StopCondition
+        Copies of the stop conditions, with their state
+    stopped_by : StopCondition
+        Condition that stopped the run, if any
+    """
+
+    control: SimulationControl
+    context: SimulationContext
+    engine: object
+    uncertainty: List[Tuple[Agent, dict]]
+    data_extractor: SimulationDataExtractor
+    stop_conditions: List[StopCondition]
+    stopped_by: StopCondition
 
 
 class Simulator:
-    """Object that simulates the graph"""
+    """Object that simulates the graph
+
+    Everything that changes during a run (the state of the agents and the
+    occupancy of the vertices) is owned by the `context` of the simulator,
+    which is created when the simulation starts. This way many simulators
+    can run in the same process, even from different threads, without
+    interfering with each other.
+
+    How time moves forward is decided by the engine of the simulator. The
+    step engine advances in fixed steps of `control.delta`, while the event
+    engine jumps from one event (an agent arriving to a vertex or finishing
+    an action) to the next one, so it stores data only when something
+    happens. The vector engine takes the same steps as the step engine, but
+    it updates every agent at once with arrays.
+
+    Besides finishing or reaching the stop time, a simulation can be
+    stopped early by its stop conditions, which are checked after every
+    update. The condition that stopped the last run is kept in
+    `stopped_by`.
+
+    Agents that arrive to a vertex that is full wait in the queue of the
+    vertex, and they are let in when other agents leave, in the order
+    given by the `admission` policy of the simulator.
+
+    A run can be captured at any moment with `snapshot` and brought back
+    with `restore`, and `fork` creates a new simulator that continues from
+    the current moment, possibly with different plans for some agents.
+    With a `checkpointer`, snapshots are written to disk periodically, and
+    `Simulator.resume` continues a run from its last checkpoint.
+    """
 
     def __init__(
         self,
@@ -24,6 +100,12 @@ class Simulator:
         control: SimulationControl = None,
         params: SimulationParameters = None,
         data_extractor_cls: type = DataFrameExtractor,
+        engine: str | type = "step",
+        stop_conditions: List[StopCondition | Callable] = None,
+        checkpointer: Checkpointer = None,
+        admission: AdmissionPolicy = None,
+        trace_hooks: List[TraceHook] = None,
+        fast_logging: bool = None,
         **kwargs,
     ) -> None:
         """Generate a simulation.
@@ -49,13 +131,127 @@ class Simulator:
             Class to use to extract data from the simulation, by default
             `DataFrameExtractor`. This class should inherit from the
             `SimulationDataExtractor` class.
+        engine : str or type, optional
+            Engine used to advance time, by default "step". It can be either
+            "step", "event" or "vector", or a class that inherits from the
+            `SimulationEngine` class.
+        stop_conditions : list of StopCondition or callable, optional
+            Conditions that stop the simulation early, by default None.
+            Functions are taken as conditions that hold when they return
+            True given the simulator.
+        checkpointer : Checkpointer, optional
+            Object that writes checkpoints of the simulation periodically, by
+            default None
+        admission : AdmissionPolicy, optional
+            Order in which the agents that wait for a vertex are let in, by
+            default None. If None, they are let in by their time of arrival.
+        trace_hooks : list of callable, optional
+            Functions that take every `TraceEvent` of the agents, by default
+            None
+        fast_logging : bool, optional
+            Whether to remove the log calls made for every agent at every
+            step, by default None. If None, the setting of the context where
+            the simulator runs holds (see `watermelon_common.logger`).
         """
         self.graph = graph
         self.agents = agents
         self.control = SimulationControl(**kwargs) if control is None else control
         self.params = SimulationParameters(**kwargs) if params is None else params
+        self._start_time = self.control.time
         self.data_extractor = None
+        self.context = None
         self._extractor_cls = data_extractor_cls
+        self._engine_cls = engine
+        if isinstance(engine, str):
+            try:
+                engine = ENGINES[engine]
+            except KeyError as exc:
+                raise ValueError(f"Unknown simulation engine {repr(engine)}") from exc
+        self.engine: SimulationEngine = engine(self)
+        self.stop_conditions = [
+            c if isinstance(c, StopCondition) else Callback(c)
+            for c in (stop_conditions or [])
+        ]
+        self.stopped_by = None
+        self.checkpointer = checkpointer
+        self.admission = FIFOAdmission() if admission is None else admission
+        self.trace_hooks: List[TraceHook] = list(trace_hooks or [])
+        self.fast_logging = fast_logging
+
+    @classmethod
+    def resume(
+        cls,
+        path: str,
+        graph: Graph,
+        agents: List[Agent],
+        *,
+        stop_conditions: List[StopCondition | Callable] = None,
+        admission: AdmissionPolicy = None,
+        checkpointer: Checkpointer = None,
+    ) -> "Simulator":
+        """Continue a simulation from a checkpoint
+
+        The run continues exactly as it would have done without stopping,
+        given the same graph, agents, stop conditions and admission policy.
+        Stop conditions and admission policies are not stored in the
+        checkpoint, only the state of the stop conditions, so they have to
+        be given again.
+
+        Parameters
+        ----------
+        path : str
+            Path of the checkpoint file
+        graph : Graph
+            Graph of the simulation
+        agents : List[Agent]
+            Agents of the simulation, matched by their identifiers
+        stop_conditions : list of StopCondition or callable, optional
+            Stop conditions of the simulation, in the same order as in the
+            original one, by default None
+        admission : AdmissionPolicy, optional
+            Admission policy of the simulation, by default None, which is
+            `FIFOAdmission`
+        checkpointer : Checkpointer, optional
+            Object that keeps writing checkpoints of the resumed simulation,
+            by default None
+
+        Returns
+        -------
+        Simulator
+            Simulator that is ready to be updated
+        """
+        conditions = [
+            copy.copy(c) if isinstance(c, StopCondition) else Callback(c)
+            for c in (stop_conditions or [])
+        ]
+        state = load_checkpoint(
+            path, graph, agents, stop_conditions=conditions, admission=admission
+        )
+        if len(state["stop_conditions"]) != len(conditions):
+            raise InvalidCheckpointException(
+                f"the checkpoint has {len(state['stop_conditions'])} stop "
+                f"conditions, but {len(conditions)} were given"
+            )
+        for condition, condition_state in zip(conditions, state["stop_conditions"]):
+            condition.setstate(condition_state)
+        snapshot = state["snapshot"]
+        sim = cls(
+            graph,
+            agents,
+            control=copy.copy(snapshot.control),
+            params=state["params"],
+            data_extractor_cls=state["data_extractor_cls"],
+            engine=state["engine"],
+            checkpointer=checkpointer,
+            admission=state["admission"],
+        )
+        sim._start_time = state["start_time"]
+        snapshot.data_extractor.resume(state["data"])
+        sim._restore(snapshot, snapshot.data_extractor)
+        if checkpointer is not None:
+            checkpointer.resume(path, state["data_size"], sim.data_extractor)
+        LOGGER.info("Resumed simulation @ time %.2f", sim.time)
+        return sim
 
     @property
     def time(self) -> float:
@@ -67,127 +263,250 @@ class Simulator:
         """Control variable that indicates if the simulation should end"""
         return self.control.should_close
 
+    @property
+    def states(self) -> Dict[Agent, AgentState]:
+        """State of each agent in the current run of the simulation"""
+        self.engine.sync()
+        return self.context.states
+
     def start(
         self,
         stop_time: float = None,
         *,
         extractor_cls: SimulationDataExtractor = None,
+        plans: Dict[Agent, List[Decision]] = None,
     ) -> None:
-        """Start the simulation. It must be ran before you start updating"""
+        """Start the simulation. It must be ran before you start updating
+
+        Parameters
+        ----------
+        stop_time : float, optional
+            Time when the simulation stops, by default None. If None, the
+            stop time of the control variables is kept.
+        extractor_cls : SimulationDataExtractor, optional
+            Class of the data extractor of this run, by default None. If
+            None, the one given to the simulator is used.
+        plans : dict, optional
+            Plans of some of the agents in this run, by default None. The
+            rest of the agents follow their own actions.
+        """
         LOGGER.info("Starting simulation")
-        if extractor_cls is not None:
-            self.data_extractor = extractor_cls(self)
-        else:
-            self.data_extractor = self._extractor_cls(self)
+        self.context = SimulationContext(self.agents)
+        for agent, plan in (plans or {}).items():
+            self.context.plans[agent] = list(plan)
+        self.control.time = self._start_time
         self.control.iteration = 0
         if stop_time is not None:
             self.control.stop_time = stop_time
         self.control.should_close = False
+        self.stopped_by = None
+        for condition in self.stop_conditions:
+            condition.reset()
+        with self.context.bound(), fast_logging_scope(self.fast_logging):
+            if extractor_cls is not None:
+                self.data_extractor = extractor_cls(self)
+            else:
+                self.data_extractor = self._extractor_cls(self)
+            self.engine.start()
 
     def update(self) -> None:
         """Update the simulation. Should be run at every timestep"""
-        LOGGER.debug(
-            "Iteration %i @ time %.2f", self.control.iteration, self.control.time
-        )
-        self.control.time += self.control.delta
-        self.control.should_close = self.control.time >= self.control.stop_time
-        self.control.iteration += 1
-
-        # State update code
-        finished_simulation = True
-        for agent in self.agents:
-            agent.state.action_time += self.control.delta
-            finished_simulation &= agent.state.is_done
-
-            if not (agent.state.is_done or agent.state.out_of_charge):
-                self._update_agent(agent)
-        self.control.should_close |= finished_simulation
-
-        if self.control.should_close and not finished_simulation:
-            LOGGER.warning("Reached stop time but some agents haven't finished")
-
-        # Store the data
-        try:
-            self.data_extractor.append(self)
-        except AttributeError:
-            LOGGER.error(
-                "Failed to append data to the extractor. Did you forget to start the simulation?"
-            )
+        if self.context is None:
+            LOGGER.error("Failed to update. Did you forget to start the simulation?")
             self.control.should_close = True
+            return
 
-    def _update_agent(self, agent: Agent) -> None:
-        decision = agent.actions[agent.state.current_action]
-        vertex, action = decision.tuple()
-        self._do_action(agent, vertex, action)
-        self._check_next_action(agent, vertex)
-
-    def _do_action(self, agent: Agent, vertex: Vertex, action: VertexAction) -> None:
-        if agent.state.is_travelling[0]:
-            # It is travelling to a vertex
-            _, origin, target = agent.state.is_travelling
-            edge = self.graph.get_edge(origin, target)
-            travel_time = edge.time
-            completion = (
-                agent.state.action_time / travel_time if travel_time != 0 else 1
-            )
-            LOGGER.debug(
-                "(%s|%i) %s->%s [%d%%]",
-                agent,
-                agent.state.current_action,
-                origin,
-                target,
-                100 * completion,
-            )
-            if agent.state.action_time > travel_time:
-                agent.state.is_travelling = (False, None, None)
-                agent.state.just_arrived = True
-                agent.state.action_time = 0
-                agent.insert_energy(-edge.weight, self.params.battery_eff)
-
-        if not agent.state.is_travelling[0]:
-            # It is doing some action
-            if agent.state.just_arrived:
-                vertex.members.add(agent)
-                agent.state.is_waiting = True
-                agent.state.just_arrived = False
-
-            if agent.state.is_waiting:
+        with self.context.bound(), fast_logging_scope(self.fast_logging):
+            if not is_fast_logging():
                 LOGGER.debug(
-                    "(%s|%i) waiting in %s", agent, agent.state.current_action, vertex
+                    "Iteration %i @ time %.2f",
+                    self.control.iteration,
+                    self.control.time,
                 )
-                agent.state.is_waiting = vertex.capacity < len(vertex.members)
-                if not agent.state.is_waiting:
-                    # This would happen when the agent stops waiting and acts
-                    agent.state.action_time = 0
-                    LOGGER.info("%s started (%s, %s)", agent, vertex, action)
-
-            if not agent.state.is_waiting:
-                time, energy = action.act(agent, vertex)
-                completion = agent.state.action_time / time if time != 0 else 1
-                LOGGER.debug(
-                    "(%s|%i) %s in %s [%d%%]",
-                    agent,
-                    agent.state.current_action,
-                    action,
-                    vertex,
-                    100 * completion,
+            finished_simulation = self.engine.update()
+            self.control.should_close = (
+                self.control.time >= self.control.stop_time or finished_simulation
+            )
+            for condition in self.stop_conditions:
+                if condition(self):
+                    LOGGER.info("Simulation stopped by %s", condition)
+                    self.stopped_by = condition
+                    self.control.should_close = True
+                    break
+
+            if self.control.should_close:
+                self.engine.sync()
+                if not (finished_simulation or self.stopped_by is not None):
+                    LOGGER.warning(
+                        "Reached stop time but some agents haven't finished"
+                    )
+
+            # Store the data
+            try:
+                self.data_extractor.append(self)
+            except AttributeError:
+                LOGGER.error(
+                    "Failed to append data to the extractor. Did you forget to start the simulation?"
                 )
-                if agent.state.action_time > time:
-                    vertex.members.discard(agent)
-                    agent.state.finished_action = True
-                    agent.insert_energy(energy, self.params.battery_eff)
-
-    def _check_next_action(self, agent: Agent, vertex: Vertex) -> None:
-        if agent.state.finished_action:
-            # Send the agent to sleep if there are no more actions left
-            if agent.state.current_action + 1 >= len(agent.actions):
-                LOGGER.info("Agent %s finished", agent)
-                agent.state.is_done = True
-                agent.state.action_time = 0
+                self.control.should_close = True
+
+        if self.checkpointer is not None:
+            self.checkpointer.update(self)
+        if self.control.should_close:
+            if self.data_extractor is not None:
+                self.data_extractor.close()
+            if self.checkpointer is not None:
+                self.checkpointer.close()
+
+    def snapshot(self, data: bool = True) -> SimulationSnapshot:
+        """Capture the current state of the run
+
+        Parameters
+        ----------
+        data : bool, optional
+            Whether to capture the data extracted so far as well, by default
+            True. Without it, a restored run only has the data from the
+            moment it is restored.
+
+        Returns
+        -------
+        SimulationSnapshot
+            State of the run, which is not affected by later updates
+        """
+        self.engine.sync()
+        sources = {}
+        for agent in self.agents:
+            sources.setdefault(id(agent.uncertainty), agent)
+        return SimulationSnapshot(
+            control=copy.copy(self.control),
+            context=self.context.copy(),
+            engine=self.engine.snapshot(),
+            uncertainty=[(a, a.uncertainty.getstate()) for a in sources.values()],
+            data_extractor=(
+                self.data_extractor.copy()
+                if data and self.data_extractor is not None
+                else None
+            ),
+            stop_conditions=[copy.copy(c) for c in self.stop_conditions],
+            stopped_by=self.stopped_by,
+        )
+
+    def restore(self, snapshot: SimulationSnapshot) -> None:
+        """Go back to a captured state of a run. The same snapshot can be
+        restored many times, so the simulator can be reused to evaluate
+        different continuations of a run
+
+        Parameters
+        ----------
+        snapshot : SimulationSnapshot
+            State to go back to, taken with `snapshot`
+        """
+        extractor = snapshot.data_extractor
+        self._restore(snapshot, None if extractor is None else extractor.copy())
+
+    def _restore(
+        self, snapshot: SimulationSnapshot, extractor: SimulationDataExtractor
+    ) -> None:
+        self.control = copy.copy(snapshot.control)
+        self.context = snapshot.context.copy()
+        self.stop_conditions = [copy.copy(c) for c in snapshot.stop_conditions]
+        self.stopped_by = snapshot.stopped_by
+        for agent, state in snapshot.uncertainty:
+            agent.uncertainty.setstate(state)
+        with self.context.bound():
+            self.engine.restore(snapshot.engine)
+            if extractor is not None:
+                self.data_extractor = extractor
             else:
-                next_vertex, _ = agent.actions[agent.state.current_action + 1].tuple()
-                if next_vertex is not vertex:
-                    agent.state.is_travelling = (True, vertex, next_vertex)
-                    agent.state.action_time = 0
-                agent.state.current_action += 1
-                agent.state.finished_action = False
+                self.data_extractor = self._extractor_cls(self)
+
+    def checkpoint_state(self) -> Dict:
+        """Capture everything that a checkpoint needs to resume the run.
+        The data extractor is captured with `SimulationDataExtractor.checkpoint`,
+        so only the data extracted since the last checkpoint is captured
+
+        Returns
+        -------
+        dict
+            Snapshot of the run, along with the state of the stop conditions,
+            new data, engine, extractor class, parameters, admission policy
+            and initial time of the simulator
+        """
+        snapshot = self.snapshot(data=False)
+        snapshot.data_extractor, data = self.data_extractor.checkpoint()
+        if self.stopped_by in self.stop_conditions:
+            # Conditions are stored by their position in the snapshot
+            index = self.stop_conditions.index(self.stopped_by)
+            snapshot.stopped_by = snapshot.stop_conditions[index]
+        return {
+            "snapshot": snapshot,
+            "stop_conditions": [c.getstate() for c in snapshot.stop_conditions],
+            "data": [] if data is None else [data],
+            "engine": type(self.engine),
+            "data_extractor_cls": self._extractor_cls,
+            "params": self.params,
+            "admission": self.admission,
+            "start_time": self._start_time,
+        }
+
+    def set_plan(self, agent: Agent, plan: List[Decision]) -> None:
+        """Change the plan of an agent in the current run. The actions that
+        the agent has already done are kept, so the plan should start the
+        same way as the previous one up to its current action
+
+        Parameters
+        ----------
+        agent : Agent
+            Agent whose plan is changed
+        plan : list of Decision
+            New plan of the agent
+        """
+        self.context.plans[agent] = list(plan)
+        with self.context.bound():
+            self.engine.replan()
+
+    def fork(
+        self, plans: Dict[Agent, List[Decision]] = None, *, data: bool = True
+    ) -> "Simulator":
+        """Create a new simulator that continues from the current moment of
+        the run, without affecting this one
+
+        Parameters
+        ----------
+        plans : dict, optional
+            New plans for some of the agents in the branch, by default None
+        data : bool, optional
+            Whether the branch starts with a copy of the data extracted so
+            far, by default True. Without it, the branch creates a new
+            extractor, so extractors that write to disk must be given a
+            different destination.
+
+        Returns
+        -------
+        Simulator
+            Simulator with the same graph, agents, parameters, engine,
+            extractor, admission policy, trace hooks and logging mode, which
+            is ready to be updated
+        """
+        branch = Simulator(
+            self.graph,
+            self.agents,
+            control=copy.copy(self.control),
+            params=self.params,
+            data_extractor_cls=self._extractor_cls,
+            engine=self._engine_cls,
+            admission=self.admission,
+            trace_hooks=self.trace_hooks,
+            fast_logging=self.fast_logging,
+        )
+        extractor = self.data_extractor
+        branch._restore(
+            self.snapshot(data=False),
+            extractor.copy() if data and extractor is not None else None,
+        )
+        for agent, plan in (plans or {}).items():
+            branch.context.plans[agent] = list(plan)
+        if plans:
+            with branch.context.bound():
+                branch.engine.replan()
+        return branch
@@ -0,0 +1,347 @@
+"""
+watermelon.sim.streaming
+------------------------
+Data extractor that streams the data of the simulation to disk in chunks,
+so that long simulations don't have to hold it in memory, and a reader
+for the chunks that it writes.
+"""
+
+import glob
+import os
+import queue
+import shutil
+import threading
+from typing import Dict, Hashable, Iterable, Iterator, List, Self, Tuple
+
+import pandas as pd
+
+from watermelon.sim.data import SimulationData
+from watermelon.sim.data_extractor import ColumnarExtractor, SimulationDataExtractor
+
+
+_FORMATS = {"csv": ".csv", "parquet": ".parquet"}
+_COLUMNS = ("time", "agent", *ColumnarExtractor.FIELDS, *ColumnarExtractor.FLAGS)
+
+
+def _chunk_paths(path: str, fmt: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(path, f"chunk-*{_FORMATS[fmt]}")))
+
+
+def _branch_path(path: str, index: int) -> str:
+    return os.path.join(path, f"branch-{index:03d}")
+
+
+def _clear(path: str, fmt: str) -> None:
+    """Remove the chunks and branches of a previous run in a directory"""
+    for old in _chunk_paths(path, fmt):
+        os.remove(old)
+    for old in glob.glob(os.path.join(path, "branch-*")):
+        shutil.rmtree(old)
+
+
+class StreamingExtractor(SimulationDataExtractor):
+    """Object that streams the data of the simulation to disk.
+
+    The data is written in long format, with one row per agent and step,
+    into a directory of chunks (`chunk-000000.csv`, `chunk-000001.csv`,
+    ...). At most `chunk_size` rows are kept in memory, and then they are
+    flushed as a new chunk. The columns are the same fields that
+    `ColumnarExtractor` stores, plus the time and the agent, and the
+    identifiers of the agents and vertices are written as strings.
+
+    Since the simulator creates the extractor by passing it only the
+    simulation, the rest of the arguments can be bound beforehand:
+
+    >>> extractor_cls = functools.partial(StreamingExtractor, path="out")
+    >>> sim = Simulator(graph, agents, data_extractor_cls=extractor_cls)
+
+    Once the simulation closes, `data` is a `ChunkReader` over the chunks.
+
+    Copying the extractor, which happens when a simulation is forked or
+    snapshotted with its data, branches the stream: the copy writes its
+    own chunks into a `branch-000`, `branch-001`, ... subdirectory, and
+    its reader goes through the chunks that the stream had written up to
+    that moment before its own ones.
+
+    In a checkpoint, the extractor only stores its position in the stream
+    and the rows that haven't been flushed. Loading it has no effect on
+    the disk, and it is `resume`, which `Simulator.resume` calls, that
+    deletes the chunks and branches written after the checkpoint.
+
+    Parameters
+    ----------
+    simulation_state : SimulationData
+        Simulation to extract the data from
+    path : str
+        Directory where the chunks are written. Chunks and branches of a
+        previous run in the same directory are deleted.
+    fmt : str, optional
+        Format of the chunks, either "csv" or "parquet", by default "csv".
+        Parquet requires pyarrow or fastparquet to be installed.
+    chunk_size : int, optional
+        Number of rows in each chunk, by default 100000
+    background : bool, optional
+        Whether to write the chunks from a background thread, by default
+        False. If True, the simulation only waits for the disk when there
+        are already two chunks waiting to be written.
+    """
+
+    def __init__(
+        self,
+        simulation_state: SimulationData,
+        path: str,
+        *,
+        fmt: str = "csv",
+        chunk_size: int = 100000,
+        background: bool = False,
+    ) -> None:
+        if fmt not in _FORMATS:
+            raise ValueError(f"Unknown format {repr(fmt)} for the chunks")
+        self.path = path
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.background = background
+        self._num_chunks = 0
+        self._num_branches = 0
+        self._parents: List[Tuple[str, int]] = []
+        self._buffer: Dict[str, list] = {c: [] for c in _COLUMNS}
+        self._error = None
+        self._queue = None
+        self._writer = None
+
+        os.makedirs(path, exist_ok=True)
+        _clear(path, fmt)
+        super().__init__(simulation_state)
+
+    @property
+    def data(self):
+        return ChunkReader(self.path, self.fmt, parents=self._parents)
+
+    @data.setter
+    def data(self, new_data: object):
+        pass
+
+    def _initialize(self, data: object) -> None:
+        self._append(data)
+
+    def _append(self, data: object) -> None:
+        _, time, states = data
+        buffer = self._buffer
+        buffer["time"].extend([time] * len(states))
+        buffer["agent"].extend(str(agent.id) for agent, _, _ in states)
+        buffer["vertex"].extend(str(v) for _, v, _ in states)
+        buffer["soc"].extend(s.soc for _, _, s in states)
+        buffer["payload"].extend(s.payload for _, _, s in states)
+        buffer["action"].extend(s.current_action for _, _, s in states)
+        buffer["action_time"].extend(s.action_time for _, _, s in states)
+        buffer["travelling"].extend(s.is_travelling[0] for _, _, s in states)
+        buffer["waiting"].extend(s.is_waiting for _, _, s in states)
+        buffer["done"].extend(s.is_done for _, _, s in states)
+        buffer["out_of_charge"].extend(s.out_of_charge for _, _, s in states)
+        buffer["overcharged"].extend(s.overcharged for _, _, s in states)
+        if len(buffer["time"]) >= self.chunk_size:
+            self.flush()
+
+    @staticmethod
+    def extract_data(simulation_state: SimulationData) -> object:
+        states = [
+            (a, a.actions[a.state.current_action].vertex.id, a.state)
+            for a in simulation_state.agents
+        ]
+        return None, simulation_state.time, states
+
+    def flush(self) -> None:
+        """Write the rows in memory as a new chunk"""
+        if self._error is not None:
+            raise self._error
+        if not self._buffer["time"]:
+            return
+        chunk = pd.DataFrame(self._buffer, columns=list(_COLUMNS))
+        path = os.path.join(
+            self.path, f"chunk-{self._num_chunks:06d}{_FORMATS[self.fmt]}"
+        )
+        self._num_chunks += 1
+        self._buffer = {c: [] for c in _COLUMNS}
+        os.makedirs(self.path, exist_ok=True)
+        if self.background and self._writer is None:
+            self._start_writer()
+        if self._queue is None:
+            self._write(chunk, path)
+        else:
+            self._queue.put((chunk, path))
+
+    def close(self) -> None:
+        """Flush the remaining rows and wait until every chunk is written"""
+        self.flush()
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+            self._queue = None
+        if self._error is not None:
+            raise self._error
+
+    def copy(self) -> Self:
+        if self._queue is not None:
+            # The branch reads the chunks written so far, so they must be on
+            # disk before it does
+            self._queue.join()
+        if self._error is not None:
+            raise self._error
+        other = StreamingExtractor.__new__(StreamingExtractor)
+        vars(other).update(vars(self))
+        other.path = _branch_path(self.path, self._num_branches)
+        self._num_branches += 1
+        other._num_chunks = 0
+        other._num_branches = 0
+        other._parents = [*self._parents, (self.path, self._num_chunks)]
+        other._buffer = {c: list(v) for c, v in self._buffer.items()}
+        other._queue = None
+        other._writer = None
+        if os.path.isdir(other.path):
+            _clear(other.path, self.fmt)
+        return other
+
+    def checkpoint(self) -> Tuple[Self, object]:
+        # The copy doesn't branch the stream, it stays at the same position
+        other = StreamingExtractor.__new__(StreamingExtractor)
+        vars(other).update(vars(self))
+        other._buffer = {c: list(v) for c, v in self._buffer.items()}
+        # Chunks that are still queued are written before the copy is stored
+        other._pending = self._queue
+        other._queue = None
+        other._writer = None
+        return other, None
+
+    def __getstate__(self) -> Dict:
+        state = dict(vars(self))
+        pending = state.pop("_pending", None)
+        if pending is not None:
+            pending.join()
+        state.update(_queue=None, _writer=None, _error=None)
+        return state
+
+    def resume(self, data: List[object]) -> None:
+        """Delete the chunks and branches written after the checkpoint, so
+        that the stream continues from it
+        """
+        for path in _chunk_paths(self.path, self.fmt)[self._num_chunks :]:
+            os.remove(path)
+        for path in sorted(glob.glob(os.path.join(self.path, "branch-*"))):
+            if int(os.path.basename(path)[len("branch-") :]) >= self._num_branches:
+                shutil.rmtree(path)
+
+    def _start_writer(self) -> None:
+        if self.background:
+            self._queue = queue.Queue(maxsize=2)
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def _write(self, chunk: pd.DataFrame, path: str) -> None:
+        if self.fmt == "csv":
+            chunk.to_csv(path, index=False)
+        else:
+            chunk.to_parquet(path, index=False)
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            try:
+                self._write(*item)
+            except Exception as exc:  # pylint: disable=broad-except
+                # The error is raised again from the simulation thread
+                self._error = exc
+            self._queue.task_done()
+
+
+class ChunkReader:
+    """Lazy reader of the chunks written by a `StreamingExtractor`
+
+    Chunks are only read when they are iterated, one at a time, so the
+    data of a simulation can be processed without loading all of it.
+
+    Parameters
+    ----------
+    path : str
+        Directory that holds the chunks
+    fmt : str, optional
+        Format of the chunks, by default "csv"
+    parents : list of tuple, optional
+        Chunks that come before the ones in `path`, for streams that were
+        branched from another one, as pairs of a directory and the number
+        of its chunks to read, by default None
+    """
+
+    def __init__(
+        self, path: str, fmt: str = "csv", parents: List[Tuple[str, int]] = None
+    ) -> None:
+        if fmt not in _FORMATS:
+            raise ValueError(f"Unknown format {repr(fmt)} for the chunks")
+        self.path = path
+        self.fmt = fmt
+        self.parents = list(parents or [])
+
+    def _paths(self) -> List[str]:
+        paths = []
+        for path, num_chunks in self.parents:
+            paths.extend(_chunk_paths(path, self.fmt)[:num_chunks])
+        return paths + _chunk_paths(self.path, self.fmt)
+
+    def __len__(self) -> int:
+        return len(self._paths())
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        for path in self._paths():
+            if self.fmt == "csv":
+                yield pd.read_csv(path, dtype={"agent": str, "vertex": str})
+            else:
+                yield pd.read_parquet(path)
+
+    def filter(
+        self,
+        agents: Iterable[Hashable] = None,
+        start: float = None,
+        stop: float = None,
+    ) -> Iterator[pd.DataFrame]:
+        """Iterate over the chunks, keeping only some of the rows
+
+        Parameters
+        ----------
+        agents : iterable, optional
+            Identifiers of the agents to keep, by default None. If None,
+            every agent is kept.
+        start, stop : float, optional
+            Keep only the rows with `start <= time < stop`, by default None.
+            If None, the range is not bounded on that side.
+
+        Yields
+        ------
+        pandas.DataFrame
+            Rows of each chunk that pass the filter
+        """
+        agents = None if agents is None else {str(a) for a in agents}
+        for chunk in self:
+            times = chunk["time"]
+            if stop is not None and times.iloc[0] >= stop:
+                return
+            mask = pd.Series(True, index=chunk.index)
+            if agents is not None:
+                mask &= chunk["agent"].isin(agents)
+            if start is not None:
+                mask &= times >= start
+            if stop is not None:
+                mask &= times < stop
+            if mask.any():
+                yield chunk[mask]
+
+    def read(self, **filters) -> pd.DataFrame:
+        """Read every chunk into a single DataFrame, taking the same filters
+        as `filter`
+        """
+        chunks = list(self.filter(**filters))
+        if not chunks:
+            return pd.DataFrame(columns=list(_COLUMNS))
+        return pd.concat(chunks, ignore_index=True)
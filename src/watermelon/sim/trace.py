@@ -0,0 +1,56 @@
+"""
+watermelon.sim.trace
+--------------------
+Structured events of the agents during a simulation, which are given to
+trace hooks instead of being logged.
+"""
+
+import dataclasses
+from typing import Callable
+
+from watermelon.model import Agent, Vertex
+
+
+# Kinds of trace events
+ARRIVED = "arrived"
+WAITING = "waiting"
+STARTED = "started"
+COMPLETED = "completed"
+FINISHED = "finished"
+
+
+@dataclasses.dataclass
+class TraceEvent:
+    """Something that happened to an agent during a simulation
+
+    The kinds of events are:
+
+    - `ARRIVED`: the agent got to the vertex of its action.
+    - `WAITING`: the agent joined the queue of a vertex that was full.
+    - `STARTED`: the agent started its action.
+    - `COMPLETED`: the agent completed its action.
+    - `FINISHED`: the agent completed the last action of its plan.
+
+    Attributes
+    ----------
+    time : float
+        Time of the simulation when it happened. With the step engines it
+        is the end of the step in which it happened.
+    kind : str
+        Kind of event
+    agent : Agent
+        Agent
+    action : int
+        Index of the action of the agent in its plan
+    vertex : Vertex
+        Vertex of the action
+    """
+
+    time: float
+    kind: str
+    agent: Agent
+    action: int
+    vertex: Vertex
+
+
+TraceHook = Callable[[TraceEvent], None]
@@ -0,0 +1,206 @@
+"""
+watermelon.sim.trajectory
+-------------------------
+Compact recording of the trajectories of the agents, which only stores
+the moments in which their state changes, and queries over them.
+"""
+
+import copy
+from typing import Dict, List, Self, Tuple
+
+import numpy as np
+import pandas as pd
+
+from watermelon.model import Agent
+from watermelon.sim.data import SimulationData
+from watermelon.sim.data_extractor import SimulationDataExtractor
+
+
+# Fields whose change makes a new sample
+_DISCRETE = ("action", "vertex", "travelling", "waiting", "done", "out_of_charge")
+_FIELDS = ("time", "soc", *_DISCRETE)
+
+
+class Trajectory:
+    """Samples of the state of an agent over time
+
+    Between two samples, the state of charge is interpolated linearly and
+    the rest of the fields keep the value of the previous sample.
+    """
+
+    def __init__(self, samples: Dict[str, list]) -> None:
+        self.time = np.array(samples["time"], dtype=np.float64)
+        self.soc = np.array(samples["soc"], dtype=np.float64)
+        self.action = np.array(samples["action"], dtype=np.int64)
+        self.vertex = np.empty(len(self.time), dtype=object)
+        self.vertex[:] = samples["vertex"]
+        self.travelling = np.array(samples["travelling"], dtype=bool)
+        self.waiting = np.array(samples["waiting"], dtype=bool)
+        self.done = np.array(samples["done"], dtype=bool)
+        self.out_of_charge = np.array(samples["out_of_charge"], dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """Samples as a DataFrame"""
+        return pd.DataFrame({f: getattr(self, f) for f in _FIELDS})
+
+    def at(self, times) -> pd.DataFrame:
+        """Reconstruct the state at the given times
+
+        Parameters
+        ----------
+        times : float or array_like
+            Times at which to evaluate the trajectory
+
+        Returns
+        -------
+        pandas.DataFrame
+            State at each time, indexed by time
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        previous = np.maximum(np.searchsorted(self.time, times, side="right") - 1, 0)
+        values = {"soc": np.interp(times, self.time, self.soc)}
+        for field in _DISCRETE:
+            values[field] = getattr(self, field)[previous]
+        return pd.DataFrame(values, index=pd.Index(times, name="time"))
+
+
+class ChangeExtractor(SimulationDataExtractor):
+    """Object that records the state of each agent only when it changes.
+
+    A sample of an agent is stored when its action, vertex or status
+    (travelling, waiting, done or out of charge) changes, or when its state
+    of charge moves away more than `soc_tolerance` from the last sample.
+    The state right before a change is stored as well, so that jumps in
+    the state of charge are not smeared when interpolating.
+
+    The data is a dictionary with the `Trajectory` of each agent, which can
+    reconstruct the state at any time.
+
+    Parameters
+    ----------
+    simulation_state : SimulationData
+        Simulation to extract the data from
+    soc_tolerance : float, optional
+        Largest change in the state of charge that is not sampled, by
+        default 1e-3
+    """
+
+    READS_ACTION_TIME = False
+
+    def __init__(
+        self, simulation_state: SimulationData, soc_tolerance: float = 1e-3
+    ) -> None:
+        self.soc_tolerance = soc_tolerance
+        self._agents: List[Agent] = []
+        self._samples: List[Dict[str, list]] = []
+        self._last: List[Tuple] = []
+        self._recorded: List[bool] = []
+        self._checkpointed: List[int] = []
+        self._trajectories = None
+        super().__init__(simulation_state)
+
+    @property
+    def data(self) -> Dict[Agent, Trajectory]:
+        if self._trajectories is None:
+            self._trajectories = {
+                a: Trajectory(s) for a, s in zip(self._agents, self._samples)
+            }
+        return self._trajectories
+
+    @data.setter
+    def data(self, new_data: object):
+        self._trajectories = new_data
+
+    def _record(self, i: int, row: Tuple) -> None:
+        for field, value in zip(_FIELDS, row):
+            self._samples[i][field].append(value)
+
+    def _initialize(self, data: Tuple) -> None:
+        self._agents, rows = data
+        self._samples = [{f: [] for f in _FIELDS} for _ in self._agents]
+        for i, row in enumerate(rows):
+            self._record(i, row)
+        self._last = rows
+        self._recorded = [True] * len(rows)
+        self._checkpointed = [0] * len(rows)
+
+    def _append(self, data: Tuple) -> None:
+        _, rows = data
+        tolerance = self.soc_tolerance
+        for i, row in enumerate(rows):
+            samples = self._samples[i]
+            if (
+                row[2:] != self._last[i][2:]
+                or abs(row[1] - samples["soc"][-1]) > tolerance
+            ):
+                if not self._recorded[i]:
+                    self._record(i, self._last[i])
+                self._record(i, row)
+                self._recorded[i] = True
+            else:
+                self._recorded[i] = False
+            self._last[i] = row
+        self._trajectories = None
+
+    def close(self) -> None:
+        """Store the last state of every agent, so that the trajectories
+        span the whole simulation
+        """
+        for i, row in enumerate(self._last):
+            if not self._recorded[i]:
+                self._record(i, row)
+                self._recorded[i] = True
+        self._trajectories = None
+
+    def copy(self) -> Self:
+        other = copy.copy(self)
+        other._samples = [{f: list(v) for f, v in s.items()} for s in self._samples]
+        other._last = list(self._last)
+        other._recorded = list(self._recorded)
+        other._checkpointed = [0] * len(self._agents)
+        return other
+
+    def checkpoint(self) -> Tuple[Self, object]:
+        # Only the samples taken since the last checkpoint are copied
+        new = [
+            {f: v[start:] for f, v in samples.items()}
+            for samples, start in zip(self._samples, self._checkpointed)
+        ]
+        self._checkpointed = [len(s["time"]) for s in self._samples]
+        other = copy.copy(self)
+        other._samples = None
+        other._last = list(self._last)
+        other._recorded = list(self._recorded)
+        other._trajectories = None
+        return other, new
+
+    def resume(self, data: List[object]) -> None:
+        self._samples = [{f: [] for f in _FIELDS} for _ in self._agents]
+        for new in data:
+            for samples, new_samples in zip(self._samples, new):
+                for field, values in new_samples.items():
+                    samples[field].extend(values)
+
+    @staticmethod
+    def extract_data(simulation_state: SimulationData) -> object:
+        time = simulation_state.time
+        rows = []
+        for a in simulation_state.agents:
+            state = a.state
+            rows.append(
+                (
+                    time,
+                    state.soc,
+                    state.current_action,
+                    a.actions[state.current_action].vertex.id,
+                    state.is_travelling[0],
+                    state.is_waiting,
+                    state.is_done,
+                    state.out_of_charge,
+                )
+            )
+        return simulation_state.agents, rows
@@ -0,0 +1,429 @@
+"""
+watermelon.sim.vector_engine
+----------------------------
+Engine that keeps the state of the agents in arrays, and advances all of
+them at once with vectorized operations.
+"""
+
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from watermelon_common.logger import LOGGER, is_fast_logging
+from watermelon.model import (
+    Agent,
+    AgentState,
+    Decision,
+    NoUncertainty,
+    Vertex,
+    VertexAction,
+)
+from watermelon.model.agent import _MINUTES_PER_HOUR
+from watermelon.sim.engine import SimulationEngine
+from watermelon.sim.plan import CompiledPlans
+from watermelon.sim.queueing import AdmissionPolicy, FIFOAdmission, VertexQueue
+from watermelon.sim.trace import ARRIVED, COMPLETED, FINISHED, STARTED, WAITING
+
+
+class VectorKernel(CompiledPlans):
+    """Struct of arrays with the state of many simulated agents
+
+    Each lane of the kernel is one agent following one plan. The fields of
+    `AgentState` are stored as one array per field, next to the compiled
+    plans of the lanes. Every call to `step` applies the same rules as
+    `StepEngine` to all lanes at once.
+
+    Lanes are split in groups that don't share vertices, so that each group
+    has its own queues in the vertices with limited capacity. The queues
+    hold lanes, and they are kept in `queues` by vertex and group.
+
+    The kernel logs the lanes that finish unless `verbose` is unset, which
+    by default follows the fast logging mode. If `trace` is set, it is
+    called as `trace(kind, lanes, k)` with the lanes of each kind of
+    `TraceEvent` in a step and the decisions they refer to.
+
+    Parameters
+    ----------
+    graph : watermelon.model.Graph
+        Graph where the agents move
+    agents : list of watermelon.model.Agent
+        Agent of each lane, used for its battery and uncertainty source
+    plans : list of list of watermelon.model.Decision
+        Plan that each lane follows
+    states : list of watermelon.model.AgentState
+        Initial state of each lane
+    battery_eff : float
+        Efficiency of the batteries
+    act : callable
+        Function `act(lane, action, vertex)` that returns the time and
+        energy of an action whose values can't be computed with arrays
+    groups : sequence of int, optional
+        Group of each lane, by default None. If None, every lane is in the
+        same group.
+    admission : AdmissionPolicy, optional
+        Order in which the lanes that wait for a vertex are let in, by
+        default None. If None, they are let in by their time of arrival.
+    time : float, optional
+        Time of the lanes before the first step, by default 0
+    """
+
+    # Arrays that change while the lanes are simulated
+    STATE = (
+        "soc",
+        "current_action",
+        "action_time",
+        "finished",
+        "waiting",
+        "done",
+        "travelling",
+        "arrived",
+        "out_of_charge",
+        "overcharged",
+        "time",
+        "energy",
+        "pending",
+        "changed",
+    )
+
+    def __init__(
+        self,
+        graph,
+        agents: Sequence[Agent],
+        plans: Sequence[List[Decision]],
+        states: Sequence[AgentState],
+        battery_eff: float,
+        act: Callable[[int, VertexAction, Vertex], Tuple[float, float]],
+        groups: Sequence[int] = None,
+        admission: AdmissionPolicy = None,
+        time: float = 0,
+    ) -> None:
+        self._act = act
+        num_lanes = len(plans)
+        groups = np.zeros(num_lanes, dtype=np.int64) if groups is None else groups
+        self.group = np.asarray(groups, dtype=np.int64)
+        self.num_groups = int(np.max(groups, initial=0)) + 1
+        self.admission = FIFOAdmission() if admission is None else admission
+        self.now = time
+        self.queues: Dict[Tuple[Vertex, int], VertexQueue] = {}
+        self.verbose = not is_fast_logging()
+        self.trace: Callable[[str, np.ndarray, np.ndarray], None] = None
+        super().__init__(graph, agents, plans)
+
+        self.scale = np.array([battery_eff * a.battery_capacity for a in agents])
+        # Lanes that share an uncertainty source take their samples together
+        sources = {}
+        self.source = np.array(
+            [sources.setdefault(id(a.uncertainty), len(sources)) for a in agents],
+            dtype=np.int64,
+        )
+        self.sources = list({id(a.uncertainty): a.uncertainty for a in agents}.values())
+
+        self.soc = np.array([s.soc for s in states], dtype=np.float64)
+        self.current_action = np.array([s.current_action for s in states])
+        self.action_time = np.array([s.action_time for s in states], dtype=np.float64)
+        self.finished = np.array([s.finished_action for s in states])
+        self.waiting = np.array([s.is_waiting for s in states])
+        self.done = np.array([s.is_done for s in states])
+        self.travelling = np.array([s.is_travelling[0] for s in states])
+        self.arrived = np.array([s.just_arrived for s in states])
+        self.out_of_charge = np.array([s.out_of_charge for s in states])
+        self.overcharged = np.array([s.overcharged for s in states])
+        self.time = np.zeros(num_lanes)
+        self.energy = np.zeros(num_lanes)
+        self.pending = np.ones(num_lanes, dtype=bool)
+        self.changed = np.arange(num_lanes)
+
+        # Lanes that start waiting queue up in order
+        k = np.minimum(self.offsets[:-1] + self.current_action, len(self.vertex) - 1)
+        waiting = np.flatnonzero(self.waiting & ~(self.travelling | self.done))
+        self.waiting[waiting] = False
+        touched = self._enqueue(waiting, self.vertex[k])
+        self.action_time[self._admit(touched)] = 0
+
+    def _queue(self, slot: int, lane: int) -> VertexQueue:
+        key = (self.vertices[slot], int(self.group[lane]))
+        try:
+            return self.queues[key]
+        except KeyError:
+            return self.queues.setdefault(key, VertexQueue(self.capacity[slot]))
+
+    def _enqueue(self, lanes: np.ndarray, slot: np.ndarray) -> List[VertexQueue]:
+        """Make the lanes that arrive to a vertex with limited capacity wait
+        in its queue, and return the queues
+        """
+        queued = lanes[np.isfinite(self.capacity[slot[lanes]])]
+        self.waiting[queued] = True
+        touched = []
+        for i in queued.tolist():
+            queue = self._queue(slot[i], i)
+            queue.push(i, self.admission.priority(self.agents[i], self.now))
+            touched.append(queue)
+        return touched
+
+    def _admit(self, touched: List[VertexQueue]) -> np.ndarray:
+        """Let in the lanes that fit in some queues, and return them"""
+        admitted = np.array([i for q in touched for i in q.admit()], dtype=np.int64)
+        self.waiting[admitted] = False
+        return admitted
+
+    def _emit(self, kind: str, lanes: np.ndarray, k: np.ndarray) -> None:
+        if self.trace is not None and len(lanes):
+            self.trace(kind, lanes, k)
+
+    def _insert_energy(self, lanes: np.ndarray, energy: np.ndarray) -> None:
+        soc = self.soc[lanes]
+        new_soc = soc + energy / self.scale[lanes]
+        for i in lanes[(soc != 0) & (new_soc <= 0)].tolist():
+            LOGGER.warning("%s out of charge", self.agents[i])
+        empty = new_soc <= 0
+        full = new_soc > 1
+        normal = ~(empty | full)
+        self.soc[lanes] = np.where(empty, 0, new_soc)
+        self.out_of_charge[lanes[empty]] = True
+        self.overcharged[lanes[full]] = True
+        self.out_of_charge[lanes[normal]] = False
+        self.overcharged[lanes[normal]] = False
+
+    def _noise(self, lanes: np.ndarray, draws: int) -> np.ndarray:
+        """Samples of the uncertainty sources of some lanes, with one row per
+        draw. Each source gives all the samples of its lanes in one call
+        """
+        noise = np.zeros((draws, len(lanes)))
+        source = self.source[lanes]
+        for s in np.unique(source).tolist():
+            if isinstance(self.sources[s], NoUncertainty):
+                continue
+            mask = source == s
+            samples = self.sources[s].sample_array(draws * int(mask.sum()))
+            noise[:, mask] = samples.reshape(-1, draws).T
+        return noise
+
+    def _compute_actions(self, lanes: np.ndarray) -> None:
+        k = self.offsets[lanes] + self.current_action[lanes]
+        code = self.code[k]
+
+        constant = code == self.CONSTANT
+        self.time[lanes[constant]] = self.action_time_k[k[constant]]
+        self.energy[lanes[constant]] = self.action_energy_k[k[constant]]
+
+        charge = code == self.CHARGE
+        lanes_c = lanes[charge]
+        k_c = k[charge]
+        # The state of charge is measured twice, like `ChargeBatteryAction`
+        # does, to compare it with the limit and to compute the energy
+        noise = self._noise(lanes_c, 2)
+        soc = self.soc[lanes_c]
+        limit = self.limit[k_c]
+        below = np.clip(soc + noise[0], 0, 1) < limit
+        energy = (limit - np.clip(soc + noise[1], 0, 1)) * self.charge_scale[k_c]
+        time = _MINUTES_PER_HOUR * energy / self.power[k_c]
+        self.time[lanes_c] = np.where(below, time, 0)
+        self.energy[lanes_c] = np.where(below, energy, 0)
+
+        # Forbidden actions raise their error when they are called
+        generic = (code == self.GENERIC) | (code == self.FORBIDDEN)
+        for i, j in zip(lanes[generic].tolist(), k[generic].tolist()):
+            self.time[i], self.energy[i] = self._act(
+                i, self.actions[j], self.vertices[self.vertex[j]]
+            )
+        self.pending[lanes] = False
+
+    def step(self, delta: float) -> bool:
+        """Advance every lane by a step of the given length
+
+        Besides the action time, only the lanes in `changed` are modified.
+
+        Returns
+        -------
+        bool
+            Whether every lane had finished before the step
+        """
+        self.action_time += delta
+        self.now += delta
+        finished_all = bool(self.done.all())
+        active = ~(self.done | self.out_of_charge)
+        k = np.minimum(self.offsets[:-1] + self.current_action, len(self.vertex) - 1)
+
+        # Travels
+        travelling = active & self.travelling
+        missing = travelling & np.isnan(self.edge_time[k])
+        if missing.any():
+            i = np.flatnonzero(missing)[0]
+            self.graph.get_edge(
+                self.vertices[self.vertex[k[i] - 1]], self.vertices[self.vertex[k[i]]]
+            )
+        arrive = np.flatnonzero(travelling & (self.action_time > self.edge_time[k]))
+        self.travelling[arrive] = False
+        self.arrived[arrive] = True
+        self.action_time[arrive] = 0
+        self._insert_energy(arrive, -self.edge_energy[k[arrive]])
+        self._emit(ARRIVED, arrive, k[arrive])
+
+        # Actions
+        acting = active & ~self.travelling
+        arrivals = np.flatnonzero(acting & self.arrived)
+        self.arrived[arrivals] = False
+        slot = self.vertex[k]
+        touched = self._enqueue(arrivals, slot)
+        # Vertices without limit are entered right away
+        entered = arrivals[~self.waiting[arrivals]]
+        queued = arrivals[self.waiting[arrivals]]
+        self._emit(WAITING, queued, k[queued])
+
+        busy = acting & ~self.waiting
+        busy[arrivals] = False
+        self._compute_actions(np.flatnonzero(busy & self.pending))
+        complete = np.flatnonzero(busy & (self.action_time > self.time))
+        for i in complete[np.isfinite(self.capacity[slot[complete]])].tolist():
+            queue = self._queue(slot[i], i)
+            queue.leave(i)
+            touched.append(queue)
+
+        admitted = self._admit(touched)
+        started = np.union1d(entered, admitted)
+        self.action_time[started] = 0
+        self._compute_actions(started)
+        self._emit(STARTED, started, k[started])
+
+        self.finished[complete] = True
+        self._insert_energy(complete, self.energy[complete])
+        self._emit(COMPLETED, complete, k[complete])
+
+        # Next actions
+        last = self.current_action[complete] + 1 >= self.length[complete]
+        ending = complete[last]
+        self.done[ending] = True
+        self.action_time[ending] = 0
+        if self.verbose:
+            for i in ending.tolist():
+                LOGGER.info("Agent %s finished", self.agents[i])
+        self._emit(FINISHED, ending, k[ending])
+        moving = complete[~last]
+        k_next = k[moving] + 1
+        travel = self.vertex[k_next] != self.vertex[k[moving]]
+        self.travelling[moving[travel]] = True
+        self.action_time[moving[travel]] = 0
+        self.pending[moving] = True
+        self.current_action[moving] += 1
+        self.finished[moving] = False
+        self._emit(STARTED, moving[~travel], k_next[~travel])
+
+        self.changed = np.unique(np.concatenate([arrive, arrivals, admitted, complete]))
+        return finished_all
+
+    def lane_state(self, i: int) -> AgentState:
+        """Build the state of one lane"""
+        state = AgentState()
+        self.write_state(i, state)
+        return state
+
+    def write_state(self, i: int, state: AgentState) -> None:
+        """Copy the state of one lane into an `AgentState`"""
+        k = self.offsets[i] + self.current_action[i]
+        state._soc = float(self.soc[i])  # pylint: disable=protected-access
+        state.current_action = int(self.current_action[i])
+        state.action_time = float(self.action_time[i])
+        state.finished_action = bool(self.finished[i])
+        state.is_waiting = bool(self.waiting[i])
+        state.is_done = bool(self.done[i])
+        state.just_arrived = bool(self.arrived[i])
+        state.out_of_charge = bool(self.out_of_charge[i])
+        state.overcharged = bool(self.overcharged[i])
+        if self.travelling[i]:
+            state.is_travelling = (
+                True,
+                self.vertices[self.vertex[k - 1]],
+                self.vertices[self.vertex[k]],
+            )
+        else:
+            state.is_travelling = (False, None, None)
+
+
+class VectorEngine(SimulationEngine):
+    """Engine that advances every agent at once, in fixed steps
+
+    The state of the agents is kept in a `VectorKernel`, which follows the
+    same rules as `StepEngine`. The lanes that change are copied into the
+    states of the simulation after every step, while the action time is
+    only copied when it is read, like the parked agents of `StepEngine`.
+    It pays off for large fleets, where the loop over the agents of the
+    step engine dominates.
+
+    The durations of actions are computed once, when they start. Charging
+    with an uncertainty source takes the samples of every lane that starts
+    to charge from its source with a single call, and actions other than
+    `NullAction`, `WaitAction` and `ChargeBatteryAction` are computed by
+    calling the action.
+    """
+
+    def __init__(self, sim) -> None:
+        super().__init__(sim)
+        self.kernel = None
+        self._states = []
+
+    def start(self) -> None:
+        self._check_outputs()
+        self._states = [self.sim.context.states[a] for a in self.sim.agents]
+        self.kernel = VectorKernel(
+            self.sim.graph,
+            self.sim.agents,
+            [a.actions for a in self.sim.agents],
+            self._states,
+            self.sim.params.battery_eff,
+            self._act,
+            admission=self.sim.admission,
+            time=self.sim.control.time,
+        )
+
+    def snapshot(self) -> object:
+        arrays = {
+            name: getattr(self.kernel, name).copy() for name in VectorKernel.STATE
+        }
+        return arrays, {key: q.copy() for key, q in self.kernel.queues.items()}
+
+    def restore(self, snapshot: object) -> None:
+        # The kernel is built again from the restored plans. Queues are kept
+        # by vertex, so they don't depend on the slots of the new plans
+        arrays, queues = snapshot
+        self.start()
+        for name, value in arrays.items():
+            setattr(self.kernel, name, value.copy())
+        self.kernel.queues = {key: q.copy() for key, q in queues.items()}
+
+    def replan(self) -> None:
+        # The plans are compiled again, keeping the state of every lane
+        self.kernel.compile([a.actions for a in self.sim.agents])
+
+    def _act(self, i: int, action: VertexAction, vertex: Vertex) -> Tuple[float, float]:
+        agent = self.sim.agents[i]
+        self.kernel.write_state(i, agent.state)
+        return action.act(agent, vertex)
+
+    def _trace_lanes(self, kind: str, lanes: np.ndarray, k: np.ndarray) -> None:
+        offsets = self.kernel.offsets
+        for i, j in zip(lanes.tolist(), k.tolist()):
+            vertex = self.kernel.vertices[self.kernel.vertex[j]]
+            self._trace(kind, self.sim.agents[i], j - int(offsets[i]), vertex)
+
+    def update(self) -> bool:
+        self._check_outputs()
+        self.kernel.verbose = self._verbose
+        self.kernel.trace = self._trace_lanes if self._tracing else None
+        control = self.sim.control
+        control.time += control.delta
+        control.iteration += 1
+        finished_simulation = self.kernel.step(control.delta)
+
+        # Only the action time changes for every agent at every step, and it
+        # is copied only when it is read
+        for i in self.kernel.changed.tolist():
+            self.kernel.write_state(i, self._states[i])
+        if self._reads_action_time():
+            self.sync()
+        return finished_simulation
+
+    def sync(self) -> None:
+        for state, action_time in zip(
+            self._states, self.kernel.action_time.tolist()
+        ):
+            state.action_time = action_time
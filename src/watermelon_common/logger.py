@@ -5,15 +5,24 @@ Creation and setup for the logger used by watermelon and its related
 packages.
 """
 
+import contextlib
+import contextvars
 import logging
 import os
 from datetime import datetime
+from typing import Iterator
 
 from watermelon_utils.console import AsciiColors
 
 
 LOGGER = logging.Logger("watermelon")
 
+# Whether the log calls of the hot paths are removed, for every simulation
+# and for the ones in the current context. None in the context means that
+# the global setting holds
+_FAST_LOGGING = False
+_FAST_LOGGING_SCOPE = contextvars.ContextVar("fast_logging", default=None)
+
 # Formatter for the files
 log_fmt = logging.Formatter(
     fmt="[%(asctime)s](%(filename)s:%(lineno)d) %(levelname)s :: %(message)s",
@@ -45,7 +54,53 @@ class CustomFormatter(logging.Formatter):
         return formatter.format(record)
 
 
-def setup_logger(quiet=False, debug=False, verbose=False, log_dir=False):
+def set_fast_logging(enabled: bool = True) -> None:
+    """Remove the log calls of the hot paths of watermelon, like the ones
+    made for every agent at every step of a simulation, or bring them back.
+
+    Those calls cost time even when their level is disabled, so in fast
+    mode they are skipped altogether. Messages about the simulation as a
+    whole, warnings and errors are still logged.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Whether to enable the fast mode, by default True
+    """
+    global _FAST_LOGGING  # pylint: disable=global-statement
+    _FAST_LOGGING = enabled
+
+
+def is_fast_logging() -> bool:
+    """Whether the log calls of the hot paths are removed in the current
+    context
+    """
+    enabled = _FAST_LOGGING_SCOPE.get()
+    return _FAST_LOGGING if enabled is None else enabled
+
+
+@contextlib.contextmanager
+def fast_logging(enabled: bool | None = True) -> Iterator[None]:
+    """Enable or disable the fast mode of `set_fast_logging` within the
+    current context only
+
+    Parameters
+    ----------
+    enabled : bool or None, optional
+        Whether to enable the fast mode, by default True. If None, the
+        current setting is kept.
+    """
+    if enabled is None:
+        yield
+        return
+    token = _FAST_LOGGING_SCOPE.set(enabled)
+    try:
+        yield
+    finally:
+        _FAST_LOGGING_SCOPE.reset(token)
+
+
+def setup_logger(quiet=False, debug=False, verbose=False, log_dir=False, fast=None):
     """Setup the logger.
 
     This must be run at the beginning of every program that uses
@@ -69,7 +124,13 @@ def setup_logger(quiet=False, debug=False, verbose=False, log_dir=False):
         with the current time and date as name, and if it corresponds
         to a file then it outputs to the given file, overwriting if
         necessary
+    fast : bool, optional
+        Remove the log calls of the hot paths of the simulations, by
+        default None. If None, the current setting is kept. See
+        `set_fast_logging`.
     """
+    if fast is not None:
+        set_fast_logging(fast)
 
     if not quiet:
         # Stream logger
@@ -28,25 +28,12 @@ def _get_times(*decisions, graph, sim):
     while not sim.should_close:
         sim.update()
 
-    times = {a: None for a in sim.data_extractor.data}
-    finished = {a: False for a in sim.data_extractor.data}
-
-    # This code is coupled with the data extractor
-    # TODO: Figure out a better way to extract data from each simulation
-    for row in sim.data_extractor.data.iloc[::-1].iloc:
-        for a, data in row.items()[1:]:
-            if times[a] is not None:
-                # Go to the next agent if we already found this
-                # solution
-                break
-
-            # Inmediately give the minimum reward if an agent runs
-            # out of charge
-            if data.state.out_of_charge:
-                return None
-            if not data.is_done and finished[a]:
-                times[a] = row["time"]
-    return times
+    # Inmediately give the minimum reward if an agent runs out of charge or
+    # doesn't finish
+    summaries = sim.data_extractor.data
+    if any(s.out_of_charge or not s.finished for s in summaries.values()):
+        return None
+    return {a: s.finish_time for a, s in summaries.items()}
 
 
 def _arithmetic_statistic(*decisions, graph, sim):
@@ -61,6 +48,16 @@ def _cumulative_statistic(*decisions, graph, sim):
     return -np.sum(list(times.values()))
 
 
+def _batch_statistic(statistic, result: wm.sim.BatchResult) -> np.ndarray:
+    # Scenarios where some agent doesn't finish get the minimum reward
+    valid = ~result.out_of_charge.any(axis=1) & result.finished.all(axis=1)
+    fitness = np.full(len(valid), MINIMUM_REWARD)
+    fitness[valid] = -np.sum(result.finish_times[valid], axis=1)
+    if statistic is _arithmetic_statistic:
+        fitness[valid] /= result.finish_times.shape[1]
+    return fitness
+
+
 class AgentFitness:
     """Object for the fitness function of the actions of agents in a graph"""
 
@@ -77,6 +74,10 @@ class AgentFitness:
     ) -> None:
         self._agents = agents
         self.decoder = ActionDecoder() if decoder is None else decoder()
+        kwargs.setdefault("data_extractor_cls", wm.sim.SummaryExtractor)
+        # Runs where an agent runs out of charge get the minimum reward, so
+        # there is no need to simulate them any further
+        kwargs.setdefault("stop_conditions", [wm.sim.AnyOutOfCharge()])
         self.sim = wm.sim.Simulator(None, self._agents, **kwargs)
         self._sim_kwargs = kwargs
 
@@ -111,5 +112,36 @@ class AgentFitness:
         decisions = self.decoder(code)
         return self.statistic(*decisions, graph=graph, sim=self.sim)
 
+    def evaluate_population(
+        self, codes: List[List[bool]], graph: wm.Graph
+    ) -> np.ndarray:
+        """Evaluate the actions of a whole population at once
+
+        Every individual is simulated in the same batch, so the cost is
+        close to the one of a single vectorized simulation. Custom
+        statistics can't be computed from a batch, so with them each
+        individual is evaluated on its own.
+
+        Parameters
+        ----------
+        codes : list of list of bool
+            Code of each individual
+        graph : watermelon.model.Graph
+            Graph where the agents move
+
+        Returns
+        -------
+        numpy.ndarray
+            Fitness of each individual
+        """
+        if self.statistic not in (_cumulative_statistic, _arithmetic_statistic):
+            return np.array([self.evaluate(code, graph) for code in codes])
+
+        population = [self.decoder(code) for code in codes]
+        result = wm.sim.simulate_batch(
+            graph, self._agents, population, **self._sim_kwargs
+        )
+        return _batch_statistic(self.statistic, result)
+
     def __call__(self, chrom: genus.Chromosome, graph: wm.Graph) -> float:
         return self.evaluate(chrom.code, graph)
@@ -1,5 +1,8 @@
 """Unittest for graphs"""
 
+import numpy as np
+import pytest
+
 import watermelon as wm
 
 
@@ -25,3 +28,81 @@ def test_get():
 
     assert graph.neighbors(2) == [wm.Vertex(0), wm.Vertex(4)]
     assert set(edges) == set(graph.edges)
+
+
+def test_edges():
+    """Test edge lookups on the compressed rows"""
+    graph = wm.Graph(
+        [wm.Vertex(i) for i in range(3)],
+        [
+            wm.Edge(wm.Vertex(0), wm.Vertex(1), 10, 2),
+            wm.Edge(wm.Vertex(1), wm.Vertex(2), 5),
+        ],
+    )
+    assert graph.get_edge(0, 1) == wm.Edge(wm.Vertex(0), wm.Vertex(1), 10, 2)
+    assert graph.get_edge(1, 2).time is None
+    assert graph.adjacent(0, 1)
+    assert not graph.adjacent(1, 0)
+    with pytest.raises(wm.exceptions.NonExistentEdgeException):
+        graph.get_edge(2, 0)
+
+    # Replacing an edge keeps a single edge between the vertices
+    graph.add_edge(wm.Edge(wm.Vertex(0), wm.Vertex(1), 3, 1))
+    assert graph.num_edges == 2
+    assert graph.get_edge(0, 1).weight == 3
+    assert graph.adj_mat[wm.Vertex(1)][wm.Vertex(0)].weight == 3
+
+    # Incoming edges are indexed again after the graph changes
+    assert graph.neighbors(1) == [wm.Vertex(0)]
+    graph.add_edge(wm.Edge(wm.Vertex(2), wm.Vertex(1), 1, 1))
+    assert graph.neighbors(1) == [wm.Vertex(0), wm.Vertex(2)]
+
+
+def test_from_arrays():
+    """Test the bulk constructors"""
+    graph = wm.Graph.from_arrays(
+        ["a", "b", "c"],
+        ["a", "b", "a"],
+        ["b", "c", "c"],
+        [1, 2, None],
+        types=[None, wm.EVChargerType(10), None],
+        capacities=[np.nan, 2, np.nan],
+    )
+    assert graph.num_edges == 3
+    assert graph.get_edge("a", "c").weight is None
+    assert graph.get_edge("b", "c").weight == 2
+    assert isinstance(wm.Vertex("b").type, wm.EVChargerType)
+    assert wm.Vertex("b").capacity == 2
+
+    same = wm.Graph.from_networkx(graph.to_networkx())
+    assert set(same.edges) == set(graph.edges)
+
+    for origins, targets in [(["a"], ["d"]), (["a", "a"], ["b", "b"])]:
+        with pytest.raises(wm.exceptions.InvalidGraphException):
+            wm.Graph.from_arrays(["a", "b", "c"], origins, targets)
+
+    # Vertices that are alive can't be given other types or capacities
+    with pytest.raises(wm.exceptions.InvalidGraphException):
+        wm.Graph.from_arrays(["b"], [], [], types=[wm.EVChargerType(20)])
+    with pytest.raises(wm.exceptions.InvalidGraphException):
+        wm.Graph.from_arrays(["b"], [], [], types=[wm.EVChargerType(10)])
+    with wm.registry_scope():
+        other = wm.Graph.from_arrays(["b"], [], [], capacities=[3])
+        assert other.vertex_at(0).capacity == 3
+
+
+def test_shortest_paths():
+    """Test the cached shortest travel times and energies"""
+    graph = wm.Graph.from_arrays(
+        np.arange(4), [0, 1, 0, 2], [1, 2, 2, 3], [1, 1, 5, 1], [4, 4, 1, 1]
+    )
+    assert graph.travel_energy(0, 2) == 2
+    assert graph.travel_time(0, 2) == 1
+    assert graph.time_matrix[0, 3] == 2
+    assert np.isinf(graph.time_matrix[3, 0])
+
+    # Only the rows that reach the new edge are recomputed
+    graph.add_edge(wm.Edge(wm.Vertex(3), wm.Vertex(0), 1, 1))
+    assert graph.time_matrix[3, 0] == 1
+    assert graph.time_matrix[2, 1] == 6
+    assert graph.energy_matrix[2, 1] == 3
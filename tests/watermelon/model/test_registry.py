@@ -0,0 +1,40 @@
+"""Unittest for the registries of singletons"""
+
+import gc
+import threading
+
+import watermelon as wm
+
+
+def test_scopes():
+    """Test that scopes don't share singletons"""
+    outer = wm.Vertex("scoped", 1)
+    with wm.registry_scope() as registry:
+        inner = wm.Vertex("scoped", 2, wm.EVChargerType(10))
+        graph = wm.Graph([inner])
+        assert inner is not outer
+        assert wm.Vertex("scoped") is inner
+        assert graph.registry is registry
+    assert wm.Vertex("scoped") is outer
+
+    with wm.registry_scope(graph.registry):
+        assert wm.Vertex("scoped") is inner
+
+    # Threads start in the global scope
+    found = []
+    with wm.registry_scope():
+        thread = threading.Thread(target=lambda: found.append(wm.Vertex("scoped")))
+        thread.start()
+        thread.join()
+    assert found[0] is outer
+
+
+def test_weak_references():
+    """Test that singletons are collected once they are not used"""
+    with wm.registry_scope() as registry:
+        graph = wm.Graph([wm.Vertex(i) for i in range(10)])
+        agent = wm.Agent(0, graph)
+        assert len(registry) == 11
+        del graph, agent
+        gc.collect()
+        assert len(registry) == 0
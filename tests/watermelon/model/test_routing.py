@@ -0,0 +1,41 @@
+"""Unittest for routing"""
+
+import numpy as np
+
+import watermelon as wm
+
+
+def _graph():
+    # Direct path 0->3 is fast but uses too much energy, while the detour
+    # through the charger 1 is feasible
+    return wm.Graph.from_arrays(
+        ["r0", "r1", "r2", "r3"],
+        ["r0", "r0", "r1", "r2"],
+        ["r3", "r1", "r2", "r3"],
+        [60000, 30000, 30000, 30000],
+        [10, 10, 10, 10],
+        types=[None, wm.EVChargerType(60000), None, None],
+    )
+
+
+def test_fastest_route():
+    """Test that the route charges only when it must"""
+    graph = _graph()
+    route = graph.fastest_route("r0", "r3", battery_capacity=100000, battery_eff=1)
+    assert [v.id for v in route.vertices] == ["r0", "r3"]
+    assert route.time == 10
+
+    route = graph.fastest_route(
+        "r0", "r3", soc=0.5, battery_capacity=100000, battery_eff=1
+    )
+    assert [v.id for v in route.vertices] == ["r0", "r1", "r2", "r3"]
+    assert route.charges == [False, True, False, False]
+    # Charging from 0.2 to 0.8 takes 60 minutes at 60 kW
+    assert np.isclose(route.time, 90)
+    assert np.isclose(route.soc, 0.2)
+
+    decisions = wm.route_decisions(route)
+    assert isinstance(decisions[1].action, wm.ChargeBatteryAction)
+    assert isinstance(decisions[2].action, wm.NullAction)
+
+    assert graph.fastest_route("r0", "r3", soc=0.2, battery_capacity=100000) is None
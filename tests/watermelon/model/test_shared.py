@@ -0,0 +1,56 @@
+"""Unittest for graphs in shared memory"""
+
+import pickle
+
+import numpy as np
+
+import watermelon as wm
+
+
+def test_attach():
+    """Test that an attached graph is a read-only copy of the original"""
+    graph = wm.Graph.from_arrays(
+        ["h0", "h1", "h2"], ["h0", "h1"], ["h1", "h2"], [1, 2], [3, 4]
+    )
+    with wm.SharedGraph.create(graph) as shared:
+        attached = pickle.loads(pickle.dumps(shared))
+        assert attached.name == shared.name
+        assert set(attached.graph.edges) == set(graph.edges)
+        assert attached.graph.travel_time("h0", "h2") == 7
+        assert not attached.graph.csr.weights.flags.writeable
+        attached.close()
+
+
+def test_graph_outlives_close():
+    """Test that a graph stays usable after its segment is closed"""
+    graph = wm.Graph.from_arrays(["h0", "h1"], ["h0"], ["h1"], [1], [3])
+    with wm.SharedGraph.create(graph) as shared:
+        attached = wm.SharedGraph.attach(shared.name)
+        view = attached.graph
+        attached.close()
+        del attached
+        assert view.travel_time("h0", "h1") == 3
+
+
+def test_attach_with_alive_vertex():
+    """Test that attaching keeps the stored vertices when others share their ids"""
+    with wm.registry_scope():
+        graph = wm.Graph.from_arrays(
+            [1, 2],
+            [1],
+            [2],
+            [1],
+            [1],
+            types=[wm.EVChargerType(50), None],
+            capacities=[2, np.nan],
+        )
+        shared = wm.SharedGraph.create(graph)
+    del graph
+
+    with shared:
+        vertex = wm.Vertex(1)
+        attached = wm.SharedGraph.attach(shared.name)
+        assert isinstance(attached.graph.vertex_at(0).type, wm.EVChargerType)
+        assert attached.graph.vertex_at(0).capacity == 2
+        assert vertex.capacity == np.inf
+        attached.close()
@@ -0,0 +1,60 @@
+"""Unittest for the binary graph format"""
+
+import numpy as np
+
+import watermelon as wm
+
+
+def test_round_trip(tmp_path):
+    """Test that a saved graph loads back the same"""
+    graph = wm.Graph.from_arrays(
+        ["s0", "s1", "s2"],
+        ["s0", "s1", "s2"],
+        ["s1", "s2", "s0"],
+        [1, None, 3],
+        [4, 5, 6],
+        types=[None, wm.EVChargerType(100), wm.MaterialLoadType(10)],
+        capacities=[np.nan, 2, np.nan],
+    )
+    path = tmp_path / "graph.wmg"
+    wm.save_graph(graph, path)
+
+    for mmap in (True, False):
+        loaded = wm.load_graph(path, mmap=mmap)
+        assert set(loaded.edges) == set(graph.edges)
+        assert loaded.get_edge("s1", "s2").weight is None
+        assert loaded.vertex_at(1).type.charge_power == 100
+        assert loaded.vertex_at(1).capacity == 2
+    assert isinstance(loaded.csr.targets, np.ndarray)
+
+    # Modifying a memory-mapped graph creates new arrays
+    loaded = wm.load_graph(path)
+    with wm.registry_scope(loaded.registry):
+        loaded.add_edge(wm.Edge(wm.Vertex("s0"), wm.Vertex("s2"), 7, 8))
+    assert loaded.num_edges == 4
+    assert wm.load_graph(path).num_edges == 3
+
+
+def test_load_with_alive_vertex(tmp_path):
+    """Test that loading keeps the stored vertices when others share their ids"""
+    with wm.registry_scope():
+        graph = wm.Graph.from_arrays(
+            [1, 2],
+            [1],
+            [2],
+            [1],
+            [1],
+            types=[wm.EVChargerType(50), None],
+            capacities=[2, np.nan],
+        )
+        path = tmp_path / "graph.wmg"
+        wm.save_graph(graph, path)
+    del graph
+
+    vertex = wm.Vertex(1)
+    loaded = wm.load_graph(path)
+    assert isinstance(loaded.vertex_at(0).type, wm.EVChargerType)
+    assert loaded.vertex_at(0).capacity == 2
+    assert vertex.capacity == np.inf
+    with wm.registry_scope(loaded.registry):
+        assert wm.Vertex(1) is loaded.vertex_at(0)
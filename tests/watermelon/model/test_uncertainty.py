@@ -0,0 +1,54 @@
+"""Unittest for the uncertainty sources"""
+
+import numpy as np
+
+import watermelon as wm
+
+
+def test_block_sampling():
+    """Test that samples don't depend on how they are taken"""
+    source = wm.GaussianUncertainty(std=0.1, seed=3, block_size=7)
+    expected = [source.sample() for _ in range(30)]
+    assert source.last == expected[-1]
+
+    source.seed(3)
+    samples = [*source.sample_array(3), source.sample(), *source.sample_array(20)]
+    samples += [source.sample() for _ in range(6)]
+    assert np.array_equal(samples, expected)
+
+    # Sources have their own streams
+    other = wm.GaussianUncertainty(std=0.1, seed=3)
+    wm.GaussianUncertainty(std=0.1).sample_array(10)
+    assert np.array_equal(other.sample_array(30), expected)
+    assert not wm.NoUncertainty().sample_array(4).any()
+
+
+def test_state():
+    """Test that a source continues the same after restoring its state"""
+    source = wm.GaussianUncertainty(seed=1, block_size=5)
+    source.sample_array(3)
+    state = source.getstate()
+    expected = source.sample_array(12)
+    source.sample()
+    source.setstate(state)
+    assert np.array_equal(source.sample_array(12), expected)
+
+    # The block of samples is drawn again instead of being stored
+    source = wm.GaussianUncertainty(seed=1)
+    source.sample()
+    state = source.getstate()
+    assert "_block" not in state
+    expected = source.sample_array(5000)
+    source.setstate(state)
+    assert np.array_equal(source.sample_array(5000), expected)
+
+
+def test_parameter_changes():
+    """Test that changes to the parameters apply to the next sample"""
+    source = wm.GaussianUncertainty(std=0.1, seed=2)
+    reference = wm.GaussianUncertainty(std=0.1, seed=2)
+    assert source.sample() == reference.sample()
+    source.mean, source.std = 10, 0
+    assert source.sample() == 10
+    assert np.all(source.sample_array(3) == 10)
+    assert source.last == 10
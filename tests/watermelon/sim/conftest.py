@@ -0,0 +1,67 @@
+"""Fixtures for the tests of the simulator"""
+
+import numpy as np
+import pytest
+
+import watermelon as wm
+
+
+def build_scenario(std: float = None):
+    """Two agents that go through a charger with capacity for one of them,
+    with a Gaussian uncertainty source of the given deviation if any
+    """
+    graph = wm.Graph.from_arrays(
+        ["t0", "t1", "t2"],
+        ["t0", "t1", "t2"],
+        ["t1", "t2", "t0"],
+        [10000, 10000, 10000],
+        [2, 3, 4],
+        types=[None, wm.EVChargerType(50000), None],
+        capacities=[np.nan, 1, np.nan],
+    )
+    agents = [
+        wm.Agent(
+            f"t-agent{i}",
+            graph,
+            [
+                wm.Decision(wm.Vertex("t0"), wm.NullAction()),
+                wm.Decision(wm.Vertex("t1"), wm.ChargeBatteryAction(0.9)),
+                wm.Decision(wm.Vertex("t2"), wm.WaitAction(1)),
+                wm.Decision(wm.Vertex("t0"), wm.NullAction()),
+            ],
+            initial_state=wm.AgentState(_soc=0.5),
+        )
+        for i in range(2)
+    ]
+    if std is not None:
+        for agent in agents:
+            agent.uncertainty = wm.GaussianUncertainty(std=std)
+    return graph, agents
+
+
+def run_simulation(sim, stop_time: float = 200):
+    """Run a simulation from the start, and return its records as strings"""
+    sim.start(stop_time)
+    while not sim.should_close:
+        sim.update()
+    return [[str(x) for x in row] for row in sim.data_extractor.data.values]
+
+
+@pytest.fixture
+def scenario():
+    """Graph and agents of the scenario"""
+    return build_scenario()
+
+
+@pytest.fixture
+def make_scenario():
+    """Function that builds the scenario, for tests that need it more than
+    once or in other processes
+    """
+    return build_scenario
+
+
+@pytest.fixture
+def run():
+    """Function that runs a simulation and returns its records"""
+    return run_simulation
@@ -0,0 +1,153 @@
+"""Unittest for the data extractors"""
+
+import functools
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import watermelon as wm
+
+
+def test_columnar_extractor(scenario, run):
+    """Test that the columnar extractor records the same states"""
+    graph, agents = scenario
+    sim = wm.sim.Simulator(graph, agents, delta=0.1)
+    run(sim)
+    expected = sim.data_extractor.data
+    sim = wm.sim.Simulator(
+        graph, agents, delta=0.1, data_extractor_cls=wm.sim.ColumnarExtractor
+    )
+    run(sim)
+    data = sim.data_extractor.data
+
+    # Buffers must have grown past their initial size
+    assert len(data) == len(expected) > wm.sim.ColumnarExtractor.INITIAL_CAPACITY
+    assert np.array_equal(data.index, expected["time"])
+    for a in agents:
+        states = [e.state for e in expected[a]]
+        assert np.array_equal(data[a]["soc"], [s.soc for s in states])
+        assert np.array_equal(data[a]["done"], [s.is_done for s in states])
+        assert list(data[a]["vertex"].iloc[[0, -1]]) == ["t0", "t0"]
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_streaming_extractor(tmp_path, background, scenario, run):
+    """Test that the streaming extractor writes every row in chunks"""
+    graph, agents = scenario
+    sim = wm.sim.Simulator(
+        graph, agents, delta=0.5, data_extractor_cls=wm.sim.ColumnarExtractor
+    )
+    run(sim)
+    expected = sim.data_extractor.data
+    extractor_cls = functools.partial(
+        wm.sim.StreamingExtractor, path=tmp_path, chunk_size=50, background=background
+    )
+    sim = wm.sim.Simulator(graph, agents, delta=0.5, data_extractor_cls=extractor_cls)
+    sim.start(200)
+    while not sim.should_close:
+        sim.update()
+    reader = sim.data_extractor.data
+
+    assert len(reader) == -(-2 * len(expected) // 50)
+    data = reader.read(agents=[agents[1].id])
+    assert np.array_equal(data["time"], expected.index)
+    assert np.allclose(data["soc"], expected[agents[1]]["soc"])
+    assert list(data["vertex"].iloc[[0, -1]]) == ["t0", "t0"]
+
+    data = reader.read(start=10, stop=20)
+    assert data["time"].between(10, 20, inclusive="left").all()
+    assert len(data) == 2 * 20
+
+    # Only resuming a checkpoint of the stream deletes the chunks after it
+    state, _ = sim.data_extractor.checkpoint()
+    state._num_chunks = 1
+    state = pickle.loads(pickle.dumps(state))
+    assert len(reader) == -(-2 * len(expected) // 50)
+    state.resume([])
+    assert len(reader) == 1
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_streaming_branches(tmp_path, background, scenario):
+    """Test that forks and snapshots of a stream continue from its chunks"""
+    graph, agents = scenario
+    plan = list(agents[0].actions)
+    plan[2] = wm.Decision(wm.Vertex("t2"), wm.WaitAction(5))
+
+    def stream(name):
+        return functools.partial(
+            wm.sim.StreamingExtractor,
+            path=tmp_path / name,
+            chunk_size=30,
+            background=background,
+        )
+
+    def finish(sim):
+        while not sim.should_close:
+            sim.update()
+        return sim.data_extractor.data.read()
+
+    sim = wm.sim.Simulator(graph, agents, delta=0.5, data_extractor_cls=stream("a"))
+    sim.start(200)
+    expected = finish(sim)
+    sim.start(200)
+    sim.set_plan(agents[0], plan)
+    expected_branch = finish(sim)
+
+    sim = wm.sim.Simulator(graph, agents, delta=0.5, data_extractor_cls=stream("b"))
+    sim.start(200)
+    while sim.time < 20:
+        sim.update()
+    snapshot = sim.snapshot()
+    branch = sim.fork({agents[0]: plan})
+    pd.testing.assert_frame_equal(finish(branch), expected_branch)
+    pd.testing.assert_frame_equal(finish(sim), expected)
+    for _ in range(2):
+        sim.restore(snapshot)
+        pd.testing.assert_frame_equal(finish(sim), expected)
+
+
+def test_summary_extractor(scenario):
+    """Test the summary of each agent"""
+    graph, agents = scenario
+    sim = wm.sim.Simulator(
+        graph, agents, engine="event", data_extractor_cls=wm.sim.SummaryExtractor
+    )
+    sim.start(200)
+    while not sim.should_close:
+        sim.update()
+    first, second = (sim.data_extractor.data[a] for a in agents)
+
+    assert (first.finish_time, second.finish_time) == (58, 106)
+    assert not first.out_of_charge and not second.out_of_charge
+    # The second agent waits for the first one to charge
+    assert first.waiting_time == 0 and second.waiting_time == 48
+    assert first.min_soc == pytest.approx(0.5 - 10000 / 75000)
+    assert first.energy_used == pytest.approx(3 * 10000)
+    assert first.energy_charged == pytest.approx((0.9 - first.min_soc) * 75000)
+
+
+def test_change_extractor(scenario, run):
+    """Test that trajectories reconstruct the state at every step"""
+    graph, agents = scenario
+    sim = wm.sim.Simulator(
+        graph, agents, delta=0.1, data_extractor_cls=wm.sim.ColumnarExtractor
+    )
+    run(sim)
+    expected = sim.data_extractor.data
+    sim = wm.sim.Simulator(
+        graph, agents, delta=0.1, data_extractor_cls=wm.sim.ChangeExtractor
+    )
+    sim.start(200)
+    while not sim.should_close:
+        sim.update()
+
+    for a in agents:
+        trajectory = sim.data_extractor.data[a]
+        assert len(trajectory) < len(expected) / 20
+        states = trajectory.at(expected.index)
+        assert np.allclose(states["soc"], expected[a]["soc"])
+        for field in ("action", "vertex", "waiting", "done", "out_of_charge"):
+            assert np.array_equal(states[field], expected[a][field])
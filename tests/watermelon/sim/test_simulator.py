@@ -0,0 +1,494 @@
+"""Unittest for the simulator"""
+
+import functools
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import watermelon as wm
+from watermelon_common.logger import LOGGER, fast_logging
+
+
+def test_independent_runs(scenario, run):
+    """Test that simulators don't share the state of agents and vertices"""
+    graph, agents = scenario
+    expected = run(wm.sim.Simulator(graph, agents, delta=0.1))
+    assert all(a.state.soc == 0.5 for a in agents)
+
+    # Interleave two simulators over the same agents
+    sims = [wm.sim.Simulator(graph, agents, delta=0.1) for _ in range(2)]
+    for sim in sims:
+        sim.start(200)
+    while not all(sim.should_close for sim in sims):
+        for sim in sims:
+            if not sim.should_close:
+                sim.update()
+    for sim in sims:
+        assert [[str(x) for x in row] for row in sim.data_extractor.data.values] == expected
+        assert all(s.is_done for s in sim.states.values())
+
+
+def _finish_times(sim):
+    data = sim.data_extractor.data
+    return {
+        a: next(t for t, e in zip(data["time"], data[a]) if e.state.is_done)
+        for a in sim.agents
+    }
+
+
+def test_event_engine(scenario, run):
+    """Test that the event engine matches the step engine"""
+    graph, agents = scenario
+    step = wm.sim.Simulator(graph, agents, delta=0.1)
+    event = wm.sim.Simulator(graph, agents, engine="event")
+    run(step)
+    run(event)
+
+    # The second agent waits until the first one leaves the charger
+    assert _finish_times(event) == {agents[0]: 58, agents[1]: 106}
+    for a, t in _finish_times(step).items():
+        assert abs(t - _finish_times(event)[a]) < 0.5
+        assert abs(step.states[a].soc - event.states[a].soc) < 1e-9
+    assert len(event.data_extractor.data) < 20
+
+
+def test_vector_engine(scenario, run):
+    """Test that the vector engine gives the same records as the step engine"""
+    graph, agents = scenario
+    expected = run(wm.sim.Simulator(graph, agents, delta=0.5))
+    assert run(wm.sim.Simulator(graph, agents, delta=0.5, engine="vector")) == expected
+
+
+def test_queues(scenario, run):
+    """Test that agents that wait for a vertex are let in by the admission
+    policy
+    """
+    graph, agents = scenario
+    sim = wm.sim.Simulator(
+        graph,
+        agents,
+        engine="event",
+        admission=wm.sim.PriorityAdmission(lambda a: a.id != "t-agent1"),
+    )
+    run(sim)
+    assert _finish_times(sim) == {agents[1]: 58, agents[0]: 106}
+
+    # Agents get in by order of arrival, even with more than one waiting
+    with wm.registry_scope():
+        extra = wm.Agent(
+            "t-agent2",
+            graph,
+            agents[0].actions,
+            initial_state=wm.AgentState(_soc=0.5),
+        )
+    agents = [extra, *agents]
+    sim = wm.sim.Simulator(graph, agents, engine="event")
+    run(sim)
+    assert list(_finish_times(sim).values()) == [58, 106, 154]
+    expected = run(wm.sim.Simulator(graph, agents, delta=0.5))
+    assert run(wm.sim.Simulator(graph, agents, delta=0.5, engine="vector")) == expected
+
+
+def test_timer_wheel():
+    """Test that the timer wheel gives back every item at its step"""
+    rng = np.random.default_rng(0)
+    wheel = wm.sim.TimerWheel(slots=4, levels=2)
+    expected = {}
+    for item, tick in enumerate(rng.integers(1, 100, 200).tolist()):
+        wheel.schedule(item, tick)
+        expected.setdefault(tick, []).append(item)
+    for tick in range(1, 100):
+        assert sorted(wheel.advance()) == expected.get(tick, [])
+    with pytest.raises(ValueError):
+        wheel.schedule(0, wheel.tick)
+
+
+@pytest.mark.parametrize("engine", ["step", "vector"])
+def test_dormant_agents(scenario, engine):
+    """Test that agents whose action time is only written when it is read end
+    up in the same states as when they are updated at every step
+    """
+    graph, agents = scenario
+    step = wm.sim.Simulator(graph, agents, delta=0.1)
+    summary = wm.sim.Simulator(
+        graph,
+        agents,
+        delta=0.1,
+        engine=engine,
+        data_extractor_cls=wm.sim.SummaryExtractor,
+    )
+    for sim in (step, summary):
+        sim.start(200)
+    while not step.should_close:
+        step.update()
+        summary.update()
+        if step.control.iteration % 50 == 0:
+            # Parked agents get their action time when it is read
+            assert summary.snapshot().context.states == step.states
+    assert summary.should_close
+    assert summary.states == step.states
+    finish_times = {a: s.finish_time for a, s in summary.data_extractor.data.items()}
+    assert finish_times == _finish_times(step)
+
+
+def test_trace_hooks(scenario, run):
+    """Test that every engine gives the same events to the trace hooks"""
+    graph, agents = scenario
+    traces = {}
+    for engine in ("step", "event", "vector"):
+        events = []
+        sim = wm.sim.Simulator(
+            graph, agents, delta=0.5, engine=engine, trace_hooks=[events.append]
+        )
+        run(sim)
+        traces[engine] = {
+            a: [(e.kind, e.action) for e in events if e.agent is a] for a in agents
+        }
+        assert [e.kind for e in events if e.agent is agents[1]][:5] == [
+            wm.sim.COMPLETED,
+            wm.sim.ARRIVED,
+            wm.sim.WAITING,
+            wm.sim.STARTED,
+            wm.sim.COMPLETED,
+        ]
+    assert traces["step"] == traces["event"] == traces["vector"]
+
+
+def test_fast_logging(scenario, run):
+    """Test that the fast logging mode removes the logs of the agents"""
+    records = []
+    handler = logging.Handler(logging.DEBUG)
+    handler.emit = records.append
+    LOGGER.addHandler(handler)
+    try:
+        graph, agents = scenario
+        for engine in ("step", "event", "vector"):
+            records.clear()
+            sim = wm.sim.Simulator(
+                graph, agents, delta=0.5, engine=engine, fast_logging=True
+            )
+            run(sim)
+            assert not [r for r in records if r.levelno < logging.WARNING][1:]
+            records.clear()
+            with fast_logging():
+                run(wm.sim.Simulator(graph, agents, delta=0.5, engine=engine))
+            assert not [r for r in records if r.levelno < logging.WARNING][1:]
+            records.clear()
+            with fast_logging():
+                sim = wm.sim.Simulator(
+                    graph, agents, delta=0.5, engine=engine, fast_logging=False
+                )
+                run(sim)
+            assert any("finished" in r.getMessage() for r in records)
+    finally:
+        LOGGER.removeHandler(handler)
+
+
+def test_batch(scenario, run):
+    """Test that a batch gives the same results as separate simulations"""
+    graph, agents = scenario
+    t0, t1, t2 = wm.Vertex("t0"), wm.Vertex("t1"), wm.Vertex("t2")
+    population = [
+        [a.actions for a in agents],
+        [
+            [wm.Decision(t0, wm.NullAction()), wm.Decision(t1, wm.ChargeBatteryAction(l))]
+            for l in (0.6, 0.7)
+        ],
+        # Going around without charging runs out of charge
+        [[wm.Decision(v, wm.NullAction()) for v in (t0, t1, t2, t0, t1, t2)]] * 2,
+    ]
+    result = wm.sim.simulate_batch(graph, agents, population, delta=0.5, stop_time=200)
+
+    for plans, times, ooc in zip(population, result.finish_times, result.out_of_charge):
+        with wm.registry_scope():
+            batch_agents = [
+                wm.Agent(a.id, graph, p, initial_state=a.state.copy())
+                for a, p in zip(agents, plans)
+            ]
+        sim = wm.sim.Simulator(graph, batch_agents, delta=0.5)
+        run(sim)
+        finish = _finish_times(sim) if all(s.is_done for s in sim.states.values()) else {}
+        for i, a in enumerate(batch_agents):
+            assert ooc[i] == sim.states[a].out_of_charge
+            if a in finish:
+                assert abs(times[i] - finish[a]) < 1e-9
+            else:
+                assert np.isnan(times[i])
+    assert result.out_of_charge[2].all() and result.finished[:2].all()
+
+
+def test_stop_conditions(scenario, run):
+    """Test that stop conditions close the simulation early"""
+    graph, agents = scenario
+    sim = wm.sim.Simulator(
+        graph, agents, engine="event", stop_conditions=[wm.sim.TotalTimeBound(150)]
+    )
+    run(sim)
+    # The first agent finishes at 58, so the bound is passed after 92, at
+    # the next event
+    assert isinstance(sim.stopped_by, wm.sim.TotalTimeBound)
+    assert sim.time == 98 and not all(s.is_done for s in sim.states.values())
+
+    sim = wm.sim.Simulator(
+        graph, agents, engine="event", stop_conditions=[lambda s: s.time > 10]
+    )
+    run(sim)
+    assert isinstance(sim.stopped_by, wm.sim.Callback) and sim.time == 50
+
+    # Without charging, the agents run out of charge in the second lap
+    plan = [wm.Decision(wm.Vertex(v), wm.NullAction()) for v in ["t0", "t1", "t2"] * 3]
+    with wm.registry_scope():
+        agent = wm.Agent("t-agent", graph, plan, initial_state=wm.AgentState(_soc=0.5))
+    sim = wm.sim.Simulator(
+        graph, [agent], delta=0.5, stop_conditions=[wm.sim.AnyOutOfCharge()]
+    )
+    run(sim)
+    assert isinstance(sim.stopped_by, wm.sim.AnyOutOfCharge)
+    assert sim.states[agent].out_of_charge and sim.time < 20
+
+
+def _records(sim):
+    while not sim.should_close:
+        sim.update()
+    return [[str(x) for x in row] for row in sim.data_extractor.data.values]
+
+
+def test_fork(scenario):
+    """Test that branches of a simulation match runs from the start"""
+    graph, agents = scenario
+    plan = list(agents[0].actions)
+    plan[2] = wm.Decision(wm.Vertex("t2"), wm.WaitAction(5))
+
+    for engine in ("step", "event", "vector"):
+        sim = wm.sim.Simulator(graph, agents, delta=0.5, engine=engine)
+        sim.start(200)
+        sim.set_plan(agents[0], plan)
+        expected = _records(sim)
+
+        sim.start(200)
+        while sim.time < 20:
+            sim.update()
+        snapshot = sim.snapshot()
+        branch = sim.fork({agents[0]: plan})
+        assert _records(branch) == expected
+        assert agents[0].actions[2].action.time == 1
+
+        # The original run is not affected, and can be restored many times
+        original = _records(sim)
+        assert original != expected
+        for _ in range(2):
+            sim.restore(snapshot)
+            assert _records(sim) == original
+
+
+def test_checkpoint(tmp_path, make_scenario):
+    """Test that a resumed simulation continues exactly like the original"""
+    with wm.registry_scope():
+        graph, agents = make_scenario()
+    for agent in agents:
+        agent.uncertainty = wm.GaussianUncertainty(std=0.01)
+    path = str(tmp_path / "run.ckpt")
+    # Lambdas can't be pickled, so these are stored by reference
+    options = {
+        "stop_conditions": [wm.sim.TotalTimeBound(1e6), lambda sim: False],
+        "admission": wm.sim.PriorityAdmission(lambda agent: -agent.soc),
+    }
+
+    for engine in ("step", "event", "vector"):
+        sim = wm.sim.Simulator(
+            graph,
+            agents,
+            delta=0.5,
+            engine=engine,
+            checkpointer=wm.sim.Checkpointer(path, every=2),
+            **options,
+        )
+        sim.start(200)
+        while sim.control.iteration < 6:
+            sim.update()
+        sim.checkpointer.close()
+        sim.checkpointer = None
+        expected = _records(sim)
+
+        resumed = wm.sim.Simulator.resume(path, graph, agents, **options)
+        assert resumed.control.iteration == 5
+        assert _records(resumed) == expected
+
+    with pytest.raises(wm.exceptions.InvalidCheckpointException):
+        wm.sim.Simulator.resume(path, graph, agents)
+    with pytest.raises(wm.exceptions.InvalidCheckpointException):
+        wm.sim.Simulator.resume(
+            path, graph, agents, stop_conditions=options["stop_conditions"]
+        )
+
+    with open(path, "wb") as file:
+        file.write(b"not a checkpoint")
+    with pytest.raises(wm.exceptions.InvalidCheckpointException):
+        wm.sim.Simulator.resume(path, graph, agents)
+
+
+def _extracted(sim):
+    while not sim.should_close:
+        sim.update()
+    data = sim.data_extractor.data
+    if isinstance(data, wm.sim.ChunkReader):
+        data = data.read()
+    if isinstance(data, pd.DataFrame):
+        return list(data.index), data.astype(str).values.tolist()
+    return {str(a.id): str(vars(v)) for a, v in data.items()}
+
+
+@pytest.mark.parametrize(
+    "extractor",
+    ["DataFrameExtractor", "ColumnarExtractor", "SummaryExtractor", "ChangeExtractor"]
+    + ["StreamingExtractor"],
+)
+def test_incremental_checkpoints(tmp_path, scenario, extractor):
+    """Test that checkpoints that only store the new data resume every
+    extractor, from the same checkpoint file or from another one
+    """
+    graph, agents = scenario
+    extractor_cls = getattr(wm.sim, extractor)
+    if extractor == "StreamingExtractor":
+        extractor_cls = functools.partial(
+            extractor_cls, path=tmp_path / "stream", chunk_size=30
+        )
+    first, second = str(tmp_path / "first.ckpt"), str(tmp_path / "second.ckpt")
+
+    def run_until(sim, iteration):
+        while sim.control.iteration < iteration:
+            sim.update()
+        sim.checkpointer.close()
+        sim.checkpointer = None
+
+    sim = wm.sim.Simulator(
+        graph,
+        agents,
+        delta=0.5,
+        data_extractor_cls=extractor_cls,
+        checkpointer=wm.sim.Checkpointer(first, every=3),
+    )
+    sim.start(200)
+    run_until(sim, 20)
+    expected = _extracted(sim)
+
+    checkpointer = wm.sim.Checkpointer(second, every=3)
+    resumed = wm.sim.Simulator.resume(first, graph, agents, checkpointer=checkpointer)
+    assert resumed.control.iteration == 19
+    run_until(resumed, 40)
+    assert _extracted(resumed) == expected
+
+    checkpointer = wm.sim.Checkpointer(second, every=3)
+    resumed = wm.sim.Simulator.resume(second, graph, agents, checkpointer=checkpointer)
+    assert resumed.control.iteration == 38
+    run_until(resumed, 50)
+    assert _extracted(resumed) == expected
+    state = wm.sim.load_checkpoint(second, graph, agents)
+    if extractor not in ("SummaryExtractor", "StreamingExtractor"):
+        assert len(state["data"]) > 2
+
+
+def test_monte_carlo(make_scenario):
+    """Test that Monte Carlo studies don't depend on the number of workers"""
+    results = [
+        wm.sim.run_monte_carlo(
+            functools.partial(make_scenario, std=0.01),
+            6,
+            seed=7,
+            workers=w,
+            stop_time=200,
+            delta=0.5,
+            keep_samples=keep,
+        )
+        for w, keep in ((1, True), (2, True), (2, False))
+    ]
+    assert np.array_equal(results[0].finish_time, results[1].finish_time)
+    assert np.array_equal(results[0].final_soc, results[1].final_soc)
+    assert results[0].finish_time.shape == (6, 2)
+    # Every replication and agent gets its own stream
+    assert len(np.unique(results[0].final_soc)) == 12
+
+    summary = results[0].summary()
+    assert summary.loc[("final_soc", "t-agent0"), "count"] == 6
+    row = summary.loc[("finish_time", "t-agent1")]
+    assert row["ci_low"] <= row["mean"] <= row["ci_high"]
+    assert row["mean"] == pytest.approx(np.nanmean(results[0].finish_time[:, 1]))
+
+    # Without the samples, the statistics are running ones
+    assert not results[2].has_samples
+    streamed = results[2].summary()
+    pd.testing.assert_frame_equal(
+        streamed[["count", "mean", "std"]], summary[["count", "mean", "std"]]
+    )
+    assert (streamed["q0.05"] <= streamed["q0.5"]).all()
+    assert (streamed["q0.5"] <= streamed["q0.95"]).all()
+    assert results[0].summary(quantiles=[0.25])["q0.25"].notna().all()
+    with pytest.raises(ValueError):
+        results[2].summary(quantiles=[0.25])
+
+
+def test_compiled_plans(scenario):
+    """Test that plans are compiled into the kinds of their actions"""
+    graph, agents = scenario
+    plans = wm.sim.CompiledPlans(graph, agents, [a.actions for a in agents])
+    assert plans.offsets.tolist() == [0, 4, 8]
+    assert plans.code[:4].tolist() == [
+        plans.CONSTANT,
+        plans.CHARGE,
+        plans.CONSTANT,
+        plans.CONSTANT,
+    ]
+    assert np.isnan(plans.edge_time[0]) and plans.edge_time[1:4].tolist() == [2, 3, 4]
+
+    # Forbidden actions only fail once an agent gets to them
+    plan = list(agents[0].actions)
+    plan[1] = wm.Decision(wm.Vertex("t1"), wm.LoadMaterialAction())
+    sim = wm.sim.Simulator(graph, agents, delta=0.5)
+    sim.start(200)
+    sim.set_plan(agents[0], plan)
+    assert sim.engine.plans.code[1] == plans.FORBIDDEN
+    sim.update()
+    with pytest.raises(wm.exceptions.ForbiddenActionException):
+        while not sim.should_close:
+            sim.update()
+    assert sim.time > 2
+
+
+def test_analytic(make_scenario):
+    """Test that closed-form schedules match the event engine"""
+    graph, agents = make_scenario()
+    # The second agent waits for the charger, so the run must be simulated
+    assert wm.sim.solve_analytic(graph, agents, stop_time=200) is None
+    result = wm.sim.evaluate_schedule(graph, agents, stop_time=200)
+    assert not result.analytic
+    assert list(result.finish_times) == [58, 106]
+
+    # Without the second agent nobody waits
+    plans = [list(agents[0].actions), [wm.Decision(wm.Vertex("t0"), wm.NullAction())]]
+    for stop_time in (200, 30):
+        result = wm.sim.evaluate_schedule(graph, agents, plans, stop_time=stop_time)
+        assert result.analytic
+        sim = wm.sim.Simulator(
+            graph, agents, engine="event", data_extractor_cls=wm.sim.SummaryExtractor
+        )
+        sim.start(stop_time, plans=dict(zip(agents, plans)))
+        while not sim.should_close:
+            sim.update()
+        summaries = [sim.data_extractor.data[a] for a in agents]
+        assert [s.finish_time for s in summaries] == [
+            None if np.isnan(t) else t for t in result.finish_times
+        ]
+        assert list(result.soc) == [sim.states[a].soc for a in agents]
+
+    # Running out of charge
+    with wm.registry_scope():
+        graph, agents = make_scenario()
+        agents[0].state.soc = 0.01
+        plans[1] = [wm.Decision(wm.Vertex("t0"), wm.NullAction())]
+        result = wm.sim.solve_analytic(
+            graph, agents, [agents[0].actions, plans[1]], stop_time=200
+        )
+    assert list(result.out_of_charge) == [True, False]
+    assert result.out_of_charge_times[0] == 2